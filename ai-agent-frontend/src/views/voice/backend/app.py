@@ -1,14 +1,40 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, has_request_context, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-from whisper_engine import speech_to_text
-from tts_engine import text_to_speech
+from whisper_engine import transcribe, parse_decode_options, swap_model, current_model_name
+from tts_engine import text_to_speech, engine_used, synthesize_stream, swap_voice, voice_manager, tts_health, OUTPUT_PATH
+from text_frontend import phoneme_cache, first_sentences
 from llm_client import call_local_llm
+from audio_utils import (convert_audio_to_wav, decode_audio_stream, is_raw_audio_request, AudioUploadTooLarge,
+                         InvalidAudioFormat, wav_duration)
+from cancellation import CancellationRegistry, JobCancelled
+from speculation import SpeculativeLLM
+from voice_channel import VoiceChannel
+from job_store import create_job_store, new_result_id, result_owner, INSTANCE_ID
+from conversation_store import ConversationStore
+from scheduler import JobScheduler, RateLimiter, INTERACTIVE, BATCH, PRIORITY_CLASSES
+from overload import OverloadController
+from profiling import SamplingProfiler, RequestProfiles, MemoryTracker, ProfilerBusy
+from semantic_cache import SemanticCache
+from transcript_cache import TranscriptCache, content_key, file_chunks
+import requests
 import os
+import io
+import json
+import atexit
+import re
+import hashlib
+import hmac
+import zipfile
 import logging
 import threading
-import uuid
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
+import time
+import math
+
+try:
+    from flask_sock import Sock
+    SOCK_AVAILABLE = True
+except ImportError:
+    SOCK_AVAILABLE = False
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,129 +62,97 @@ if os.getenv("CORS_ORIGINS"):
 
 CORS(app, origins=cors_origins)
 
-# 创建线程池以更好地管理线程
-thread_pool = ThreadPoolExecutor(max_workers=4)
+# 任务调度：interactive 优先于 batch，同一分类内按客户端公平排队、短音频优先
+scheduler = JobScheduler.from_env()
+
+# 过载保护：根据队列深度和各阶段耗时逐级降级，当前等级通过 /health 和每个响应的
+# X-Degradation-Level / X-Degradation-Mode 响应头公布
+overload = OverloadController.from_env(scheduler.queued, workers=scheduler.max_workers)
+
+# 按客户端限流，超出时返回 429（默认关闭，RATE_LIMIT_PER_MINUTE > 0 时开启）
+rate_limiter = RateLimiter.from_env()
+RATE_LIMITED_ENDPOINTS = {"handle_audio", "speech_stream", "call_llm", "handle_text", "handle_tts",
+                          "handle_tts_batch"}
+# 流式识别每一两秒就上传一个分块，每块只消耗少量令牌
+RATE_LIMIT_COSTS = {"speech_stream": float(os.getenv("RATE_LIMIT_STREAM_COST", "0.1"))}
+
+# 未指定优先级时，超过该时长的录音按 batch 调度
+BATCH_AUDIO_SECONDS = float(os.getenv("SCHEDULER_BATCH_AUDIO_SECONDS", "60"))
 
-# 存储异步任务的结果
-async_results = {}
+# 存储异步任务的结果；多实例部署时使用共享存储（JOB_STORE=sqlite/redis），任何实例都能回答状态查询
+async_results = create_job_store()
 
-def convert_audio_to_wav(input_path: str, output_path: str):
+# 对话记录（识别文本、提问、回复）先入队，由后台线程批量写入，不增加请求延迟
+conversations = ConversationStore.from_env()
+atexit.register(conversations.close)
+
+def record_conversation(cancel_token, kind, text, job_id=None, **meta):
     """
-    使用 ffmpeg 将音频文件转换为 WAV 格式
+    记录对话；写入失败不影响请求本身
     """
     try:
-        logger.info("开始转换音频文件: %s -> %s", input_path, output_path)
-        
-        # 检查输入文件是否存在
-        if not os.path.exists(input_path):
-            raise Exception(f"输入文件不存在: {input_path}")
-        
-        # 检查文件大小
-        file_size = os.path.getsize(input_path)
-        logger.info("输入文件大小: %d bytes", file_size)
-        
-        if file_size == 0:
-            raise Exception("输入文件为空")
-        
-        # 使用 ffmpeg 转换音频格式，添加更多参数提高兼容性
-        cmd = [
-            'ffmpeg',
-            '-i', input_path,           # 输入文件
-            '-f', 'wav',                # 强制输出格式为 WAV
-            '-acodec', 'pcm_s16le',     # 音频编码：16位PCM
-            '-ar', '16000',             # 采样率：16kHz
-            '-ac', '1',                 # 单声道
-            '-avoid_negative_ts', 'make_zero',  # 避免负时间戳
-            '-fflags', '+genpts',       # 生成时间戳
-            '-max_muxing_queue_size', '1024',  # 增加缓冲区大小
-            '-y',                       # 覆盖输出文件
-            output_path
-        ]
-        
-        logger.info("执行 ffmpeg 命令: %s", ' '.join(cmd))
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            logger.info("音频转换成功: %s", output_path)
-            # 检查输出文件是否生成
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                logger.info("输出文件大小: %d bytes", os.path.getsize(output_path))
-            else:
-                raise Exception("输出文件生成失败或为空")
-        else:
-            logger.error("音频转换失败，返回码: %d", result.returncode)
-            logger.error("stderr: %s", result.stderr)
-            logger.error("stdout: %s", result.stdout)
-            
-            # 尝试备用转换方案
-            logger.info("尝试备用转换方案...")
-            if _try_fallback_conversion(input_path, output_path):
-                logger.info("备用转换方案成功")
-                return
-            else:
-                raise Exception(f"ffmpeg 转换失败 (返回码: {result.returncode}): {result.stderr}")
-            
-    except subprocess.TimeoutExpired:
-        logger.error("音频转换超时")
-        raise Exception("音频转换超时")
-    except FileNotFoundError:
-        logger.error("ffmpeg 未找到，请确保已安装 ffmpeg")
-        raise Exception("ffmpeg 未安装")
+        conversations.record(cancel_token.session_id if cancel_token else None, kind, text,
+                             job_id=job_id, **meta)
     except Exception as e:
-        logger.error("音频转换异常: %s", e)
-        raise Exception(f"音频转换失败: {str(e)}")
+        logger.warning("对话记录失败: %s", e)
+
+# 合成的音频以任务ID命名，文件名中带有所属实例，其他实例据此转发音频请求
+AUDIO_DIR = os.path.dirname(OUTPUT_PATH)
+
+# 语义问答缓存（SEMANTIC_CACHE=1 开启）：相似的问题直接返回已有回答和预先合成的音频
+def synthesize_cached_answer(answer, key):
+    path = text_to_speech(answer, os.path.join(AUDIO_DIR, f"{INSTANCE_ID}.answer_{key}.wav"))
+    if engine_used() != "piper":
+        # 回退引擎的音频（pyttsx3、提示音）只是临时替代，不能在缓存里长期复用
+        os.remove(path)
+        raise RuntimeError(f"TTS 回退到了 {engine_used()}，不缓存音频")
+    return f"/static/{os.path.basename(path)}"
 
-def _try_fallback_conversion(input_path: str, output_path: str) -> bool:
+semantic_cache = SemanticCache.from_env(
+    synthesize=synthesize_cached_answer,
+    submit=lambda func, *args: scheduler.schedule(func, *args, priority=BATCH, client_id="semantic-cache")
+)
+
+def cached_answer(user_text):
     """
-    尝试备用音频转换方案
+    查询语义缓存，命中时返回缓存条目，未开启或出错时返回 None
     """
+    if semantic_cache is None:
+        return None
     try:
-        logger.info("尝试备用转换方案: %s -> %s", input_path, output_path)
-        
-        # 备用方案1：使用更宽松的参数
-        fallback_cmd = [
-            'ffmpeg',
-            '-i', input_path,
-            '-f', 'wav',
-            '-acodec', 'pcm_s16le',
-            '-ar', '16000',
-            '-ac', '1',
-            '-y',
-            output_path
-        ]
-        
-        logger.info("执行备用ffmpeg命令: %s", ' '.join(fallback_cmd))
-        result = subprocess.run(fallback_cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info("备用转换成功，输出文件大小: %d bytes", os.path.getsize(output_path))
-            return True
-        
-        # 备用方案2：尝试不同的编码器
-        fallback_cmd2 = [
-            'ffmpeg',
-            '-i', input_path,
-            '-f', 'wav',
-            '-acodec', 'pcm_u8',  # 使用8位PCM
-            '-ar', '16000',
-            '-ac', '1',
-            '-y',
-            output_path
-        ]
-        
-        logger.info("尝试8位PCM编码: %s", ' '.join(fallback_cmd2))
-        result2 = subprocess.run(fallback_cmd2, capture_output=True, text=True, timeout=30)
-        
-        if result2.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info("8位PCM转换成功，输出文件大小: %d bytes", os.path.getsize(output_path))
-            return True
-        
-        logger.error("所有备用转换方案都失败了")
-        return False
-        
+        return semantic_cache.lookup(user_text)
     except Exception as e:
-        logger.error("备用转换异常: %s", e)
-        return False
+        logger.warning("语义缓存查询失败: %s", e)
+        return None
+
+def remember_answer(user_text, reply, max_tokens=None):
+    # call_local_llm 失败时也会返回以"（"开头的提示文本，不能缓存；
+    # 过载时按 max_tokens 截短的回答也不缓存，否则负载恢复后仍然返回截短的回答
+    if semantic_cache is None or reply.startswith("（") or max_tokens is not None:
+        return
+    try:
+        semantic_cache.add(user_text, reply)
+    except Exception as e:
+        logger.warning("语义缓存写入失败: %s", e)
+
+def call_llm_cached(user_text, max_retries=3, cancel_token=None, max_tokens=None):
+    """
+    先查语义缓存，未命中再调用 LLM（WebSocket 通道使用）
+    """
+    hit = cached_answer(user_text)
+    if hit:
+        logger.info("语义缓存命中，相似度 %.3f: %s", hit["similarity"], hit["question"])
+        return hit["answer"]
+    reply = call_local_llm(user_text, max_retries=max_retries, cancel_token=cancel_token, max_tokens=max_tokens)
+    if reply and reply.strip():
+        remember_answer(user_text, reply, max_tokens=max_tokens)
+    return reply
+
+# 识别结果缓存：同样内容的录音（重传、重复发送）直接返回结果，同时到达的只识别一次
+transcript_cache = TranscriptCache.from_env()
+
+# 任务取消标记，按会话分组，用于用户打断时取消上一轮的 LLM/TTS 任务
+cancellations = CancellationRegistry()
 
 # 健康检查端点
 @app.route("/health", methods=["GET"])
@@ -166,7 +160,33 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "service": "Li-VoiceAss Backend",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "pid": os.getpid(),
+        "asr_model": current_model_name(),
+        "degradation": {"level": overload.level, "mode": overload.policy()["mode"]},
+        "tts_voice": voice_manager.default_voice,
+        "tts": tts_health()
+    })
+
+# 运行指标
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    scheduler_stats = scheduler.stats()
+    return jsonify({
+        "speculation": speculator.stats(),
+        "phoneme_cache": phoneme_cache.stats(),
+        "job_store": async_results.stats(),
+        "scheduler": scheduler_stats,
+        "rate_limit": rate_limiter.stats(),
+        "conversations": conversations.stats(),
+        "overload": overload.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache else {"enabled": False},
+        "transcript_cache": transcript_cache.stats(),
+        "deadlines": {
+            "expired": deadline_stats["expired"],
+            "expired_before_start": sum(c["expired"] for c in scheduler_stats["classes"].values()),
+            "default_timeout": DEFAULT_REQUEST_TIMEOUT
+        }
     })
 
 # 显式处理OPTIONS请求
@@ -180,66 +200,458 @@ def handle_options():
         response.headers.add("Access-Control-Allow-Credentials", "true")
         return response
 
+@app.after_request
+def announce_degradation(response):
+    policy = overload.policy()
+    response.headers["X-Degradation-Level"] = str(policy["level"])
+    response.headers["X-Degradation-Mode"] = policy["mode"]
+    return response
+
+# 性能分析（管理接口）：采样分析、单请求 cProfile、tracemalloc 快照对比
+sampling_profiler = SamplingProfiler()
+request_profiles = RequestProfiles(capacity=int(os.getenv("PROFILE_KEEP", "50")))
+memory_tracker = MemoryTracker()
+# 带 X-Profile: 1 请求头（且有管理权限）时对这些接口做 cProfile，包括它们提交的后台任务
+PROFILED_ENDPOINTS = {"handle_audio", "handle_tts", "call_llm"}
+
+# 客户端标识来自哪个请求头，只应设置为可信的反向代理或网关会覆盖的请求头（如 X-Real-IP、X-Forwarded-For）。
+# 客户端自己能随意设置的请求头（如 X-Client-Id）可以用来绕过限流，只在网关负责写入时使用
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER", "")
+
+def client_id_from_request():
+    """
+    限流和公平排队使用的客户端标识：CLIENT_ID_HEADER 指定的请求头，未设置或为空时使用来源地址
+    """
+    if CLIENT_ID_HEADER:
+        # X-Forwarded-For 由每一级代理追加，最后一项是可信代理看到的来源地址
+        value = request.headers.get(CLIENT_ID_HEADER, "").split(",")[-1].strip()
+        if value:
+            return value
+    return request.remote_addr
+
+# 管理接口的令牌；未设置时管理接口全部禁用
+# （反向代理转发的请求 remote_addr 也是本机地址，不能按来源地址放行）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def is_admin_request():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+@app.before_request
+def enforce_rate_limit():
+    if request.method == "OPTIONS" or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    client_id = client_id_from_request()
+    allowed, retry_after = rate_limiter.allow(client_id, RATE_LIMIT_COSTS.get(request.endpoint, 1.0))
+    if allowed:
+        return None
+    logger.warning("客户端 %s 请求过于频繁，%s 被限流", client_id, request.path)
+    response = jsonify({"error": "请求过于频繁，请稍后重试", "retry_after": round(retry_after, 2)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+@app.before_request
+def start_request_profile():
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return None
+    if request.headers.get("X-Profile", "").lower() not in ("1", "true", "yes", "on") or not is_admin_request():
+        return None
+    g.profile = request_profiles.start()
+    if g.profile is not None:
+        g.profile_id = new_result_id()
+        g.profile_started = time.monotonic()
+    return None
+
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        request_profiles.save(g.profile_id, "request", profile, time.monotonic() - g.profile_started)
+        response.headers["X-Profile-Id"] = g.profile_id
+    return response
+
+def requested_priority(data=None):
+    """
+    请求中显式指定的优先级（JSON/表单字段、查询参数或 X-Priority 请求头），未指定返回 None，无效时抛出 ValueError
+    """
+    value = (data or {}).get("priority")
+    if value is None and request.mimetype == "multipart/form-data":
+        value = request.form.get("priority")
+    value = value or request.args.get("priority") or request.headers.get("X-Priority")
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if value not in PRIORITY_CLASSES:
+        raise ValueError(f"priority 只能是 {'、'.join(PRIORITY_CLASSES)}: {value}")
+    return value
+
+# 请求截止时间：客户端没有指定时使用的默认时长（秒），0 表示不限
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("DEFAULT_REQUEST_TIMEOUT", "0"))
+
+def deadline_from_request(data=None):
+    """
+    请求的截止时间（time.time() 时间戳），没有时返回 None，无效时抛出 ValueError。
+    - timeout 字段 / X-Request-Timeout 请求头：从现在起的秒数
+    - deadline 字段 / X-Deadline 请求头：Unix 时间戳，前端可以把同一个截止时间依次传给识别、LLM、合成，
+      整轮对话共用一个时间预算
+    """
+    def value_of(name, header):
+        value = (data or {}).get(name)
+        if value is None and request.mimetype == "multipart/form-data":
+            value = request.form.get(name)
+        # 只有缺失（或空字符串）才继续找下一个来源，0 是有效值（timeout=0 会被拒绝，而不是当作没传）
+        for fallback in (request.args.get(name), request.headers.get(header)):
+            if value is None or value == "":
+                value = fallback
+        return None if value == "" else value
+
+    deadline = value_of("deadline", "X-Deadline")
+    timeout = value_of("timeout", "X-Request-Timeout")
+    try:
+        deadline = float(deadline) if deadline is not None else None
+        timeout = float(timeout) if timeout is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("timeout 和 deadline 必须是数字")
+    if timeout is not None and timeout <= 0:
+        raise ValueError("timeout 必须大于 0")
+    if timeout is None and deadline is None and DEFAULT_REQUEST_TIMEOUT > 0:
+        timeout = DEFAULT_REQUEST_TIMEOUT
+    if timeout is not None:
+        # 两者都指定时取较早的
+        deadline = min(deadline, time.time() + timeout) if deadline is not None else time.time() + timeout
+    return deadline
+
+def audio_priority(requested, audio_seconds):
+    return requested or (BATCH if audio_seconds > BATCH_AUDIO_SECONDS else INTERACTIVE)
+
+# 其他实例生成的音频：本地没有该文件时，按文件名中的实例ID转发给生成它的实例
+@app.before_request
+def proxy_foreign_audio():
+    if not request.path.startswith("/static/") or request.headers.get("X-Forwarded-Audio"):
+        return None
+    filename = request.path[len("/static/"):]
+    owner = result_owner(filename)
+    if not owner or owner == INSTANCE_ID or os.path.exists(os.path.join(AUDIO_DIR, filename)):
+        return None
+    owner_url = async_results.instance_url(owner)
+    if not owner_url:
+        logger.warning("音频所属实例未登记: %s", owner)
+        return jsonify({"error": "文件不存在"}), 404
+    try:
+        upstream = requests.get(f"{owner_url}/static/{filename}", headers={"X-Forwarded-Audio": INSTANCE_ID},
+                                stream=True, timeout=10)
+    except requests.RequestException as e:
+        logger.error("转发音频请求到实例 %s 失败: %s", owner, e)
+        return jsonify({"error": "音频所属实例不可用"}), 502
+    logger.info("音频 %s 由实例 %s 提供", filename, owner)
+    response = Response(stream_with_context(upstream.iter_content(64 * 1024)), status=upstream.status_code,
+                        content_type=upstream.headers.get("Content-Type"))
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    return response
+
 # 确保目录存在
 os.makedirs("backend/static", exist_ok=True)
 os.makedirs("backend", exist_ok=True)
 
-def process_tts_async(text, result_id):
+def submit_job(func, result_id, *args, session_id=None, new_turn=False, priority=INTERACTIVE,
+               client_id=None, cost=1.0, deadline=None, **kwargs):
+    """
+    登记任务的取消标记并提交到调度器。
+    new_turn=True 表示会话开始新一轮对话，该会话上一轮未完成的任务会被取消。
+    priority/client_id/cost 决定排队顺序，cost 为预计耗时（秒）。
+    deadline 为截止时间戳，过期后任务以 "deadline" 原因取消（还在排队的任务不会再执行）。
+    返回被取消的任务ID列表
+    """
+    token, cancelled = cancellations.register(result_id, session_id, new_turn=new_turn, deadline=deadline)
+    async_results[result_id] = {"status": "processing", "priority": priority}
+    if has_request_context() and g.get("profile_id"):
+        func = request_profiles.wrap(g.profile_id, func)
+    scheduler.schedule(func, *args, result_id=result_id, cancel_token=token, priority=priority,
+                       client_id=client_id or session_id, cost=cost, deadline=deadline, **kwargs)
+    return cancelled
+
+# 会话ID只允许字母、数字、下划线和连字符
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def session_id_from_request(data=None):
+    """
+    从 JSON 字段、表单字段、查询参数或 X-Session-Id 请求头中获取会话ID
+    """
+    if data and data.get("session"):
+        return str(data["session"])
+    if not is_raw_audio_request(request.mimetype) and request.form.get("session"):
+        return request.form["session"]
+    return request.args.get("session") or request.headers.get("X-Session-Id")
+
+# 超过截止时间而取消的任务数（其中排队期间就已过期、没有开始处理的见调度器各分类的 expired）
+deadline_stats = {"expired": 0}
+deadline_stats_lock = threading.Lock()
+
+def mark_cancelled(result_id, token):
+    """
+    记录任务被取消的结果
+    """
+    logger.info("任务已取消，ID: %s，原因: %s", result_id, token.reason if token else "cancelled")
+    if token and token.reason == "deadline":
+        with deadline_stats_lock:
+            deadline_stats["expired"] += 1
+    if token and token.reason == "speculation":
+        # 作废的推测任务不会有人查询，直接清理
+        async_results.pop(result_id, None)
+        return
+    async_results[result_id] = {
+        "status": "cancelled",
+        "reason": token.reason if token else "cancelled"
+    }
+
+# 合成音频按任务ID命名，定期删除超过任务保留时间的文件
+_last_audio_sweep = 0.0
+_audio_sweep_lock = threading.Lock()
+
+def remove_expired_audio():
+    """
+    删除过期的合成音频，每分钟最多执行一次。在任务结束后（finally 中）调用，不会抛出异常
+    """
+    global _last_audio_sweep
+    now = time.time()
+    with _audio_sweep_lock:
+        if now - _last_audio_sweep < 60:
+            return
+        _last_audio_sweep = now
+    try:
+        prefix = f"{INSTANCE_ID}."
+        # 语义缓存中仍有效的回答音频保留
+        keep = {f"{prefix}answer_{key}.wav" for key in semantic_cache.audio_keys()} if semantic_cache else set()
+        names = os.listdir(AUDIO_DIR)
+    except Exception as e:
+        logger.warning("清理过期音频失败: %s", e)
+        return
+    for name in names:
+        if name in keep or not name.startswith(prefix) or not name.endswith(".wav"):
+            continue
+        path = os.path.join(AUDIO_DIR, name)
+        try:
+            # 文件可能刚被其他任务删除或替换
+            if now - os.path.getmtime(path) > async_results.ttl:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("删除过期音频失败: %s (%s)", path, e)
+
+def launch_speculative_llm(session_id, text):
+    """
+    推测式发起 LLM 调用，返回任务ID
+    """
+    result_id = new_result_id()
+    submit_job(process_llm_async, result_id, text, speculative=True, session_id=session_id,
+               client_id=session_id)
+    return result_id
+
+def cancel_speculative_llm(result_id):
+    """
+    取消未命中的推测任务；已经结束的推测结果不会再被查询，直接清理
+    """
+    if not cancellations.cancel(result_id, reason="speculation"):
+        async_results.pop(result_id, None)
+
+def take_finished_result(result_id):
+    """
+    取出已经结束的异步任务结果（WebSocket 通道复用推测任务时使用），任务仍在处理时返回 None，不等待
+    """
+    result = async_results.get(result_id)
+    if result is None:
+        return {"status": "not_found"}
+    if result["status"] == "processing":
+        return None
+    return async_results.pop(result_id, result)
+
+# 推测式 LLM：流式识别结果稳定后提前调用 LLM，默认关闭，可用 SPECULATIVE_LLM=1 或请求参数 speculate=true 开启
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "0").lower() in ("1", "true", "yes", "on")
+speculator = SpeculativeLLM.from_env(launch_speculative_llm, cancel_speculative_llm)
+
+def process_tts_async(text, result_id, voice=None, speaker=None, length_scale=None, cancel_token=None):
     """
     异步处理TTS任务
     """
     try:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         logger.info("开始TTS处理，文本: %s", text[:50] + "..." if len(text) > 50 else text)
-        audio_path = text_to_speech(text)
+        policy = overload.policy()
+        if policy["tts_sentences"]:
+            text = first_sentences(text, policy["tts_sentences"])
+        started = time.monotonic()
+        audio_path = text_to_speech(text, os.path.join(AUDIO_DIR, f"{result_id}.wav"), voice=voice,
+                                    speaker=speaker, length_scale=length_scale, cancel_token=cancel_token)
+        overload.observe("tts", time.monotonic() - started)
         logger.info("TTS处理完成，音频路径: %s", audio_path)
         async_results[result_id] = {
             "status": "completed",
-            "audio_path": audio_path
+            "audio_path": audio_path,
+            "audio_url": f"/static/{os.path.basename(audio_path)}"
         }
         logger.info("TTS结果已保存到async_results，ID: %s", result_id)
+    except JobCancelled:
+        mark_cancelled(result_id, cancel_token)
     except Exception as e:
         logger.error("异步TTS处理失败: %s", e, exc_info=True)
         async_results[result_id] = {
             "status": "failed",
             "error": str(e)
         }
+    finally:
+        cancellations.finish(result_id)
+        remove_expired_audio()
 
-def process_speech_to_text_async(file_path, result_id):
+def process_speech_to_text_async(file_path, result_id, decode_options=None, partial_session=None,
+                                  partial_chunk=None, end_of_utterance=False, remove_input=False, cache_key=None,
+                                  cancel_token=None):
     """
-    异步处理语音识别任务
+    异步处理语音识别任务。
+    partial_session 不为空时，识别结果作为该会话的中间结果交给推测式 LLM；
+    partial_chunk 为独立分块的编号（见 SpeculativeLLM.next_chunk），不为空时先与之前的分块拼接；
+    remove_input=True 时识别结束后删除输入文件；
+    cache_key 不为空时结果写入识别缓存，并分发给等待同样内容的其他请求
     """
+    shared = False
+    cancelled = False
+    handed_off = False
+    failure = None
+    chunk_reported = False
     try:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         logger.info("开始语音识别处理，文件路径: %s，结果ID: %s", file_path, result_id)
-        user_text = speech_to_text(file_path)
-        logger.info("语音识别完成，结果: %s", user_text)
+        def report_progress(done, total):
+            # 长音频分块识别的进度，通过 /speech-status 返回给前端
+            async_results[result_id] = {
+                "status": "processing",
+                "progress": {"done": done, "total": total}
+            }
+
+        started = time.monotonic()
+        stt_result = transcribe(file_path, decode_options, progress_callback=report_progress,
+                                cancel_token=cancel_token, model_name=overload.policy()["asr_model"])
+        if stt_result["duration"] > 0:
+            overload.observe("asr", (time.monotonic() - started) / stt_result["duration"])
+        user_text = stt_result["text"]
+        logger.info("语音识别完成，结果: %s，解码信息: %s", user_text, stt_result["decode"])
         # 确保user_text不是None或undefined
         if not user_text:
             user_text = "（未识别到内容）"
         logger.info("语音识别最终结果: %s", user_text)
-        async_results[result_id] = {
+        result = {
             "status": "completed",
-            "user_text": user_text  # 确保这个字段存在
+            "user_text": user_text,  # 确保这个字段存在
+            "language": stt_result["language"],
+            "duration": stt_result["duration"],
+            "segments": stt_result["segments"],
+            "decode": stt_result["decode"]
         }
+        async_results[result_id] = result
         logger.info("语音识别结果已保存到async_results，ID: %s", result_id)
+        if cache_key:
+            # 降级或热切换期间由其他模型得到的结果只分发，不缓存。
+            # 使用本地的 result：存储中的结果可能已经被状态查询取走
+            cacheable = stt_result["decode"].get("model") == current_model_name()
+            for follower in transcript_cache.complete(cache_key, result, cache=cacheable):
+                async_results[follower] = dict(result, deduplicated=True)
+            shared = True
+        record_conversation(cancel_token, "transcript", user_text, job_id=result_id,
+                            source="speech", duration=stt_result["duration"], language=stt_result["language"])
+        if partial_session and partial_chunk is not None:
+            chunk_reported = True
+            speculator.on_chunk(partial_session, partial_chunk, stt_result["text"], end_of_utterance)
+        elif partial_session and user_text != "（未识别到内容）":
+            speculator.on_partial(partial_session, user_text, end_of_utterance)
+    except JobCancelled:
+        cancelled = True
+        mark_cancelled(result_id, cancel_token)
     except Exception as e:
         logger.error("异步语音识别处理失败: %s", e, exc_info=True)
-        async_results[result_id] = {
+        failure = {
             "status": "failed",
             "error": str(e),
             "user_text": "（语音识别失败）"  # 提供默认文本
         }
+        async_results[result_id] = failure
         logger.info("语音识别失败结果已保存到async_results，ID: %s", result_id)
+    finally:
+        cancellations.finish(result_id)
+        if partial_session and partial_chunk is not None and not chunk_reported:
+            # 失败或取消的分块按空文本计入，后面的分块仍能拼接
+            speculator.on_chunk(partial_session, partial_chunk, "")
+        if cache_key and not shared:
+            if cancelled:
+                # 取消只针对本任务，等待同样内容的请求由其中一个接手识别
+                handed_off = hand_off_transcription(cache_key, file_path, decode_options)
+            else:
+                # 识别失败，等待同样内容的请求得到同样的结果
+                fail_transcript_followers(cache_key, failure or {"status": "failed", "error": "语音识别未完成"})
+        if remove_input and not handed_off and os.path.exists(file_path):
+            os.remove(file_path)
+
+def fail_transcript_followers(cache_key, outcome):
+    """
+    识别失败时，把同样的失败结果告知等待同样内容的请求
+    """
+    for follower in transcript_cache.abandon(cache_key):
+        async_results[follower] = outcome
 
-def process_llm_async(user_text, result_id):
+def hand_off_transcription(cache_key, file_path, decode_options):
     """
-    异步处理LLM调用任务
+    执行识别的任务被取消后，按第一个跟随者登记的参数重新提交识别，输入文件交给新任务。
+    返回是否已交接
     """
+    handoff = transcript_cache.handoff(cache_key)
+    if handoff is None:
+        return False
+    result_id, context = handoff
+    logger.info("识别任务被取消，由等待同样内容的请求接手识别，ID: %s", result_id)
     try:
+        audio_seconds = wav_duration(file_path)
+        submit_job(process_speech_to_text_async, result_id, file_path, decode_options=decode_options,
+                   session_id=context.get("session_id"), remove_input=True, cache_key=cache_key,
+                   priority=audio_priority(context.get("priority"), audio_seconds),
+                   client_id=context.get("client_id"), cost=audio_seconds, deadline=context.get("deadline"))
+    except Exception as e:
+        logger.error("接手识别任务失败: %s", e, exc_info=True)
+        outcome = {"status": "failed", "error": str(e)}
+        async_results[result_id] = outcome
+        fail_transcript_followers(cache_key, outcome)
+        return False
+    return True
+
+def process_llm_async(user_text, result_id, speculative=False, cancel_token=None):
+    """
+    异步处理LLM调用任务；speculative=True 表示推测式发起，回复不一定会被采用
+    """
+    try:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         logger.info("开始处理LLM请求: %s", user_text)
         # 更新状态为处理中
         async_results[result_id] = {"status": "processing"}
+        hit = cached_answer(user_text)
+        if hit:
+            logger.info("语义缓存命中，相似度 %.3f: %s", hit["similarity"], hit["question"])
+            async_results[result_id] = {
+                "status": "completed",
+                "reply": hit["answer"],
+                "cached": True,
+                "similarity": hit["similarity"],
+                "audio_url": hit["audio_url"]
+            }
+            record_conversation(cancel_token, "prompt", user_text, job_id=result_id, speculative=speculative)
+            record_conversation(cancel_token, "reply", hit["answer"], job_id=result_id, speculative=speculative,
+                                cached=True, similarity=hit["similarity"])
+            return
         logger.info("调用call_local_llm函数")
-        reply = call_local_llm(user_text, max_retries=3)
+        started = time.monotonic()
+        max_tokens = overload.policy()["max_tokens"]
+        reply = call_local_llm(user_text, max_retries=3, cancel_token=cancel_token, max_tokens=max_tokens)
+        overload.observe("llm", time.monotonic() - started)
         logger.info("LLM返回结果，长度: %d", len(reply) if reply else 0)
         
         # 检查回复是否有效
@@ -249,6 +661,9 @@ def process_llm_async(user_text, result_id):
                 "status": "completed",
                 "reply": reply
             }
+            record_conversation(cancel_token, "prompt", user_text, job_id=result_id, speculative=speculative)
+            record_conversation(cancel_token, "reply", reply, job_id=result_id, speculative=speculative)
+            remember_answer(user_text, reply, max_tokens=max_tokens)
             logger.info("LLM处理完成，结果已保存")
         else:
             logger.warning("LLM返回空回复或无效回复: %s", type(reply))
@@ -258,6 +673,8 @@ def process_llm_async(user_text, result_id):
                 "reply": "（AI未返回有效回复）"
             }
             logger.info("LLM处理失败，已记录空回复错误")
+    except JobCancelled:
+        mark_cancelled(result_id, cancel_token)
     except Exception as e:
         logger.error("异步LLM处理失败: %s", e, exc_info=True)
         async_results[result_id] = {
@@ -266,37 +683,158 @@ def process_llm_async(user_text, result_id):
             "reply": "（AI处理失败，请稍后重试）"
         }
         logger.info("LLM处理失败，错误已保存")
+    finally:
+        cancellations.finish(result_id)
+        speculator.job_finished(result_id)
+
+def receive_raw_audio(wav_path):
+    """
+    将原始音频请求体（audio/webm、audio/ogg;codecs=opus、audio/L16;rate=16000）
+    直接从输入流解码为 WAV，不经过 multipart 解析和中间文件
+    """
+    received = decode_audio_stream(
+        request.stream,
+        request.mimetype,
+        request.mimetype_params,
+        wav_path,
+        content_length=request.content_length
+    )
+    logger.info("收到原始音频流，MIME类型: %s，大小: %d bytes", request.content_type, received)
+
+# 请求中可以覆盖的 Whisper 解码参数
+DECODE_OPTION_KEYS = ("language", "beam_size", "temperature_max", "without_timestamps",
+                      "condition_on_previous_text", "initial_prompt", "long_audio")
+
+def decode_options_from_request():
+    """
+    从查询参数（原始音频流）或表单字段（multipart 上传）读取解码参数
+    """
+    values = {key: request.args[key] for key in DECODE_OPTION_KEYS if key in request.args}
+    if not is_raw_audio_request(request.mimetype):
+        values.update({key: request.form[key] for key in DECODE_OPTION_KEYS if key in request.form})
+    return parse_decode_options(values)
+
+def cached_transcript(cache_key, result_id, session_id, priority=None, deadline=None):
+    """
+    识别缓存命中或同样内容正在识别时，登记结果并返回响应；否则返回 None，由调用方继续识别。
+    与正常提交一样，命中时该会话上一轮未完成的任务会被取消
+    """
+    cached = transcript_cache.get(cache_key)
+    if cached is not None:
+        logger.info("识别缓存命中，ID: %s", result_id)
+        cancelled = cancellations.cancel_session(session_id, reason="superseded") if session_id else []
+        async_results[result_id] = dict(cached, cached=True)
+        return jsonify({
+            "audio_status": "processing",
+            "stt_result_id": result_id,
+            "session_id": session_id,
+            "cached": True,
+            "cancelled_jobs": cancelled
+        })
+    # 正在识别的任务被取消时，由第一个跟随者按这些参数接手识别
+    context = {"session_id": session_id, "priority": priority, "deadline": deadline,
+               "client_id": client_id_from_request()}
+    leader = transcript_cache.claim(cache_key, result_id, context)
+    if leader is None:
+        return None
+    logger.info("同样内容的录音正在识别（%s），复用其结果，ID: %s", leader, result_id)
+    async_results[result_id] = {"status": "processing"}
+    # 被取消的可能正是要复用的任务（同一会话重传），此时由本请求接手识别
+    cancelled = cancellations.cancel_session(session_id, reason="superseded") if session_id else []
+    return jsonify({
+        "audio_status": "processing",
+        "stt_result_id": result_id,
+        "session_id": session_id,
+        "deduplicated": True,
+        "cancelled_jobs": cancelled
+    })
 
 # 一次性上传接口（原有）
 @app.route("/speech", methods=["POST"])
 def handle_audio():
     try:
-        if "audio" not in request.files:
-            return jsonify({"error": "未上传音频文件"}), 400
+        try:
+            decode_options = decode_options_from_request()
+        except ValueError as e:
+            return jsonify({"error": f"解码参数无效: {e}"}), 400
+        try:
+            priority = requested_priority()
+            deadline = deadline_from_request()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # 每个请求使用独立的文件，多个请求（以及同一目录下的多个实例）不会互相覆盖
+        stt_result_id = new_result_id()
+        session_id = session_id_from_request()
+        wav_path = f"backend/input_{stt_result_id}.wav"
+        # 登记为执行者之后、提交识别任务之前出错时，等待同样内容的请求也不会再有结果
+        claimed_key = None
+        try:
+            if is_raw_audio_request(request.mimetype):
+                # 原始音频流直接解码，没有完整的原始数据，按解码后的 PCM 计算缓存键
+                receive_raw_audio(wav_path)
+                with open(wav_path, "rb") as f:
+                    cache_key = content_key(file_chunks(f), decode_options)
+                cached = cached_transcript(cache_key, stt_result_id, session_id, priority, deadline)
+                if cached is not None:
+                    os.remove(wav_path)
+                    return cached
+                claimed_key = cache_key
+            else:
+                if "audio" not in request.files:
+                    return jsonify({"error": "未上传音频文件"}), 400
+
+                file = request.files["audio"]
+                logger.info("收到音频文件，文件名: %s，MIME类型: %s", file.filename, file.content_type)
+                # 在格式转换之前按上传内容查缓存
+                cache_key = content_key(file_chunks(file.stream), decode_options)
+                cached = cached_transcript(cache_key, stt_result_id, session_id, priority, deadline)
+                if cached is not None:
+                    return cached
+                claimed_key = cache_key
+
+                # 保存原始文件
+                original_filename = file.filename or "input"
+                original_extension = original_filename.split('.')[-1] if '.' in original_filename else 'webm'
+                original_path = f"backend/input_{stt_result_id}.{original_extension}"
+
+                # 转换为WAV格式
+                try:
+                    file.save(original_path)
+                    convert_audio_to_wav(original_path, wav_path)
+                finally:
+                    if os.path.exists(original_path):
+                        os.remove(original_path)
+
+            # 异步处理语音识别；新的语音输入会打断该会话上一轮未完成的任务
+            audio_seconds = wav_duration(wav_path)
+            priority = audio_priority(priority, audio_seconds)
+            cancelled = submit_job(process_speech_to_text_async, stt_result_id, wav_path,
+                                   decode_options=decode_options, session_id=session_id, new_turn=True,
+                                   remove_input=True, cache_key=cache_key, priority=priority,
+                                   client_id=client_id_from_request(), cost=audio_seconds, deadline=deadline)
+            # 提交之后由识别任务负责分发结果
+            claimed_key = None
+        except Exception as e:
+            if claimed_key is not None:
+                fail_transcript_followers(claimed_key, {"status": "failed", "error": str(e)})
+                if os.path.exists(wav_path):
+                    os.remove(wav_path)
+            raise
 
-        file = request.files["audio"]
-        logger.info("收到音频文件，文件名: %s，MIME类型: %s", file.filename, file.content_type)
-        
-        # 保存原始文件
-        original_filename = file.filename or "input"
-        original_extension = original_filename.split('.')[-1] if '.' in original_filename else 'webm'
-        original_path = f"backend/input.{original_extension}"
-        file.save(original_path)
-        
-        # 转换为WAV格式
-        wav_path = "backend/input.wav"
-        convert_audio_to_wav(original_path, wav_path)
-        
-        # 异步处理语音识别
-        stt_result_id = str(uuid.uuid4())
-        async_results[stt_result_id] = {"status": "processing"}
-        thread_pool.submit(process_speech_to_text_async, wav_path, stt_result_id)
-        
         # 立即返回，告知前端任务已接受
         return jsonify({
             "audio_status": "processing",
-            "stt_result_id": stt_result_id
+            "stt_result_id": stt_result_id,
+            "session_id": session_id,
+            "priority": priority,
+            "cancelled_jobs": cancelled
         })
+    except InvalidAudioFormat as e:
+        return jsonify({"error": str(e)}), 400
+    except AudioUploadTooLarge as e:
+        logger.warning("音频上传过大: %s", e)
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         logger.error("处理失败: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -305,16 +843,22 @@ def handle_audio():
 @app.route("/speech-status/<result_id>", methods=["GET"])
 def check_speech_status(result_id):
     logger.info("检查语音识别状态，ID: %s", result_id)
-    if result_id in async_results:
-        result = async_results[result_id]
+    # 只读一次：共享存储中的结果可能在两次读取之间过期或被其他请求取走
+    result = async_results.get(result_id)
+    if result is not None:
         logger.info("语音识别状态结果: %s", result)
         if result["status"] == "completed":
             response = jsonify({
                 "status": "completed",
-                "user_text": result["user_text"]
+                "user_text": result["user_text"],
+                "language": result.get("language"),
+                "duration": result.get("duration"),
+                "segments": result.get("segments", []),
+                "decode": result.get("decode"),
+                "cached": result.get("cached", False)
             })
             # 任务完成后清理结果，避免影响后续请求
-            del async_results[result_id]
+            async_results.pop(result_id, None)
             logger.info("语音识别任务完成，已清理结果，ID: %s", result_id)
             return response
         elif result["status"] == "failed":
@@ -323,14 +867,19 @@ def check_speech_status(result_id):
                 "error": result["error"]
             })
             # 任务失败后清理结果，避免影响后续请求
-            del async_results[result_id]
+            async_results.pop(result_id, None)
             logger.info("语音识别任务失败，已清理结果，ID: %s", result_id)
             return response
+        elif result["status"] == "cancelled":
+            async_results.pop(result_id, None)
+            logger.info("语音识别任务已取消，已清理结果，ID: %s", result_id)
+            return jsonify({"status": "cancelled", "reason": result.get("reason")})
         else:
             logger.info("语音识别任务仍在处理中，ID: %s", result_id)
-            return jsonify({
-                "status": "processing"
-            })
+            response = {"status": "processing"}
+            if "progress" in result:
+                response["progress"] = result["progress"]
+            return jsonify(response)
     else:
         logger.warning("语音识别任务未找到，ID: %s", result_id)
         return jsonify({"status": "not_found"}), 404
@@ -344,15 +893,39 @@ def call_llm():
             return jsonify({"error": "未提供文本"}), 400
 
         user_text = data["user_text"]
+        session_id = session_id_from_request(data)
+        try:
+            priority = requested_priority(data) or INTERACTIVE
+            deadline = deadline_from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # 异步调用LLM
-        llm_result_id = str(uuid.uuid4())
-        async_results[llm_result_id] = {"status": "processing"}
-        thread_pool.submit(process_llm_async, user_text, llm_result_id)
+        # 最终文本与推测时的文本一致，直接复用已提前发起的 LLM 任务。
+        # 推测任务按 interactive 调度，指定 batch 的请求不复用；请求的截止时间同样作用于推测任务
+        if session_id:
+            speculative_id = speculator.on_final(session_id, user_text)
+            if speculative_id and priority != INTERACTIVE:
+                cancel_speculative_llm(speculative_id)
+                speculative_id = None
+            if speculative_id:
+                token = cancellations.get(speculative_id)
+                if token is not None:
+                    token.limit_deadline(deadline)
+                return jsonify({
+                    "llm_status": "processing",
+                    "llm_result_id": speculative_id,
+                    "speculative": True
+                })
+
+        # 异步调用LLM（属于当前轮次，不打断同会话的其他任务）
+        llm_result_id = new_result_id()
+        submit_job(process_llm_async, llm_result_id, user_text, session_id=session_id,
+                   priority=priority, client_id=client_id_from_request(), deadline=deadline)
         
         return jsonify({
             "llm_status": "processing",
-            "llm_result_id": llm_result_id
+            "llm_result_id": llm_result_id,
+            "speculative": False
         })
     except Exception as e:
         logger.error("处理失败: %s", e, exc_info=True)
@@ -361,15 +934,17 @@ def call_llm():
 # 检查LLM任务状态
 @app.route("/llm-status/<result_id>", methods=["GET"])
 def check_llm_status(result_id):
-    if result_id in async_results:
-        result = async_results[result_id]
+    result = async_results.get(result_id)
+    if result is not None:
         if result["status"] == "completed":
             response = jsonify({
                 "status": "completed",
-                "reply": result["reply"]
+                "reply": result["reply"],
+                "cached": result.get("cached", False),
+                "audio_url": result.get("audio_url")
             })
             # 任务完成后清理结果，避免影响后续请求
-            del async_results[result_id]
+            async_results.pop(result_id, None)
             return response
         elif result["status"] == "failed":
             response = jsonify({
@@ -377,8 +952,11 @@ def check_llm_status(result_id):
                 "error": result["error"]
             })
             # 任务失败后清理结果，避免影响后续请求
-            del async_results[result_id]
+            async_results.pop(result_id, None)
             return response
+        elif result["status"] == "cancelled":
+            async_results.pop(result_id, None)
+            return jsonify({"status": "cancelled", "reason": result.get("reason")})
         else:
             return jsonify({
                 "status": "processing"
@@ -396,15 +974,24 @@ def handle_text():
 
         user_text = data["text"]
         logger.info("📝 用户输入：%s", user_text)
+        try:
+            priority = requested_priority(data) or INTERACTIVE
+            deadline = deadline_from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # 异步调用LLM
-        llm_result_id = str(uuid.uuid4())
-        async_results[llm_result_id] = {"status": "processing"}
-        thread_pool.submit(process_llm_async, user_text, llm_result_id)
+        # 异步调用LLM；新的文字输入会打断该会话上一轮未完成的任务
+        llm_result_id = new_result_id()
+        session_id = session_id_from_request(data)
+        cancelled = submit_job(process_llm_async, llm_result_id, user_text,
+                               session_id=session_id, new_turn=True, priority=priority,
+                               client_id=client_id_from_request(), deadline=deadline)
         
         return jsonify({
             "text_status": "processing",
-            "llm_result_id": llm_result_id
+            "llm_result_id": llm_result_id,
+            "session_id": session_id,
+            "cancelled_jobs": cancelled
         })
     except Exception as e:
         logger.error("处理失败: %s", e, exc_info=True)
@@ -420,10 +1007,36 @@ def handle_tts():
 
         text = data["text"]
 
+        # 可选的语音、说话人和语速参数
+        voice = data.get("voice")
+        speaker = data.get("speaker")
+        length_scale = data.get("length_scale")
+        if voice and voice not in voice_manager.available_voices():
+            return jsonify({"error": f"语音不存在: {voice}"}), 400
+        if length_scale is not None:
+            try:
+                length_scale = float(length_scale)
+            except (TypeError, ValueError):
+                return jsonify({"error": "length_scale 必须是数字"}), 400
+            if length_scale <= 0:
+                return jsonify({"error": "length_scale 必须大于 0"}), 400
+        try:
+            priority = requested_priority(data) or INTERACTIVE
+            deadline = deadline_from_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # 最高降级等级下不再合成语音，前端只显示文本回复
+        if not overload.policy()["tts"]:
+            return jsonify({"tts_status": "skipped", "error": "服务繁忙，暂时只返回文本回复"}), 503
+
         # 异步合成语音
-        result_id = str(uuid.uuid4())
-        async_results[result_id] = {"status": "processing"}
-        thread_pool.submit(process_tts_async, text, result_id)
+        result_id = new_result_id()
+        # 预计时长：中文语速约每秒 4 个字
+        submit_job(process_tts_async, result_id, text, voice=voice, speaker=speaker,
+                   length_scale=length_scale, session_id=session_id_from_request(data),
+                   priority=priority, client_id=client_id_from_request(), cost=len(text) / 4,
+                   deadline=deadline)
 
         return jsonify({
             "tts_status": "processing",
@@ -433,20 +1046,180 @@ def handle_tts():
         logger.error("处理失败: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# 批量合成：一次提交多条文本（菜单提示、快捷回复等），去重后并行合成。
+# 音频文件按内容命名，同样的文本和参数再次提交时直接复用已有文件
+TTS_BATCH_MAX_ITEMS = int(os.getenv("TTS_BATCH_MAX_ITEMS", "100"))
+TTS_BATCH_MAX_CHARS = int(os.getenv("TTS_BATCH_MAX_CHARS", "500"))
+
+def batch_audio_filename(text, voice, speaker, length_scale):
+    key = json.dumps([text, voice or voice_manager.default_voice, speaker, length_scale], ensure_ascii=False)
+    return f"{INSTANCE_ID}.tts_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]}.wav"
+
+def process_tts_batch_item(text, result_id, filename, voice=None, speaker=None, length_scale=None,
+                           cancel_token=None):
+    """
+    合成批量任务中的一条；文件已存在时只刷新修改时间，避免被过期清理。
+    只有 Piper 合成的音频以内容命名供后续批次复用，回退引擎的音频按任务ID命名，只用这一次
+    """
+    path = os.path.join(AUDIO_DIR, filename)
+    try:
+        if os.path.exists(path):
+            os.utime(path)
+            async_results[result_id] = {"status": "completed", "audio_url": f"/static/{filename}", "reused": True}
+            return
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        # 先写临时文件再改名，同时合成同一条文本的批次不会读到写了一半的文件
+        tmp_path = os.path.join(AUDIO_DIR, f"{result_id}.partial.wav")
+        text_to_speech(text, tmp_path, voice=voice, speaker=speaker, length_scale=length_scale,
+                       cancel_token=cancel_token)
+        if engine_used() != "piper":
+            logger.warning("批量合成回退到了 %s，音频不复用，ID: %s", engine_used(), result_id)
+            filename = f"{result_id}.wav"
+            path = os.path.join(AUDIO_DIR, filename)
+        os.replace(tmp_path, path)
+        async_results[result_id] = {"status": "completed", "audio_url": f"/static/{filename}", "reused": False}
+    except JobCancelled:
+        mark_cancelled(result_id, cancel_token)
+    except Exception as e:
+        logger.error("批量合成失败，文本: %s，错误: %s", text[:50], e, exc_info=True)
+        async_results[result_id] = {"status": "failed", "error": str(e)}
+    finally:
+        cancellations.finish(result_id)
+        remove_expired_audio()
+
+@app.route("/tts-batch", methods=["POST"])
+def handle_tts_batch():
+    data = request.get_json(silent=True) or {}
+    texts = data.get("texts")
+    if not isinstance(texts, list) or not texts:
+        return jsonify({"error": "texts 必须是非空列表"}), 400
+    if len(texts) > TTS_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"一次最多 {TTS_BATCH_MAX_ITEMS} 条"}), 400
+    texts = [str(text).strip() for text in texts]
+    if any(not text or len(text) > TTS_BATCH_MAX_CHARS for text in texts):
+        return jsonify({"error": f"每条文本不能为空且不超过 {TTS_BATCH_MAX_CHARS} 字"}), 400
+
+    voice = data.get("voice")
+    speaker = data.get("speaker")
+    length_scale = data.get("length_scale")
+    if voice and voice not in voice_manager.available_voices():
+        return jsonify({"error": f"语音不存在: {voice}"}), 400
+    if length_scale is not None:
+        try:
+            length_scale = float(length_scale)
+        except (TypeError, ValueError):
+            return jsonify({"error": "length_scale 必须是数字"}), 400
+        if length_scale <= 0:
+            return jsonify({"error": "length_scale 必须大于 0"}), 400
+    try:
+        # 预取默认按 batch 调度，不影响正在进行的对话
+        priority = requested_priority(data) or BATCH
+        deadline = deadline_from_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not overload.policy()["tts"]:
+        return jsonify({"error": "服务繁忙，暂时只返回文本回复"}), 503
+
+    # 去重：相同文本只合成一次，清单中的重复项指向同一个文件
+    item_ids = {}
+    for text in texts:
+        if text in item_ids:
+            continue
+        item_id = item_ids[text] = new_result_id()
+        submit_job(process_tts_batch_item, item_id, text,
+                   batch_audio_filename(text, voice, speaker, length_scale),
+                   voice=voice, speaker=speaker, length_scale=length_scale, priority=priority,
+                   client_id=client_id_from_request(), cost=len(text) / 4, deadline=deadline)
+    batch_id = new_result_id()
+    async_results[batch_id] = {"status": "batch", "items": [[text, item_ids[text]] for text in texts]}
+    logger.info("批量合成已提交，批次: %s，共 %d 条，去重后 %d 条", batch_id, len(texts), len(item_ids))
+    return jsonify({"batch_id": batch_id, "total": len(texts), "unique": len(item_ids)}), 202
+
+def read_batch_audio(filename):
+    """
+    读取批量合成的音频，文件在其他实例上时通过其地址获取
+    """
+    path = os.path.join(AUDIO_DIR, filename)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    owner_url = async_results.instance_url(result_owner(filename) or "")
+    if not owner_url:
+        raise FileNotFoundError(filename)
+    upstream = requests.get(f"{owner_url}/static/{filename}", headers={"X-Forwarded-Audio": INSTANCE_ID}, timeout=30)
+    upstream.raise_for_status()
+    return upstream.content
+
+@app.route("/tts-batch-status/<batch_id>", methods=["GET"])
+def check_tts_batch_status(batch_id):
+    """
+    返回逐条状态和音频地址的清单；全部完成后 format=zip 可下载包含所有音频和清单的压缩包
+    """
+    batch = async_results.get(batch_id)
+    if batch is None or batch.get("status") != "batch":
+        return jsonify({"status": "not_found"}), 404
+
+    manifest = []
+    results = {}
+    for index, (text, item_id) in enumerate(batch["items"]):
+        if item_id not in results:
+            results[item_id] = async_results.get(item_id) or {"status": "not_found"}
+        result = results[item_id]
+        manifest.append({"index": index, "text": text, "status": result["status"],
+                         "audio_url": result.get("audio_url"), "error": result.get("error")})
+    statuses = {item["status"] for item in manifest}
+    status = "processing" if "processing" in statuses else ("completed" if statuses == {"completed"} else "partial")
+
+    if request.args.get("format") != "zip":
+        return jsonify({"batch_id": batch_id, "status": status, "items": manifest})
+    if status == "processing":
+        return jsonify({"error": "批次尚未完成", "status": status}), 409
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        written = {}
+        for item in manifest:
+            if not item["audio_url"]:
+                continue
+            filename = os.path.basename(item["audio_url"])
+            if filename not in written:
+                written[filename] = f"{item['index']:03d}.wav"
+                try:
+                    zf.writestr(written[filename], read_batch_audio(filename))
+                except (OSError, requests.RequestException) as e:
+                    logger.warning("批量合成音频读取失败: %s (%s)", filename, e)
+                    written[filename] = None
+            item["file"] = written[filename]
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    return Response(archive.getvalue(), mimetype="application/zip",
+                    headers={"Content-Disposition": f"attachment; filename=tts_batch_{batch_id}.zip"})
+
+# 列出可用的TTS语音
+@app.route("/tts-voices", methods=["GET"])
+def list_tts_voices():
+    return jsonify({
+        "default_voice": voice_manager.default_voice,
+        "available": voice_manager.available_voices(),
+        "loaded": voice_manager.loaded_voices(),
+        "phoneme_cache": phoneme_cache.stats()
+    })
+
 # 检查TTS任务状态
 @app.route("/tts-status/<result_id>", methods=["GET"])
 def check_tts_status(result_id):
     logger.info("检查TTS状态，ID: %s", result_id)
-    if result_id in async_results:
-        result = async_results[result_id]
+    result = async_results.get(result_id)
+    if result is not None:
         logger.info("TTS状态结果: %s", result)
         if result["status"] == "completed":
             response = jsonify({
                 "status": "completed",
-                "audio_path": result["audio_path"]
+                "audio_path": result["audio_path"],
+                "audio_url": result.get("audio_url")
             })
             # 任务完成后清理结果，避免影响后续请求
-            del async_results[result_id]
+            async_results.pop(result_id, None)
             logger.info("TTS任务完成，已清理结果，ID: %s", result_id)
             return response
         elif result["status"] == "failed":
@@ -455,9 +1228,13 @@ def check_tts_status(result_id):
                 "error": result["error"]
             })
             # 任务失败后清理结果，避免影响后续请求
-            del async_results[result_id]
+            async_results.pop(result_id, None)
             logger.info("TTS任务失败，已清理结果，ID: %s", result_id)
             return response
+        elif result["status"] == "cancelled":
+            async_results.pop(result_id, None)
+            logger.info("TTS任务已取消，已清理结果，ID: %s", result_id)
+            return jsonify({"status": "cancelled", "reason": result.get("reason")})
         else:
             logger.info("TTS任务仍在处理中，ID: %s", result_id)
             return jsonify({
@@ -467,6 +1244,209 @@ def check_tts_status(result_id):
         logger.warning("TTS任务未找到，ID: %s", result_id)
         return jsonify({"status": "not_found"}), 404
 
+# 取消任务接口：按任务ID取消单个任务，或按会话ID取消该会话所有未完成的任务
+@app.route("/cancel", methods=["POST"])
+def cancel_jobs():
+    data = request.get_json(silent=True) or {}
+    result_id = data.get("result_id")
+    session_id = data.get("session")
+    if not result_id and not session_id:
+        return jsonify({"error": "需要提供 result_id 或 session"}), 400
+
+    cancelled = []
+    if result_id and cancellations.cancel(result_id, reason="user"):
+        cancelled.append(result_id)
+    elif result_id and result_owner(result_id) not in (None, INSTANCE_ID) \
+            and not request.headers.get("X-Forwarded-Cancel"):
+        # 任务在其他实例上执行，取消标记只存在于那个实例的进程中
+        owner_url = async_results.instance_url(result_owner(result_id))
+        if owner_url:
+            try:
+                forwarded = requests.post(f"{owner_url}/cancel", json={"result_id": result_id},
+                                          headers={"X-Forwarded-Cancel": INSTANCE_ID}, timeout=5)
+                cancelled.extend(forwarded.json().get("cancelled", []))
+            except (requests.RequestException, ValueError) as e:
+                logger.warning("转发取消请求失败，任务: %s，错误: %s", result_id, e)
+    if session_id:
+        cancelled.extend(cancellations.cancel_session(session_id, reason="user"))
+    logger.info("取消请求，result_id: %s，session: %s，已取消: %s", result_id, session_id, cancelled)
+    return jsonify({"cancelled": cancelled})
+
+# 模型热切换：新模型在后台加载、预热后原子地换入，切换期间旧模型照常服务。
+# 只作用于当前实例，多实例部署时需要逐个实例调用
+SWAP_KINDS = {"asr": swap_model, "tts": swap_voice}
+active_swaps = {}
+active_swaps_lock = threading.Lock()
+
+def process_swap_async(kind, name, result_id):
+    try:
+        report = SWAP_KINDS[kind](name)
+        if kind == "asr":
+            # 旧模型的识别结果不再复用
+            transcript_cache.clear()
+        async_results[result_id] = dict(report, status="completed")
+        logger.info("模型热切换完成: %s", report)
+    except Exception as e:
+        logger.error("模型热切换失败，类型: %s，模型: %s，错误: %s", kind, name, e, exc_info=True)
+        async_results[result_id] = {"status": "failed", "kind": kind, "current": name, "error": str(e)}
+    finally:
+        with active_swaps_lock:
+            active_swaps.pop(kind, None)
+
+@app.route("/admin/swap", methods=["POST"])
+def admin_swap():
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind")
+    name = (data.get("name") or "").strip()
+    if kind not in SWAP_KINDS or not name:
+        return jsonify({"error": "需要提供 kind（asr 或 tts）和 name"}), 400
+
+    with active_swaps_lock:
+        if kind in active_swaps:
+            return jsonify({"error": "已有进行中的切换", "swap_id": active_swaps[kind]}), 409
+        result_id = active_swaps[kind] = new_result_id()
+    async_results[result_id] = {"status": "processing", "kind": kind, "current": name}
+    # 加载模型可能要几十秒，不占用调度器的工作线程
+    threading.Thread(target=process_swap_async, args=(kind, name, result_id),
+                     name=f"swap-{kind}", daemon=True).start()
+    logger.info("开始模型热切换，类型: %s，模型: %s，ID: %s", kind, name, result_id)
+    return jsonify({"swap_id": result_id, "status": "processing"}), 202
+
+@app.route("/admin/swap-status/<result_id>", methods=["GET"])
+def admin_swap_status(result_id):
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    result = async_results.get(result_id)
+    if result is None:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify(result)
+
+# 对话记录查询（管理接口）
+@app.route("/admin/conversations", methods=["GET"])
+def admin_recent_conversations():
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    try:
+        limit = min(int(request.args.get("limit", "20")), 500)
+        since = float(request.args["since"]) if "since" in request.args else None
+    except ValueError:
+        return jsonify({"error": "limit/since 必须是数字"}), 400
+    return jsonify({"sessions": conversations.recent_sessions(limit=limit, since=since)})
+
+@app.route("/admin/conversations/<session_id>", methods=["GET"])
+def admin_conversation(session_id):
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    try:
+        limit = min(int(request.args.get("limit", "200")), 5000)
+    except ValueError:
+        return jsonify({"error": "limit 必须是数字"}), 400
+    # 让刚结束的对话也能查到
+    conversations.flush(timeout=2)
+    return jsonify({"session_id": session_id, "records": conversations.session(session_id, limit=limit)})
+
+# 采样分析：POST 开始（seconds、interval、threads 为线程名前缀），GET 取折叠栈文本，
+# 可直接交给 flamegraph.pl 或 speedscope
+@app.route("/admin/profile/sample", methods=["GET", "POST"])
+def admin_profile_sample():
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    if request.method == "GET":
+        if request.args.get("format") == "json":
+            return jsonify(sampling_profiler.stats())
+        return Response(sampling_profiler.collapsed(), mimetype="text/plain",
+                        headers={"Content-Disposition": "attachment; filename=profile.collapsed"})
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = min(float(data.get("seconds", 10)), 300.0)
+        interval = max(float(data.get("interval", 0.005)), 0.001)
+    except (TypeError, ValueError):
+        return jsonify({"error": "seconds/interval 必须是数字"}), 400
+    try:
+        sampling_profiler.start(seconds, interval, data.get("threads"))
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e), **sampling_profiler.stats()}), 409
+    return jsonify(sampling_profiler.stats()), 202
+
+@app.route("/admin/profile/sample/stop", methods=["POST"])
+def admin_profile_sample_stop():
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    sampling_profiler.stop()
+    return jsonify(sampling_profiler.stats())
+
+@app.route("/admin/profile/requests", methods=["GET"])
+def admin_profile_requests():
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    return jsonify({"profiles": request_profiles.recent()})
+
+@app.route("/admin/profile/requests/<profile_id>", methods=["GET"])
+@app.route("/admin/profile/requests/<profile_id>/<name>", methods=["GET"])
+def admin_profile_request(profile_id, name=None):
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    if name is None:
+        entries = request_profiles.entries(profile_id)
+        if entries is None:
+            return jsonify({"status": "not_found"}), 404
+        return jsonify({"profile_id": profile_id, "entries": entries})
+    if request.args.get("format") == "prof":
+        data = request_profiles.dump(profile_id, name)
+        if data is None:
+            return jsonify({"status": "not_found"}), 404
+        return Response(data, mimetype="application/octet-stream",
+                        headers={"Content-Disposition": f"attachment; filename={profile_id}-{name}.prof"})
+    try:
+        report = request_profiles.report(profile_id, name, sort=request.args.get("sort", "cumulative"),
+                                         limit=int(request.args.get("limit", "40")))
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"参数无效: {e}"}), 400
+    if report is None:
+        return jsonify({"status": "not_found"}), 404
+    return Response(report, mimetype="text/plain")
+
+# tracemalloc：start 后每次 snapshot 与上一次比较，include 为要统计的文件名片段
+@app.route("/admin/profile/memory/<action>", methods=["POST"])
+def admin_profile_memory(action):
+    if not is_admin_request():
+        return jsonify({"error": "无权访问"}), 403
+    data = request.get_json(silent=True) or {}
+    if action == "start":
+        try:
+            nframes = int(data.get("nframes", 10))
+        except (TypeError, ValueError):
+            nframes = 0
+        # tracemalloc 的调用栈深度范围是 1..65535
+        if not 1 <= nframes <= 65535:
+            return jsonify({"error": "参数无效: nframes 必须是 1 到 65535 之间的整数"}), 400
+        memory_tracker.start(nframes)
+        return jsonify({"tracing": True})
+    if action == "stop":
+        memory_tracker.stop()
+        return jsonify({"tracing": memory_tracker.tracing})
+    if action != "snapshot":
+        return jsonify({"error": f"未知操作: {action}"}), 404
+    # include 可以是逗号分隔的字符串或字符串列表
+    include = data.get("include")
+    if isinstance(include, str):
+        include = [item.strip() for item in include.split(",") if item.strip()]
+    elif include is not None and not (isinstance(include, list) and all(isinstance(i, str) for i in include)):
+        return jsonify({"error": "参数无效: include 必须是逗号分隔的字符串或字符串列表"}), 400
+    try:
+        result = memory_tracker.snapshot(group_by=data.get("group_by", "lineno"),
+                                         limit=int(data.get("limit", 30)), include=include)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"参数无效: {e}"}), 400
+    # 常见的增长来源
+    result["job_store"] = async_results.stats()
+    result["phoneme_cache"] = phoneme_cache.stats()
+    return jsonify(result)
+
 # 静态文件路由
 @app.route("/static/<path:filename>")
 def static_files(filename):
@@ -491,36 +1471,117 @@ def static_files(filename):
 @app.route("/speech-stream", methods=["POST"])
 def speech_stream():
     try:
-        if "audio" not in request.files or "session" not in request.form:
-            return jsonify({"error": "缺少 audio 或 session"}), 400
+        try:
+            decode_options = decode_options_from_request()
+        except ValueError as e:
+            return jsonify({"error": f"解码参数无效: {e}"}), 400
+
+        try:
+            priority = requested_priority()
+            deadline = deadline_from_request()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        audio_file = request.files["audio"]
-        session_id = request.form["session"]
-        logger.info("收到流式音频文件，会话ID: %s，MIME类型: %s", session_id, audio_file.content_type)
+        result_id = new_result_id()
+        raw_audio = is_raw_audio_request(request.mimetype)
+        if raw_audio:
+            # 原始音频流的会话ID通过查询参数或请求头传递
+            session_id = request.args.get("session") or request.headers.get("X-Session-Id")
+            if not session_id:
+                return jsonify({"error": "缺少 session"}), 400
+            if not SESSION_ID_RE.match(session_id):
+                return jsonify({"error": "session 只能包含字母、数字、下划线和连字符"}), 400
+            # 与 /speech 相同，每个分块使用独立的输入文件
+            wav_chunk_path = f"backend/input_{result_id}.wav"
+            receive_raw_audio(wav_chunk_path)
+        else:
+            if "audio" not in request.files or "session" not in request.form:
+                return jsonify({"error": "缺少 audio 或 session"}), 400
 
-        # 保存原始文件
-        original_filename = audio_file.filename or "chunk"
-        original_extension = original_filename.split('.')[-1] if '.' in original_filename else 'webm'
-        original_chunk_path = os.path.join("backend/static", f"{session_id}_chunk.{original_extension}")
-        audio_file.save(original_chunk_path)
+            audio_file = request.files["audio"]
+            session_id = request.form["session"]
+            logger.info("收到流式音频文件，会话ID: %s，MIME类型: %s", session_id, audio_file.content_type)
 
-        # 转换为WAV格式
-        wav_chunk_path = os.path.join("backend/static", f"{session_id}_chunk.wav")
-        convert_audio_to_wav(original_chunk_path, wav_chunk_path)
+            if not SESSION_ID_RE.match(session_id):
+                return jsonify({"error": "session 只能包含字母、数字、下划线和连字符"}), 400
 
-        # 异步处理语音识别
-        result_id = str(uuid.uuid4())
-        async_results[result_id] = {"status": "processing"}
-        thread_pool.submit(process_speech_to_text_async, wav_chunk_path, result_id)
+            # 保存原始文件；每个分块使用独立的文件，排队中的分块不会被下一块覆盖
+            original_filename = audio_file.filename or "chunk"
+            original_extension = original_filename.split('.')[-1] if '.' in original_filename else 'webm'
+            original_chunk_path = f"backend/input_{result_id}.{original_extension}"
+            wav_chunk_path = f"backend/input_{result_id}.wav"
+            try:
+                audio_file.save(original_chunk_path)
+                # 转换为WAV格式
+                convert_audio_to_wav(original_chunk_path, wav_chunk_path)
+            finally:
+                if os.path.exists(original_chunk_path):
+                    os.remove(original_chunk_path)
+
+        # 异步处理语音识别，识别结束后删除输入文件
+        # 开启推测时，该分块的识别结果作为会话的中间结果；eou=true 表示前端检测到用户已停止说话。
+        # 分块默认是互相独立的片段，识别结果按到达顺序拼接；cumulative=true 表示每次上传的是从开始说话起的全部录音
+        params = request.args if raw_audio else request.values
+        speculate = params.get("speculate", str(SPECULATIVE_LLM)).lower() in ("1", "true", "yes", "on")
+        end_of_utterance = params.get("eou", "false").lower() in ("1", "true", "yes", "on")
+        cumulative = params.get("cumulative", "false").lower() in ("1", "true", "yes", "on")
+
+        audio_seconds = wav_duration(wav_chunk_path)
+        partial_chunk = speculator.next_chunk(session_id) if speculate and not cumulative else None
+        submit_job(process_speech_to_text_async, result_id, wav_chunk_path,
+                   decode_options=decode_options, session_id=session_id,
+                   partial_session=session_id if speculate else None, partial_chunk=partial_chunk,
+                   end_of_utterance=end_of_utterance, remove_input=True,
+                   priority=audio_priority(priority, audio_seconds),
+                   client_id=client_id_from_request(), cost=audio_seconds, deadline=deadline)
         
         return jsonify({
             "stt_status": "processing",
             "stt_result_id": result_id,
             "session_id": session_id
         })
+    except InvalidAudioFormat as e:
+        return jsonify({"error": str(e)}), 400
+    except AudioUploadTooLarge as e:
+        logger.warning("流式音频上传过大: %s", e)
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         logger.error("流式处理失败: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# 全双工 WebSocket 语音通道：音频持续上行，识别文本、回复和合成音频从同一连接下行
+if SOCK_AVAILABLE:
+    sock = Sock(app)
+
+    @sock.route("/ws/voice")
+    def voice_socket(ws):
+        session_id = request.args.get("session") or request.headers.get("X-Session-Id")
+        speculate = request.args.get("speculate", str(SPECULATIVE_LLM)).lower() in ("1", "true", "yes", "on")
+        logger.info("WebSocket 语音通道已连接，会话ID: %s", session_id)
+        # 与 /speech-stream 使用同一个限流键：音频分块按折扣计费，一轮对话按一次请求计费
+        client_id = client_id_from_request()
+        VoiceChannel(
+            ws, session_id, scheduler, cancellations, speculator,
+            transcribe=transcribe,
+            parse_decode_options=parse_decode_options,
+            call_llm=call_llm_cached,
+            synthesize_stream=synthesize_stream,
+            take_result=take_finished_result,
+            cancel_result=cancel_speculative_llm,
+            speculate=speculate,
+            record=conversations.record,
+            overload=overload,
+            client_id=client_id,
+            rate_limit=lambda tokens: rate_limiter.allow(client_id, tokens),
+            partial_cost=RATE_LIMIT_COSTS["speech_stream"]
+        ).run()
+else:
+    logger.warning("flask-sock 未安装，WebSocket 语音通道 /ws/voice 不可用")
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=1013, debug=True)
\ No newline at end of file
+    # 由 backend_manager 的 supervise 模式启动多个实例时，通过环境变量指定端口并关闭调试重载
+    app.run(
+        host=os.getenv("BACKEND_HOST", "0.0.0.0"),
+        port=int(os.getenv("BACKEND_PORT", "1013")),
+        debug=os.getenv("BACKEND_DEBUG", "1").lower() in ("1", "true", "yes", "on")
+    )
\ No newline at end of file
@@ -0,0 +1,443 @@
+"""
+音频处理工具
+提供文件转换（ffmpeg）以及直接从请求体流式解码音频的功能
+"""
+import os
+import sys
+import wave
+import array
+import logging
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 直接上传（非 multipart）所支持的音频类型
+RAW_AUDIO_MIMETYPES = {"audio/webm", "audio/ogg", "audio/l16"}
+
+# 单次上传的最大字节数，可通过环境变量调整（默认 25MB）
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+# 每次从输入流读取的字节数
+STREAM_READ_SIZE = 64 * 1024
+
+# Whisper 需要的目标采样率
+TARGET_SAMPLE_RATE = 16000
+
+
+# ffmpeg 处理一次上传的最长时间
+FFMPEG_TIMEOUT_SECONDS = 30
+
+
+class AudioUploadTooLarge(Exception):
+    """上传的音频超过大小限制"""
+
+
+class InvalidAudioFormat(ValueError):
+    """Content-Type 中的音频参数（采样率、声道数）无效"""
+
+
+def is_raw_audio_request(mimetype: str) -> bool:
+    """
+    判断请求体是否为可直接解码的原始音频流
+    """
+    return (mimetype or "").lower() in RAW_AUDIO_MIMETYPES
+
+
+def convert_audio_to_wav(input_path: str, output_path: str):
+    """
+    使用 ffmpeg 将音频文件转换为 WAV 格式
+    """
+    try:
+        logger.info("开始转换音频文件: %s -> %s", input_path, output_path)
+        
+        # 检查输入文件是否存在
+        if not os.path.exists(input_path):
+            raise Exception(f"输入文件不存在: {input_path}")
+        
+        # 检查文件大小
+        file_size = os.path.getsize(input_path)
+        logger.info("输入文件大小: %d bytes", file_size)
+        
+        if file_size == 0:
+            raise Exception("输入文件为空")
+        
+        # 使用 ffmpeg 转换音频格式，添加更多参数提高兼容性
+        cmd = [
+            'ffmpeg',
+            '-i', input_path,           # 输入文件
+            '-f', 'wav',                # 强制输出格式为 WAV
+            '-acodec', 'pcm_s16le',     # 音频编码：16位PCM
+            '-ar', '16000',             # 采样率：16kHz
+            '-ac', '1',                 # 单声道
+            '-avoid_negative_ts', 'make_zero',  # 避免负时间戳
+            '-fflags', '+genpts',       # 生成时间戳
+            '-max_muxing_queue_size', '1024',  # 增加缓冲区大小
+            '-y',                       # 覆盖输出文件
+            output_path
+        ]
+        
+        logger.info("执行 ffmpeg 命令: %s", ' '.join(cmd))
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        
+        if result.returncode == 0:
+            logger.info("音频转换成功: %s", output_path)
+            # 检查输出文件是否生成
+            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                logger.info("输出文件大小: %d bytes", os.path.getsize(output_path))
+            else:
+                raise Exception("输出文件生成失败或为空")
+        else:
+            logger.error("音频转换失败，返回码: %d", result.returncode)
+            logger.error("stderr: %s", result.stderr)
+            logger.error("stdout: %s", result.stdout)
+            
+            # 尝试备用转换方案
+            logger.info("尝试备用转换方案...")
+            if _try_fallback_conversion(input_path, output_path):
+                logger.info("备用转换方案成功")
+                return
+            else:
+                raise Exception(f"ffmpeg 转换失败 (返回码: {result.returncode}): {result.stderr}")
+            
+    except subprocess.TimeoutExpired:
+        logger.error("音频转换超时")
+        raise Exception("音频转换超时")
+    except FileNotFoundError:
+        logger.error("ffmpeg 未找到，请确保已安装 ffmpeg")
+        raise Exception("ffmpeg 未安装")
+    except Exception as e:
+        logger.error("音频转换异常: %s", e)
+        raise Exception(f"音频转换失败: {str(e)}")
+
+def _try_fallback_conversion(input_path: str, output_path: str) -> bool:
+    """
+    尝试备用音频转换方案
+    """
+    try:
+        logger.info("尝试备用转换方案: %s -> %s", input_path, output_path)
+        
+        # 备用方案1：使用更宽松的参数
+        fallback_cmd = [
+            'ffmpeg',
+            '-i', input_path,
+            '-f', 'wav',
+            '-acodec', 'pcm_s16le',
+            '-ar', '16000',
+            '-ac', '1',
+            '-y',
+            output_path
+        ]
+        
+        logger.info("执行备用ffmpeg命令: %s", ' '.join(fallback_cmd))
+        result = subprocess.run(fallback_cmd, capture_output=True, text=True, timeout=30)
+        
+        if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            logger.info("备用转换成功，输出文件大小: %d bytes", os.path.getsize(output_path))
+            return True
+        
+        # 备用方案2：尝试不同的编码器
+        fallback_cmd2 = [
+            'ffmpeg',
+            '-i', input_path,
+            '-f', 'wav',
+            '-acodec', 'pcm_u8',  # 使用8位PCM
+            '-ar', '16000',
+            '-ac', '1',
+            '-y',
+            output_path
+        ]
+        
+        logger.info("尝试8位PCM编码: %s", ' '.join(fallback_cmd2))
+        result2 = subprocess.run(fallback_cmd2, capture_output=True, text=True, timeout=30)
+        
+        if result2.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            logger.info("8位PCM转换成功，输出文件大小: %d bytes", os.path.getsize(output_path))
+            return True
+        
+        logger.error("所有备用转换方案都失败了")
+        return False
+        
+    except Exception as e:
+        logger.error("备用转换异常: %s", e)
+        return False
+
+def l16_params(params: dict):
+    """
+    读取 audio/l16 的 rate 和 channels 参数，返回 (采样率, 声道数)；
+    未指定时为 16000 和 1，不是正整数时抛出 InvalidAudioFormat
+    """
+    params = {k.lower(): v for k, v in (params or {}).items()}
+    values = []
+    for name, default, limit in (("rate", TARGET_SAMPLE_RATE, 384000), ("channels", 1, 8)):
+        raw = params.get(name, default)
+        try:
+            value = int(raw)
+        except (TypeError, ValueError):
+            raise InvalidAudioFormat(f"audio/l16 的 {name} 参数无效: {raw}")
+        if not 0 < value <= limit:
+            raise InvalidAudioFormat(f"audio/l16 的 {name} 参数超出范围: {raw}")
+        values.append(value)
+    return tuple(values)
+
+
+def _ffmpeg_input_args(mimetype: str, params: dict) -> list:
+    """
+    根据 Content-Type 生成 ffmpeg 的输入格式参数
+    """
+    mimetype = mimetype.lower()
+    if mimetype == "audio/l16":
+        rate, channels = l16_params(params)
+        sample_format = "s16le" if params.get("endianness") == "little-endian" else "s16be"
+        return ['-f', sample_format, '-ar', str(rate), '-ac', str(channels)]
+    if mimetype == "audio/ogg":
+        return ['-f', 'ogg']
+    # audio/webm
+    return ['-f', 'matroska']
+
+
+def _read_limited(stream, max_bytes: int):
+    """
+    按块读取输入流，超过大小限制时抛出 AudioUploadTooLarge
+    """
+    total = 0
+    while True:
+        chunk = stream.read(STREAM_READ_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise AudioUploadTooLarge(f"音频大小超过限制 ({max_bytes} bytes)")
+        yield chunk
+
+
+def _write_l16_to_wav(stream, params: dict, output_path: str, max_bytes: int) -> int:
+    """
+    16kHz 单声道 L16 数据无需解码，直接写入 WAV 文件
+    """
+    swap = params.get("endianness") != "little-endian" and sys.byteorder == "little"
+    total = 0
+    pending = b""
+    with wave.open(output_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(TARGET_SAMPLE_RATE)
+        for chunk in _read_limited(stream, max_bytes):
+            total += len(chunk)
+            data = pending + chunk
+            # 保证按 2 字节采样对齐，余下的字节留给下一块
+            usable = len(data) - (len(data) % 2)
+            pending = data[usable:]
+            samples = array.array('h', data[:usable])
+            if swap:
+                samples.byteswap()
+            wav_file.writeframes(samples.tobytes())
+    return total
+
+
+def _pipe_stream_to_ffmpeg(stream, mimetype: str, params: dict, output_path: str, max_bytes: int) -> int:
+    """
+    将输入流逐块写入 ffmpeg 的标准输入，边接收边解码
+    """
+    cmd = [
+        'ffmpeg',
+        '-loglevel', 'error',
+        *_ffmpeg_input_args(mimetype, params),
+        '-i', 'pipe:0',             # 从标准输入读取
+        '-f', 'wav',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(TARGET_SAMPLE_RATE),
+        '-ac', '1',
+        '-y',
+        output_path
+    ]
+    logger.info("执行 ffmpeg 流式解码命令: %s", ' '.join(cmd))
+
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        logger.error("ffmpeg 未找到，请确保已安装 ffmpeg")
+        raise Exception("ffmpeg 未安装")
+
+    total = 0
+    try:
+        try:
+            for chunk in _read_limited(stream, max_bytes):
+                total += len(chunk)
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg 提前退出，稍后根据返回码报告错误
+            pass
+        # communicate 关闭标准输入并读取 stderr，卡住的 ffmpeg 在超时后被结束
+        _, stderr = process.communicate(timeout=FFMPEG_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        logger.error("音频流解码超时")
+        raise Exception("音频转换超时")
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+
+    if process.returncode != 0:
+        message = stderr.decode("utf-8", errors="replace")
+        logger.error("音频流解码失败，返回码: %d, stderr: %s", process.returncode, message)
+        raise Exception(f"ffmpeg 解码失败 (返回码: {process.returncode}): {message}")
+    return total
+
+
+def decode_audio_stream(stream, mimetype: str, params: dict, output_path: str,
+                        content_length=None, max_bytes: int = MAX_AUDIO_UPLOAD_BYTES) -> int:
+    """
+    从请求体（WSGI 输入流）增量读取音频并直接解码为 16kHz 单声道 WAV。
+    省去 multipart 解析、临时文件落盘和再次拷贝。
+    返回读取的原始字节数。
+    """
+    params = {k.lower(): v.lower() for k, v in (params or {}).items()}
+    if content_length is not None and content_length > max_bytes:
+        raise AudioUploadTooLarge(f"音频大小超过限制 ({max_bytes} bytes)")
+    # 在读取请求体之前校验参数
+    passthrough = mimetype.lower() == "audio/l16" and l16_params(params) == (TARGET_SAMPLE_RATE, 1)
+
+    logger.info("开始流式解码音频: %s %s -> %s", mimetype, params, output_path)
+    try:
+        if passthrough:
+            total = _write_l16_to_wav(stream, params, output_path, max_bytes)
+        else:
+            total = _pipe_stream_to_ffmpeg(stream, mimetype, params, output_path, max_bytes)
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    if total == 0:
+        raise Exception("输入音频为空")
+    if not os.path.exists(output_path) or os.path.getsize(output_path) <= 44:
+        raise Exception("输出文件生成失败或为空")
+    logger.info("流式解码完成，接收 %d bytes，输出文件大小: %d bytes", total, os.path.getsize(output_path))
+    return total
+
+
+class IncrementalDecoder:
+    """
+    持续接收压缩音频数据块并增量解码为 16kHz 单声道 s16le PCM。
+    常驻一个 ffmpeg 进程：数据块写入其标准输入，后台线程从标准输出读取已解码的 PCM。
+    16kHz 单声道 L16 直接透传，不启动 ffmpeg
+    """
+
+    def __init__(self, mimetype: str = "audio/webm", params: dict = None,
+                 max_bytes: int = MAX_AUDIO_UPLOAD_BYTES):
+        self.mimetype = mimetype.lower()
+        self.params = {k.lower(): v.lower() for k, v in (params or {}).items()}
+        self.max_bytes = max_bytes
+        self.received = 0
+        self._pcm = bytearray()
+        self._pending = b""
+        self._lock = threading.Lock()
+        self._process = None
+        self._reader = None
+
+        self._passthrough = (self.mimetype == "audio/l16"
+                             and l16_params(self.params) == (TARGET_SAMPLE_RATE, 1))
+        self._swap = self.params.get("endianness") != "little-endian" and sys.byteorder == "little"
+        if not self._passthrough:
+            cmd = [
+                'ffmpeg',
+                '-loglevel', 'error',
+                *_ffmpeg_input_args(self.mimetype, self.params),
+                '-i', 'pipe:0',
+                '-f', 's16le',
+                '-acodec', 'pcm_s16le',
+                '-ar', str(TARGET_SAMPLE_RATE),
+                '-ac', '1',
+                'pipe:1'
+            ]
+            try:
+                self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                 stderr=subprocess.DEVNULL)
+            except FileNotFoundError:
+                logger.error("ffmpeg 未找到，请确保已安装 ffmpeg")
+                raise Exception("ffmpeg 未安装")
+            self._reader = threading.Thread(target=self._read_output, name="ffmpeg-reader", daemon=True)
+            self._reader.start()
+
+    def _read_output(self):
+        while True:
+            data = self._process.stdout.read1(STREAM_READ_SIZE)
+            if not data:
+                break
+            with self._lock:
+                self._pcm.extend(data)
+
+    def feed(self, data: bytes):
+        """
+        写入一块压缩音频数据
+        """
+        self.received += len(data)
+        if self.received > self.max_bytes:
+            self.abort()
+            raise AudioUploadTooLarge(f"音频大小超过限制 ({self.max_bytes} bytes)")
+        if self._passthrough:
+            data = self._pending + data
+            usable = len(data) - (len(data) % 2)
+            self._pending = data[usable:]
+            samples = array.array('h', data[:usable])
+            if self._swap:
+                samples.byteswap()
+            with self._lock:
+                self._pcm.extend(samples.tobytes())
+            return
+        try:
+            self._process.stdin.write(data)
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            raise Exception(f"ffmpeg 解码进程已退出 (返回码: {self._process.poll()})")
+
+    def pcm(self) -> bytes:
+        """
+        返回目前为止已解码的全部 PCM 数据
+        """
+        with self._lock:
+            return bytes(self._pcm)
+
+    def decoded_seconds(self) -> float:
+        with self._lock:
+            return len(self._pcm) / 2 / TARGET_SAMPLE_RATE
+
+    def close(self, timeout: float = 30) -> bytes:
+        """
+        结束输入，等待 ffmpeg 输出剩余数据，返回完整的 PCM
+        """
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self._reader.join(timeout)
+            try:
+                self._process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                raise Exception("音频转换超时")
+        return self.pcm()
+
+    def abort(self):
+        """
+        丢弃数据并结束 ffmpeg 进程
+        """
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+
+def wav_duration(path: str) -> float:
+    """
+    读取 WAV 文件时长（秒），读取失败时返回 0
+    """
+    try:
+        with wave.open(path, 'rb') as wav:
+            return wav.getnframes() / float(wav.getframerate() or TARGET_SAMPLE_RATE)
+    except (OSError, wave.Error, EOFError):
+        return 0.0
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 语音后端服务管理器
-提供启动、停止、状态检查等功能
+提供启动、停止、状态检查等功能；supervise 模式在一组端口上运行多个实例，
+通过 /health 判断就绪，崩溃、失去响应或内存占用过高的实例按退避间隔自动重启
 """
 import os
 import sys
@@ -9,8 +10,60 @@ import subprocess
 import time
 import signal
 import json
+import socket
+import urllib.request
 from pathlib import Path
 
+DEFAULT_PORT = int(os.getenv("BACKEND_PORT", "1013"))
+# 加载 Whisper 和 Piper 模型需要一段时间，超过该时长仍未通过健康检查视为启动失败
+STARTUP_TIMEOUT = float(os.getenv("BACKEND_STARTUP_TIMEOUT", "180"))
+
+def probe_health(port, timeout=2.0):
+    """请求实例的 /health，返回解析后的 JSON；未就绪或无响应时返回 None"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=timeout) as response:
+            if response.status != 200:
+                return None
+            return json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def wait_until_healthy(port, process=None, timeout=STARTUP_TIMEOUT, interval=1.0):
+    """等待实例通过健康检查；进程提前退出或超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        if probe_health(port):
+            return True
+        time.sleep(interval)
+    return False
+
+def port_in_use(port):
+    """检查端口是否已被其他进程监听"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("0.0.0.0", port))
+            return False
+        except OSError:
+            return True
+
+def read_rss_mb(pid):
+    """读取进程的常驻内存（MB），无法读取时返回 None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        result = subprocess.run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True)
+        return int(result.stdout.strip()) / 1024 if result.stdout.strip() else None
+    except (OSError, ValueError):
+        return None
+
 class BackendManager:
     def __init__(self):
         self.backend_dir = Path(__file__).parent
@@ -58,16 +111,16 @@ class BackendManager:
             with open(self.pid_file, 'w') as f:
                 f.write(str(process.pid))
             
-            # 等待服务启动
-            time.sleep(3)
-            
-            if self.is_running():
+            # 等待服务通过健康检查
+            print(f"⏳ 等待服务就绪（最长 {STARTUP_TIMEOUT:.0f} 秒）...")
+            if wait_until_healthy(DEFAULT_PORT, process) and self.is_running():
                 print("✅ 后端服务启动成功")
-                print(f"📍 服务地址: http://localhost:1013")
+                print(f"📍 服务地址: http://localhost:{DEFAULT_PORT}")
                 print(f"📝 日志文件: {self.log_file}")
                 return True
             else:
                 print("❌ 后端服务启动失败")
+                print(f"📝 请查看日志: {self.log_file}")
                 return False
                 
         except Exception as e:
@@ -114,14 +167,61 @@ class BackendManager:
     def status(self):
         """检查服务状态"""
         if self.is_running():
-            print("✅ 后端服务正在运行")
-            print(f"📍 服务地址: http://localhost:1013")
+            health = probe_health(DEFAULT_PORT)
+            print("✅ 后端服务正在运行" if health else "⚠️  后端进程存在，但健康检查未通过")
+            print(f"📍 服务地址: http://localhost:{DEFAULT_PORT}")
             print(f"📝 日志文件: {self.log_file}")
             return True
         else:
             print("❌ 后端服务未运行")
             return False
     
+    def instances(self):
+        """查看 supervise 模式下各实例的状态"""
+        status_file = self.backend_dir / "supervisor.json"
+        if not status_file.exists():
+            print("ℹ️  supervise 模式未运行")
+            return False
+        with open(status_file, 'r') as f:
+            status = json.load(f)
+
+        supervisor_pid = status.get("supervisor_pid")
+        try:
+            os.kill(supervisor_pid, 0)
+            alive = True
+        except (OSError, TypeError):
+            alive = False
+        age = time.time() - status.get("updated_at", 0)
+        print(f"{'✅' if alive else '❌'} 监控进程 PID: {supervisor_pid}（状态更新于 {age:.0f} 秒前）")
+        print("-" * 50)
+        print(f"{'#':<3}{'端口':<8}{'PID':<9}{'状态':<12}{'运行秒数':<10}{'内存MB':<9}{'重启':<6}最近重启原因")
+        for inst in status.get("instances", []):
+            print(f"{inst['index']:<3}{inst['port']:<8}{str(inst['pid'] or '-'):<9}{inst['state']:<12}"
+                  f"{str(inst['uptime_seconds'] or '-'):<10}{str(inst['rss_mb'] or '-'):<9}"
+                  f"{inst['restarts']:<6}{inst['last_restart_reason'] or '-'}")
+        return alive
+
+    def stop_supervisor(self):
+        """停止 supervise 模式（监控进程会先停止所有实例）"""
+        pid_file = self.backend_dir / "supervisor.pid"
+        if not pid_file.exists():
+            print("ℹ️  supervise 模式未运行")
+            return True
+        try:
+            with open(pid_file, 'r') as f:
+                pid = int(f.read().strip())
+            os.kill(pid, signal.SIGTERM)
+            for _ in range(30):
+                time.sleep(1)
+                os.kill(pid, 0)
+            print("⚠️  监控进程仍未退出")
+            return False
+        except (OSError, ValueError):
+            if pid_file.exists():
+                pid_file.unlink()
+            print("✅ supervise 模式已停止")
+            return True
+
     def logs(self, lines=50):
         """查看服务日志"""
         if not self.log_file.exists():
@@ -141,12 +241,251 @@ class BackendManager:
         except Exception as e:
             print(f"❌ 读取日志失败: {e}")
 
+class BackendInstance:
+    """supervise 模式下的一个后端实例"""
+
+    def __init__(self, index, port, log_file):
+        self.index = index
+        self.port = port
+        self.log_file = log_file
+        self.process = None
+        # starting / ready / unhealthy / backoff / port_busy / stopped
+        self.state = "stopped"
+        self.started_at = None
+        self.ready_at = None
+        self.next_start_at = 0.0
+        self.restarts = 0
+        self.consecutive_restarts = 0
+        self.health_failures = 0
+        self.rss_mb = None
+        self.last_restart_reason = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def to_dict(self):
+        now = time.monotonic()
+        return {
+            "index": self.index,
+            "port": self.port,
+            "pid": self.pid,
+            "state": self.state,
+            "uptime_seconds": round(now - self.started_at, 1) if self.started_at and self.process else None,
+            "restarts": self.restarts,
+            "last_restart_reason": self.last_restart_reason,
+            "next_start_in_seconds": round(max(0.0, self.next_start_at - now), 1)
+                                     if self.state in ("backoff", "port_busy") else None,
+            "rss_mb": round(self.rss_mb, 1) if self.rss_mb is not None else None,
+            "log_file": str(self.log_file),
+        }
+
+
+class Supervisor:
+    """
+    在连续端口上运行多个后端实例并持续监控：
+    - 启动后轮询 /health，通过后才视为就绪
+    - 进程退出、健康检查连续失败、启动超时或常驻内存超过上限时重启
+    - 重启间隔按指数退避，实例稳定运行一段时间后退避清零
+    - 每轮检查后把各实例状态写入 supervisor.json，供 instances 命令查看
+    """
+
+    def __init__(self, backend_dir, instances, base_port=DEFAULT_PORT, host="0.0.0.0",
+                 max_rss_mb=0, startup_timeout=STARTUP_TIMEOUT, check_interval=2.0,
+                 max_health_failures=3, backoff_base=1.0, backoff_max=60.0, stable_seconds=60.0):
+        self.backend_dir = Path(backend_dir)
+        self.host = host
+        self.max_rss_mb = max_rss_mb
+        self.startup_timeout = startup_timeout
+        self.check_interval = check_interval
+        self.max_health_failures = max_health_failures
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_seconds = stable_seconds
+        self.pid_file = self.backend_dir / "supervisor.pid"
+        self.status_file = self.backend_dir / "supervisor.json"
+        self.instances = [
+            BackendInstance(i, base_port + i, self.backend_dir / f"backend.{base_port + i}.log")
+            for i in range(instances)
+        ]
+        self._stopping = False
+
+    @classmethod
+    def from_env(cls, backend_dir, instances=None, base_port=None):
+        cpu_count = os.cpu_count() or 1
+        if instances is None:
+            # 每个实例内部已有多线程推理，默认每 4 个核心运行一个实例
+            instances = int(os.getenv("SUPERVISOR_INSTANCES", str(max(1, cpu_count // 4))))
+        return cls(
+            backend_dir,
+            instances,
+            base_port=base_port if base_port is not None else DEFAULT_PORT,
+            host=os.getenv("BACKEND_HOST", "0.0.0.0"),
+            max_rss_mb=float(os.getenv("SUPERVISOR_MAX_RSS_MB", "0")),
+            startup_timeout=STARTUP_TIMEOUT,
+            check_interval=float(os.getenv("SUPERVISOR_CHECK_INTERVAL", "2")),
+            max_health_failures=int(os.getenv("SUPERVISOR_HEALTH_FAILURES", "3")),
+            backoff_base=float(os.getenv("SUPERVISOR_BACKOFF_BASE", "1")),
+            backoff_max=float(os.getenv("SUPERVISOR_BACKOFF_MAX", "60")),
+            stable_seconds=float(os.getenv("SUPERVISOR_STABLE_SECONDS", "60")),
+        )
+
+    def _instance_env(self, instance):
+        env = dict(os.environ)
+        env["BACKEND_PORT"] = str(instance.port)
+        env["BACKEND_HOST"] = self.host
+        # 调试模式的自动重载会再派生一个子进程，监控到的 PID 与实际服务进程不一致
+        env["BACKEND_DEBUG"] = "0"
+        # 同一台机器上的实例之间通过本机地址转发音频请求；跨机器部署时用 INSTANCE_URL=http://<主机>:{port} 指定
+        env.setdefault("INSTANCE_URL", "http://127.0.0.1:{port}")
+        # 多个实例平分 CPU 核心，避免每个实例的推理线程都占满整台机器
+        threads = str(max(1, (os.cpu_count() or 1) // len(self.instances)))
+        env.setdefault("OMP_NUM_THREADS", threads)
+        env.setdefault("WHISPER_WORKERS", str(min(4, int(threads))))
+        return env
+
+    def _spawn(self, instance):
+        if port_in_use(instance.port):
+            # 端口被其他进程占用：不强行杀掉，稍后重试
+            print(f"⚠️  端口 {instance.port} 已被占用，稍后重试")
+            instance.state = "port_busy"
+            instance.next_start_at = time.monotonic() + self.backoff_max
+            return
+        with open(instance.log_file, 'a') as log:
+            instance.process = subprocess.Popen(
+                [sys.executable, 'app.py'],
+                cwd=self.backend_dir,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                env=self._instance_env(instance),
+                preexec_fn=os.setsid
+            )
+        instance.state = "starting"
+        instance.started_at = time.monotonic()
+        instance.ready_at = None
+        instance.health_failures = 0
+        instance.rss_mb = None
+        print(f"🚀 实例 #{instance.index} 启动中，端口: {instance.port}，PID: {instance.pid}")
+
+    def _terminate(self, instance, timeout=10.0):
+        process = instance.process
+        if process is None:
+            return
+        if process.poll() is None:
+            try:
+                os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+                process.wait()
+            except ProcessLookupError:
+                pass
+        instance.process = None
+
+    def _restart_later(self, instance, reason):
+        self._terminate(instance)
+        delay = min(self.backoff_base * (2 ** instance.consecutive_restarts), self.backoff_max)
+        instance.consecutive_restarts += 1
+        instance.restarts += 1
+        instance.last_restart_reason = reason
+        instance.state = "backoff"
+        instance.next_start_at = time.monotonic() + delay
+        print(f"🔄 实例 #{instance.index}（端口 {instance.port}）{reason}，{delay:.0f} 秒后重启")
+
+    def check(self, instance):
+        """检查一个实例并在需要时安排重启"""
+        now = time.monotonic()
+        if instance.state in ("backoff", "port_busy", "stopped"):
+            if now >= instance.next_start_at:
+                self._spawn(instance)
+            return
+
+        code = instance.process.poll()
+        if code is not None:
+            self._restart_later(instance, f"进程已退出（退出码 {code}）")
+            return
+
+        instance.rss_mb = read_rss_mb(instance.pid)
+        if self.max_rss_mb and instance.rss_mb and instance.rss_mb > self.max_rss_mb:
+            self._restart_later(instance, f"内存占用过高（{instance.rss_mb:.0f} MB > {self.max_rss_mb:.0f} MB）")
+            return
+
+        health = probe_health(instance.port)
+        # 端口上响应的必须是本实例，而不是残留的其他进程
+        healthy = bool(health) and health.get("pid") in (None, instance.pid)
+
+        if instance.state == "starting":
+            if healthy:
+                instance.state = "ready"
+                instance.ready_at = now
+                print(f"✅ 实例 #{instance.index} 已就绪，端口: {instance.port}，"
+                      f"启动耗时 {now - instance.started_at:.1f} 秒")
+            elif now - instance.started_at > self.startup_timeout:
+                self._restart_later(instance, f"启动超时（{self.startup_timeout:.0f} 秒内未通过健康检查）")
+            return
+
+        if healthy:
+            instance.health_failures = 0
+            instance.state = "ready"
+            if instance.ready_at and now - instance.ready_at >= self.stable_seconds:
+                instance.consecutive_restarts = 0
+            return
+
+        instance.health_failures += 1
+        instance.state = "unhealthy"
+        if instance.health_failures >= self.max_health_failures:
+            self._restart_later(instance, f"健康检查连续失败 {instance.health_failures} 次")
+
+    def status(self):
+        return {
+            "supervisor_pid": os.getpid(),
+            "updated_at": time.time(),
+            "instances": [instance.to_dict() for instance in self.instances],
+        }
+
+    def _write_status(self):
+        tmp = self.status_file.with_suffix(".json.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.status(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.status_file)
+
+    def _handle_signal(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        """前台运行监控循环，收到 SIGTERM/SIGINT 后停止所有实例"""
+        with open(self.pid_file, 'w') as f:
+            f.write(str(os.getpid()))
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        ports = f"{self.instances[0].port}-{self.instances[-1].port}"
+        print(f"🎛️  supervise 模式：{len(self.instances)} 个实例，端口 {ports}")
+        try:
+            for instance in self.instances:
+                self._spawn(instance)
+            while not self._stopping:
+                for instance in self.instances:
+                    self.check(instance)
+                self._write_status()
+                time.sleep(self.check_interval)
+        finally:
+            print("🛑 正在停止所有实例...")
+            for instance in self.instances:
+                self._terminate(instance)
+                instance.state = "stopped"
+            self._write_status()
+            if self.pid_file.exists():
+                self.pid_file.unlink()
+            print("✅ 所有实例已停止")
+
 def main():
     """主函数"""
     manager = BackendManager()
     
     if len(sys.argv) < 2:
         print("用法: python backend_manager.py [start|stop|restart|status|logs]")
+        print("      python backend_manager.py supervise [实例数] [起始端口]")
+        print("      python backend_manager.py [instances|supervise-stop]")
         sys.exit(1)
     
     command = sys.argv[1].lower()
@@ -166,9 +505,19 @@ def main():
     elif command == "logs":
         lines = int(sys.argv[2]) if len(sys.argv) > 2 else 50
         manager.logs(lines)
+    elif command == "supervise":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        base_port = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        Supervisor.from_env(manager.backend_dir, count, base_port).run()
+    elif command == "instances":
+        success = manager.instances()
+        sys.exit(0 if success else 1)
+    elif command == "supervise-stop":
+        success = manager.stop_supervisor()
+        sys.exit(0 if success else 1)
     else:
         print(f"❌ 未知命令: {command}")
-        print("可用命令: start, stop, restart, status, logs")
+        print("可用命令: start, stop, restart, status, logs, supervise, instances, supervise-stop")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+"""
+录音归档批量转写（离线命令行工具）
+
+用法:
+  python batch_transcribe.py <录音目录> <输出目录> [--workers N] [--threads N] [--model base]
+                             [--language zh] [--srt] [--ext .wav,.mp3,...] [--retry-failed]
+
+- 递归遍历录音目录，用多个进程并行转换（convert_audio_to_wav）和识别（whisper_engine）
+- 每个进程加载一份模型；启用模型缓存（MODEL_CACHE=1）时各进程共享 mmap 的权重
+- 结果逐条追加到 <输出目录>/transcripts.jsonl，失败记录到 errors.jsonl；--srt 时另外输出字幕文件
+- transcripts.jsonl 同时是断点记录：重新运行时跳过已完成且未修改（大小、修改时间相同）的文件
+- 定期打印进度和吞吐量（每小时墙钟时间能转写多少小时录音）
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger("batch_transcribe")
+
+DEFAULT_EXTENSIONS = ".wav,.mp3,.m4a,.aac,.ogg,.opus,.webm,.flac,.amr,.wma"
+
+# 工作进程内的全局状态
+_decode_options = None
+
+
+def _init_worker(model, threads, decode_values):
+    """
+    工作进程初始化：每个进程单线程识别，由进程数决定并行度，避免线程之间争抢 CPU
+    """
+    global _decode_options
+    os.environ["WHISPER_MODEL"] = model
+    os.environ["WHISPER_WORKERS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    from whisper_engine import parse_decode_options
+    _decode_options = parse_decode_options(decode_values)
+
+
+def _transcribe_file(path, rel_path, tmp_dir):
+    from audio_utils import convert_audio_to_wav
+    from whisper_engine import transcribe
+
+    stat = os.stat(path)
+    record = {"file": rel_path, "size": stat.st_size, "mtime": int(stat.st_mtime)}
+    started = time.monotonic()
+    wav_path = os.path.join(tmp_dir, f"{os.getpid()}_{time.monotonic_ns()}.wav")
+    try:
+        convert_audio_to_wav(path, wav_path)
+        result = transcribe(wav_path, dict(_decode_options))
+        record.update({
+            "text": result["text"],
+            "language": result["language"],
+            "duration": result["duration"],
+            "segments": result["segments"],
+            "model": result["decode"]["model"],
+        })
+    except Exception as e:
+        record["error"] = str(e)
+    finally:
+        if os.path.exists(wav_path):
+            os.remove(wav_path)
+    record["elapsed"] = round(time.monotonic() - started, 2)
+    return record
+
+
+def find_recordings(root, extensions):
+    """
+    递归查找录音文件，返回 (绝对路径, 相对路径) 列表
+    """
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in extensions:
+                path = os.path.join(dirpath, filename)
+                found.append((path, os.path.relpath(path, root)))
+    return found
+
+
+def load_checkpoint(jsonl_path):
+    """
+    读取已完成的记录，返回 {相对路径: (大小, 修改时间)}。崩溃时最后一行可能不完整，直接忽略
+    """
+    done = {}
+    if not os.path.exists(jsonl_path):
+        return done
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record["file"]] = (record["size"], record["mtime"])
+    return done
+
+
+def _srt_time(seconds):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def write_srt(path, segments):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for index, seg in enumerate(segments, 1):
+            f.write(f"{index}\n{_srt_time(seg['start'])} --> {_srt_time(seg['end'])}\n{seg['text']}\n\n")
+
+
+class Progress:
+    """
+    进度和吞吐量统计
+    """
+
+    def __init__(self, total, interval=30.0):
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.done = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+
+    def add(self, record):
+        self.done += 1
+        if "error" in record:
+            self.failed += 1
+        else:
+            self.audio_seconds += record["duration"]
+        now = time.monotonic()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now=None):
+        wall = (now or time.monotonic()) - self.started
+        speed = self.audio_seconds / wall if wall > 0 else 0.0
+        remaining = (self.total - self.done) * wall / self.done if self.done else 0.0
+        print(f"[{self.done}/{self.total}] 失败 {self.failed}，录音 {self.audio_seconds / 3600:.2f} 小时，"
+              f"用时 {wall / 3600:.2f} 小时，吞吐量 {speed:.1f} 录音小时/小时，预计剩余 {remaining / 60:.0f} 分钟",
+              flush=True)
+
+
+def run(args):
+    extensions = {e.strip().lower() if e.strip().startswith(".") else "." + e.strip().lower()
+                  for e in args.ext.split(",") if e.strip()}
+    os.makedirs(args.output, exist_ok=True)
+    jsonl_path = os.path.join(args.output, "transcripts.jsonl")
+    errors_path = os.path.join(args.output, "errors.jsonl")
+
+    recordings = find_recordings(args.input, extensions)
+    done = load_checkpoint(jsonl_path)
+    if not args.retry_failed:
+        done.update(load_checkpoint(errors_path))
+    pending = []
+    for path, rel_path in recordings:
+        stat = os.stat(path)
+        if done.get(rel_path) != (stat.st_size, int(stat.st_mtime)):
+            pending.append((stat.st_size, path, rel_path))
+    # 大文件先处理，避免最后只剩一个进程在处理长录音
+    pending.sort(reverse=True)
+    print(f"共 {len(recordings)} 个录音，已完成 {len(recordings) - len(pending)} 个，待处理 {len(pending)} 个，"
+          f"{args.workers} 个进程 × {args.threads} 线程", flush=True)
+    if not pending:
+        return 0
+
+    # 服务默认关闭时间戳以加快解码，批处理输出的分段（以及 --srt 字幕）需要准确的时间戳
+    decode_values = {"without_timestamps": "false"}
+    if args.language:
+        decode_values["language"] = args.language
+    progress = Progress(len(pending), args.report_interval)
+    with tempfile.TemporaryDirectory(prefix="batch_transcribe_") as tmp_dir, \
+            open(jsonl_path, "a", encoding="utf-8") as out, open(errors_path, "a", encoding="utf-8") as errors, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                initargs=(args.model, args.threads, decode_values)) as pool:
+        queue = iter(pending)
+        running = set()
+        # 同时提交的任务数有上限，数千个文件时不会一次性占满内存
+        while True:
+            for _, path, rel_path in queue:
+                running.add(pool.submit(_transcribe_file, path, rel_path, tmp_dir))
+                if len(running) >= args.workers * 2:
+                    break
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                if "error" in record:
+                    logger.error("转写失败: %s (%s)", record["file"], record["error"])
+                    target = errors
+                else:
+                    if args.srt:
+                        write_srt(os.path.join(args.output, "srt", os.path.splitext(record["file"])[0] + ".srt"),
+                                  record["segments"])
+                    target = out
+                target.write(json.dumps(record, ensure_ascii=False) + "\n")
+                # 每条记录都落盘，崩溃后最多重做正在处理的文件
+                target.flush()
+                os.fsync(target.fileno())
+                progress.add(record)
+    progress.report()
+    return 1 if progress.failed else 0
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="录音归档批量转写")
+    parser.add_argument("input", help="录音目录")
+    parser.add_argument("output", help="输出目录")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="进程数")
+    parser.add_argument("--threads", type=int, default=2, help="每个进程的计算线程数")
+    parser.add_argument("--model", default=os.getenv("WHISPER_MODEL", "base"), help="Whisper 模型")
+    parser.add_argument("--language", default=None, help="识别语言，默认使用服务的默认设置")
+    parser.add_argument("--srt", action="store_true", help="同时输出 SRT 字幕")
+    parser.add_argument("--ext", default=DEFAULT_EXTENSIONS, help="录音文件扩展名，逗号分隔")
+    parser.add_argument("--retry-failed", action="store_true", help="重新处理之前失败的文件")
+    parser.add_argument("--report-interval", type=float, default=30.0, help="进度打印间隔（秒）")
+    args = parser.parse_args()
+    if not os.path.isdir(args.input):
+        print(f"❌ 录音目录不存在: {args.input}")
+        sys.exit(2)
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
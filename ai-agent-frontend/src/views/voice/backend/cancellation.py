@@ -0,0 +1,165 @@
+"""
+任务取消支持
+每个异步任务持有一个 CancelToken；同一会话的任务按“轮次”分组，
+新一轮对话（/speech 或 /text）到达时自动取消该会话上一轮尚未完成的任务。
+任务可以带截止时间，超过后视为以 "deadline" 原因取消
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger("cancellation")
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+class CancelToken:
+    """
+    可在线程间共享的取消标记。
+    工作线程在循环中调用 raise_if_cancelled()；阻塞在 I/O 上的代码可以注册回调，
+    在取消时主动关闭连接
+    """
+
+    def __init__(self, job_id, session_id=None, deadline=None):
+        self.job_id = job_id
+        self.session_id = session_id
+        # 截止时间（time.time() 时间戳），None 表示不限
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        self._check_deadline()
+        return self._event.is_set()
+
+    def remaining(self):
+        """
+        距截止时间的秒数，没有截止时间时返回 None
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def limit_deadline(self, deadline):
+        """
+        收紧截止时间：deadline 早于当前截止时间（或当前不限）时替换
+        """
+        if deadline is not None and (self.deadline is None or deadline < self.deadline):
+            self.deadline = deadline
+
+    def _check_deadline(self):
+        if self.deadline is not None and not self._event.is_set() and time.time() >= self.deadline:
+            self.cancel("deadline")
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("取消回调执行失败，任务: %s，错误: %s", self.job_id, e)
+        return True
+
+    def on_cancel(self, callback):
+        """
+        注册取消时执行的回调；已取消时立即执行
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        self._check_deadline()
+        if self._event.is_set():
+            raise JobCancelled(f"任务已取消: {self.job_id} ({self.reason})")
+
+    def wait(self, timeout):
+        """
+        可被取消打断的 sleep，返回 True 表示已取消（包括等待期间到达截止时间）
+        """
+        remaining = self.remaining()
+        if remaining is not None and (timeout is None or remaining <= timeout):
+            self._event.wait(remaining)
+            self._check_deadline()
+            return self._event.is_set()
+        return self._event.wait(timeout)
+
+
+class CancellationRegistry:
+    """
+    记录正在进行的任务及其所属会话
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def register(self, job_id, session_id=None, new_turn=False, deadline=None):
+        """
+        为任务创建取消标记。new_turn=True 时先取消该会话之前的所有任务（打断/重新提问）。
+        deadline 为截止时间戳。返回 (token, 被取消的任务ID列表)
+        """
+        cancelled = []
+        if session_id and new_turn:
+            cancelled = self.cancel_session(session_id, reason="superseded")
+        token = CancelToken(job_id, session_id, deadline)
+        with self._lock:
+            self._tokens[job_id] = token
+            if session_id:
+                self._sessions.setdefault(session_id, set()).add(job_id)
+        return token, cancelled
+
+    def get(self, job_id):
+        with self._lock:
+            return self._tokens.get(job_id)
+
+    def cancel(self, job_id, reason="cancelled"):
+        token = self.get(job_id)
+        if token and token.cancel(reason):
+            logger.info("已取消任务: %s (%s)", job_id, reason)
+            return True
+        return False
+
+    def cancel_session(self, session_id, reason="cancelled"):
+        with self._lock:
+            job_ids = list(self._sessions.get(session_id, ()))
+        cancelled = [job_id for job_id in job_ids if self.cancel(job_id, reason)]
+        if cancelled:
+            logger.info("会话 %s 已取消 %d 个任务", session_id, len(cancelled))
+        return cancelled
+
+    def finish(self, job_id):
+        """
+        任务结束（完成、失败或取消）后移除记录
+        """
+        with self._lock:
+            token = self._tokens.pop(job_id, None)
+            if token and token.session_id in self._sessions:
+                jobs = self._sessions[token.session_id]
+                jobs.discard(job_id)
+                if not jobs:
+                    del self._sessions[token.session_id]
+
+    def active_jobs(self, session_id=None):
+        with self._lock:
+            if session_id:
+                return sorted(self._sessions.get(session_id, ()))
+            return sorted(self._tokens)
@@ -0,0 +1,234 @@
+"""
+对话记录存储（审计用）
+识别文本、用户提问和模型回复追加写入 SQLite。为了不给请求路径增加磁盘延迟，
+记录先放入有界内存队列，由后台线程按批写入（write-behind）：
+- 每批最多 batch_size 条，或等待 flush_interval 秒后写入已有的记录
+- fsync 策略（CONVERSATION_FSYNC）：
+  full   每批提交都落盘（SQLite synchronous=FULL）
+  normal WAL 模式下检查点时落盘，进程崩溃不丢数据，断电可能丢失最近几批（默认）
+  off    交给操作系统，最快
+- 队列满时的背压策略（CONVERSATION_OVERFLOW）：
+  block  调用方最多等待 put_timeout 秒，仍然满则丢弃（默认）
+  drop   立即丢弃
+  丢弃的条数计入 stats()，不会让请求失败
+"""
+import os
+import json
+import time
+import queue
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger("conversation_store")
+
+FSYNC_POLICIES = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+OVERFLOW_POLICIES = ("block", "drop")
+
+# 记录类型：transcript 语音识别结果，prompt 发给模型的文本，reply 模型回复
+RECORD_KINDS = ("transcript", "prompt", "reply")
+
+_STOP = object()
+
+
+class ConversationStore:
+    """
+    追加写入的对话记录，record() 只入队不阻塞（队列满时见背压策略）
+    """
+
+    def __init__(self, path, queue_size=10000, batch_size=200, flush_interval=1.0,
+                 fsync="normal", overflow="block", put_timeout=0.05):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 fsync 策略: {fsync}")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的队列溢出策略: {overflow}")
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.last_batch_seconds = 0.0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, session_id TEXT, "
+            "job_id TEXT, kind TEXT NOT NULL, text TEXT NOT NULL, meta TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS records_session ON records (session_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS records_created_at ON records (created_at)")
+
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return cls(
+            os.getenv("CONVERSATION_STORE_PATH", os.path.join(base_dir, "backend", "conversations.db")),
+            queue_size=int(os.getenv("CONVERSATION_QUEUE_SIZE", "10000")),
+            batch_size=int(os.getenv("CONVERSATION_BATCH_SIZE", "200")),
+            flush_interval=float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "1.0")),
+            fsync=os.getenv("CONVERSATION_FSYNC", "normal").lower(),
+            overflow=os.getenv("CONVERSATION_OVERFLOW", "block").lower(),
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute(f"PRAGMA synchronous={FSYNC_POLICIES[self.fsync]}")
+            self._local.conn = conn
+        return conn
+
+    # --- 写入 ---
+
+    def record(self, session_id, kind, text, job_id=None, **meta):
+        """
+        追加一条记录，返回是否已入队（队列满被丢弃时返回 False）
+        """
+        if kind not in RECORD_KINDS:
+            raise ValueError(f"未知的记录类型: {kind}")
+        item = (time.time(), session_id, job_id, kind, text or "",
+                json.dumps(meta, ensure_ascii=False) if meta else None)
+        try:
+            if self.overflow == "block":
+                self._queue.put(item, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning("对话记录队列已满，累计丢弃 %d 条", dropped)
+            return False
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            stop = item is _STOP
+            batch = [] if stop else [item]
+            # 凑满一批或等到 flush_interval 后写入
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                self._write_batch(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        started = time.monotonic()
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO records (created_at, session_id, job_id, kind, text, meta) VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._stats_lock:
+                self.write_errors += 1
+                self.dropped += len(batch)
+            logger.error("对话记录写入失败，丢弃 %d 条: %s", len(batch), e)
+            return
+        with self._stats_lock:
+            self.written += len(batch)
+            self.batches += 1
+            self.last_batch_seconds = round(time.monotonic() - started, 4)
+
+    def flush(self, timeout=None):
+        """
+        等待队列中已有的记录写入磁盘，返回是否在超时前完成
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=5.0):
+        """
+        写完剩余记录后停止后台线程
+        """
+        if not self._writer.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("对话记录队列已满，关闭时未写入的记录将丢失")
+            return
+        self._writer.join(timeout)
+
+    # --- 查询 ---
+
+    def recent_sessions(self, limit=20, since=None):
+        """
+        最近有活动的会话，按最后活动时间倒序
+        """
+        rows = self._conn().execute(
+            "SELECT session_id, MIN(created_at), MAX(created_at), COUNT(*) FROM records "
+            "WHERE session_id IS NOT NULL AND created_at >= ? "
+            "GROUP BY session_id ORDER BY MAX(created_at) DESC LIMIT ?",
+            (since or 0.0, limit)
+        ).fetchall()
+        return [
+            {"session_id": session_id, "started_at": started_at, "last_at": last_at, "records": count}
+            for session_id, started_at, last_at, count in rows
+        ]
+
+    def session(self, session_id, limit=200):
+        """
+        某个会话最近的记录，按时间正序
+        """
+        rows = self._conn().execute(
+            "SELECT id, created_at, job_id, kind, text, meta FROM records WHERE session_id = ? "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (session_id, limit)
+        ).fetchall()
+        return [
+            {"id": record_id, "created_at": created_at, "job_id": job_id, "kind": kind, "text": text,
+             "meta": json.loads(meta) if meta else {}}
+            for record_id, created_at, job_id, kind, text, meta in reversed(rows)
+        ]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "write_errors": self.write_errors,
+                "last_batch_seconds": self.last_batch_seconds,
+                "fsync": self.fsync,
+                "overflow": self.overflow,
+            }
@@ -0,0 +1,318 @@
+"""
+异步任务结果存储
+多个后端实例部署在负载均衡后面时，状态查询可能落到与执行任务不同的实例上。
+这里把原来进程内的 async_results 字典抽象为可替换的存储：
+- memory：进程内字典（单实例，默认）
+- sqlite：本机磁盘上的 SQLite（WAL 模式），同一台机器上的多个实例共享
+- redis：Redis 或任何兼容 Redis 协议的服务（也可以传入 fakeredis 之类的本地替身客户端）
+
+所有存储都实现字典接口（[]、in、get、pop、del），结果超过 TTL 后自动清理
+（memory/sqlite 在保存时顺带清理，每 sweep_interval 秒最多一次）。
+任务ID带有所属实例的前缀（<实例ID>.<随机串>），其他实例据此把音频请求转发给生成它的实例
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis = None
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger("job_store")
+
+# 已结束但没人查询的任务结果保留多久
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+
+def _sanitize(name):
+    # 实例ID会出现在任务ID和文件名中，"." 用作分隔符，只保留字母、数字和 "-"
+    return "".join(c if c.isalnum() or c == "-" else "-" for c in name)
+
+
+# 当前实例的ID和其他实例访问本实例的地址。
+# INSTANCE_URL 中的 {port} 替换为本实例端口；共享存储（sqlite/redis）必须设置，
+# 默认的 127.0.0.1 在其他机器上指向的是它们自己
+_PORT = os.getenv("BACKEND_PORT", "1013")
+INSTANCE_ID = _sanitize(os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{_PORT}")
+INSTANCE_URL = (os.getenv("INSTANCE_URL") or "").replace("{port}", _PORT) or None
+
+
+def new_result_id():
+    """
+    生成带所属实例前缀的任务ID
+    """
+    return f"{INSTANCE_ID}.{uuid.uuid4().hex}"
+
+
+def result_owner(result_id):
+    """
+    从任务ID（或以任务ID命名的文件名）中取出所属实例ID，旧格式的ID返回 None
+    """
+    owner, sep, _ = result_id.partition(".")
+    return owner if sep and owner else None
+
+
+class JobStore(MutableMapping):
+    """
+    任务结果存储的公共接口。子类实现 _load/_save/_delete/_keys，值是可 JSON 序列化的字典
+    """
+
+    backend = "base"
+
+    def __init__(self, ttl=JOB_TTL_SECONDS, sweep_interval=60.0):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _sweep_due(self, now):
+        """
+        是否该清理过期结果：每 sweep_interval 秒最多一次，多个线程同时保存时只有一个执行清理
+        """
+        with self._sweep_lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return False
+            self._last_sweep = now
+            return True
+
+    def _load(self, key):
+        raise NotImplementedError
+
+    def _save(self, key, value):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def _keys(self):
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._save(key, value)
+
+    def __delitem__(self, key):
+        if not self._delete(key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self._load(key) is not None
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def register_instance(self, instance_id=INSTANCE_ID, url=None):
+        """
+        登记实例地址，供其他实例转发请求
+        """
+        url = url or INSTANCE_URL or f"http://127.0.0.1:{_PORT}"
+        self._save(f"instance:{instance_id}", {"url": url, "registered_at": time.time()})
+
+    def instance_url(self, instance_id):
+        info = self._load(f"instance:{instance_id}")
+        return info["url"] if info else None
+
+    def stats(self):
+        return {"backend": self.backend, "jobs": sum(1 for key in self._keys() if not key.startswith("instance:")),
+                "ttl_seconds": self.ttl, "instance_id": INSTANCE_ID}
+
+
+class MemoryJobStore(JobStore):
+    """
+    进程内存储，只在单实例部署时使用
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl=JOB_TTL_SECONDS, sweep_interval=60.0):
+        super().__init__(ttl, sweep_interval)
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        expired = [key for key, (_, updated_at) in self._data.items()
+                   if not key.startswith("instance:") and now - updated_at > self.ttl]
+        for key in expired:
+            del self._data[key]
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        return entry[0] if entry else None
+
+    def _save(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now)
+            if self._sweep_due(now):
+                self._sweep(now)
+
+    def _delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def _keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def pop(self, key, *default):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is not None:
+            return entry[0]
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLite（WAL 模式）存储。每个线程使用自己的连接，同一台机器上的多个实例可以共享同一个文件
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, ttl=JOB_TTL_SECONDS, sweep_interval=60.0):
+        super().__init__(ttl, sweep_interval)
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, key):
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, key, value):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO jobs (id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (key, json.dumps(value, ensure_ascii=False), now)
+        )
+        if self._sweep_due(now):
+            conn.execute("DELETE FROM jobs WHERE updated_at < ? AND id NOT LIKE 'instance:%'", (now - self.ttl,))
+
+    def _delete(self, key):
+        return self._conn().execute("DELETE FROM jobs WHERE id = ?", (key,)).rowcount > 0
+
+    def _keys(self):
+        return [row[0] for row in self._conn().execute("SELECT id FROM jobs")]
+
+    def pop(self, key, *default):
+        # RETURNING 需要 SQLite 3.35+，这里用事务保证读取和删除的原子性
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (key,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM jobs WHERE id = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row:
+            return json.loads(row[0])
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+
+class RedisJobStore(JobStore):
+    """
+    Redis 存储，依赖过期时间自动清理。client 可以是任何兼容 redis-py 接口的客户端
+    """
+
+    backend = "redis"
+
+    def __init__(self, client, ttl=JOB_TTL_SECONDS, prefix="voice:job:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, ttl=JOB_TTL_SECONDS, prefix="voice:job:"):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("redis 库未安装，无法使用 redis 任务存储")
+        return cls(redis.Redis.from_url(url), ttl=ttl, prefix=prefix)
+
+    def _load(self, key):
+        data = self.client.get(self.prefix + key)
+        return json.loads(data) if data else None
+
+    def _save(self, key, value):
+        # 实例登记不过期，任务结果按 TTL 过期
+        ttl = None if key.startswith("instance:") else max(1, int(self.ttl))
+        self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    def _delete(self, key):
+        return self.client.delete(self.prefix + key) > 0
+
+    def _keys(self):
+        keys = (k.decode() if isinstance(k, bytes) else k for k in self.client.scan_iter(self.prefix + "*"))
+        return [k[len(self.prefix):] for k in keys]
+
+    def pop(self, key, *default):
+        pipe = self.client.pipeline()
+        pipe.get(self.prefix + key)
+        pipe.delete(self.prefix + key)
+        data, _ = pipe.execute()
+        if data:
+            return json.loads(data)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+
+def create_job_store():
+    """
+    根据环境变量创建任务存储：
+    JOB_STORE=memory|sqlite|redis，JOB_STORE_PATH（sqlite 文件路径），JOB_STORE_URL（redis 地址）
+    """
+    backend = os.getenv("JOB_STORE", "memory").lower()
+    if backend != "memory" and not INSTANCE_URL:
+        raise RuntimeError(f"JOB_STORE={backend} 时必须设置 INSTANCE_URL（其他实例访问本实例的地址，可包含 {{port}}）")
+    if backend == "sqlite":
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.getenv("JOB_STORE_PATH", os.path.join(base_dir, "backend", "jobs.db"))
+        store = SQLiteJobStore(path)
+    elif backend == "redis":
+        store = RedisJobStore.from_url(os.getenv("JOB_STORE_URL", "redis://127.0.0.1:6379/0"))
+    elif backend == "memory":
+        store = MemoryJobStore()
+    else:
+        raise ValueError(f"未知的任务存储类型: {backend}")
+    store.register_instance()
+    logger.info("任务存储: %s，实例ID: %s，地址: %s", store.backend, INSTANCE_ID, store.instance_url(INSTANCE_ID))
+    return store
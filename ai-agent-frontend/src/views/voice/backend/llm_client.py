@@ -2,12 +2,47 @@ import requests
 import json
 import time
 import logging
+from cancellation import JobCancelled
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def call_local_llm(prompt: str, max_retries=3) -> str:
+# 带截止时间时请求超时的下限（秒），剩余时间很短时不至于传入 0 或极小的超时
+LLM_MIN_TIMEOUT = 0.5
+
+def _read_stream(response, cancel_token=None) -> str:
+    """
+    逐行读取 OpenAI 兼容接口的 SSE 流式响应，拼接出完整回复。
+    每收到一块都检查取消标记，取消时关闭连接让上游停止生成。
+    服务端忽略 stream 参数、直接返回 JSON 时按普通响应解析
+    """
+    if response.headers.get("Content-Type", "").split(";")[0].strip() == "application/json":
+        return response.json()["choices"][0]["message"]["content"]
+    parts = []
+    for line in response.iter_lines(decode_unicode=True):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+        chunk = json.loads(payload)
+        choices = chunk.get("choices") or []
+        if choices:
+            delta = choices[0].get("delta") or {}
+            content = delta.get("content")
+            if content:
+                parts.append(content)
+    return "".join(parts)
+
+def call_local_llm(prompt: str, max_retries=3, cancel_token=None, max_tokens=None) -> str:
+    """
+    调用本地 LLM（流式响应）。传入 cancel_token 后，取消时会中断 HTTP 流并抛出 JobCancelled。
+    max_tokens 不指定时默认 500，过载降级时传入更小的值。
+    cancel_token 带截止时间时，连接和读取的超时不超过剩余时间，过期后不再重试
+    """
     # 从环境变量获取 LLM 服务地址，默认为 LM Studio 默认端口
     import os
     url = os.getenv("LLM_URL", "http://localhost:1234/v1/chat/completions")
@@ -19,20 +54,34 @@ def call_local_llm(prompt: str, max_retries=3) -> str:
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.7,
-        "max_tokens": 500  # 限制最大token数以加快响应速度
+        "max_tokens": max_tokens or 500,  # 限制最大token数以加快响应速度
+        "stream": True  # 流式返回，便于在生成过程中取消
     }
     
     logger.info("开始调用本地LLM，提示: %s", prompt[:50] + "..." if len(prompt) > 50 else prompt)
     
     # 实现重试机制
     for attempt in range(max_retries):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        # 没有截止时间时不设超时，允许无限等待
+        timeout = cancel_token.remaining() if cancel_token is not None else None
+        if timeout is not None:
+            if timeout <= 0:
+                cancel_token.cancel("deadline")
+                cancel_token.raise_if_cancelled()
+            timeout = max(timeout, LLM_MIN_TIMEOUT)
+        response = None
+        close_on_cancel = None
         try:
-            # 移除超时设置，允许无限等待
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = requests.post(url, headers=headers, data=json.dumps(data), stream=True, timeout=timeout)
+            if cancel_token is not None:
+                # 阻塞在读取上时，取消会直接关闭连接
+                close_on_cancel = response.close
+                cancel_token.on_cancel(close_on_cancel)
             if response.ok:
                 try:
-                    json_response = response.json()
-                    reply = json_response["choices"][0]["message"]["content"]
+                    reply = _read_stream(response, cancel_token)
                     # 检查回复是否有效
                     if reply is not None and isinstance(reply, str) and reply.strip() != "":
                         logger.info("LLM调用成功，响应长度: %d", len(reply))
@@ -54,27 +103,53 @@ def call_local_llm(prompt: str, max_retries=3) -> str:
                 if attempt == max_retries - 1:
                     return f"（调用本地模型失败，HTTP状态码: {response.status_code}）"
                 # 否则继续重试
+        except JobCancelled:
+            logger.info("LLM调用已取消")
+            raise
         except requests.exceptions.Timeout:
+            # 请求的截止时间已到
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             logger.warning("LLM调用超时，尝试次数: %d/%d", attempt + 1, max_retries)
             # 如果是最后一次尝试，返回超时信息
             if attempt == max_retries - 1:
                 return "（调用本地模型超时，请稍后重试）"
             # 否则等待一段时间后重试
-            time.sleep(2 ** attempt)  # 指数退避
+            _backoff(attempt, cancel_token)
         except requests.exceptions.ConnectionError:
+            # 取消时关闭连接也会表现为连接错误
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             logger.warning("无法连接到LLM，尝试次数: %d/%d", attempt + 1, max_retries)
             # 如果是最后一次尝试，返回连接错误信息
             if attempt == max_retries - 1:
                 return "（无法连接到本地模型，请检查 LM Studio 是否已启动）"
             # 否则等待一段时间后重试
-            time.sleep(2 ** attempt)  # 指数退避
+            _backoff(attempt, cancel_token)
         except Exception as e:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             logger.error("LLM调用发生未知错误: %s", e, exc_info=True)
             # 如果是最后一次尝试，返回错误信息
             if attempt == max_retries - 1:
                 return f"（调用本地模型时发生错误: {str(e)}）"
             # 否则继续重试
+        finally:
+            if close_on_cancel is not None:
+                cancel_token.remove_callback(close_on_cancel)
+            if response is not None:
+                response.close()
     
     # 如果所有重试都失败了，返回通用错误信息
     logger.error("LLM调用经过 %d 次重试后仍然失败", max_retries)
-    return "（AI处理失败，请稍后重试）"
\ No newline at end of file
+    return "（AI处理失败，请稍后重试）"
+
+def _backoff(attempt: int, cancel_token=None):
+    """
+    指数退避，等待期间可被取消打断
+    """
+    delay = 2 ** attempt
+    if cancel_token is None:
+        time.sleep(delay)
+    elif cancel_token.wait(delay):
+        cancel_token.raise_if_cancelled()
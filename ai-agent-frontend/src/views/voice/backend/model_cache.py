@@ -0,0 +1,325 @@
+"""
+模型缓存：首次运行时把模型转换为可内存映射的格式，之后直接 mmap 加载
+- Whisper：权重按 64 字节对齐连续写入 weights.bin，manifest.json 记录每个张量的 dtype/形状/偏移。
+  加载时在 meta 设备上构建模型结构（不分配、不随机初始化权重），再把 np.memmap 上的视图直接作为参数，
+  多个进程（以及同一进程内的多个模型副本）共享同一份物理页
+- Piper：用 onnxruntime 把 .onnx 优化后保存为 ORT 格式，启动时跳过图优化；
+  加载时开启 session.use_ort_model_bytes_directly / use_ort_model_bytes_for_initializers，
+  初始化器直接引用模型缓冲区而不再复制一份。onnxruntime 的 Python 接口只接受 bytes，
+  模型缓冲区是每个进程私有的一份，Piper 权重不在进程之间共享（只节省启动时间和进程内的重复副本）
+
+用法：
+    python model_cache.py build [whisper模型名] [piper语音名 ...]   预先生成缓存
+    python model_cache.py bench [进程数]                            启动耗时和内存占用对比
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import subprocess
+
+logger = logging.getLogger("model_cache")
+
+try:
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+except NameError:
+    BASE_DIR = os.getcwd()
+
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(BASE_DIR, "model_cache"))
+MODEL_CACHE_ENABLED = os.getenv("MODEL_CACHE", "1").lower() in ("1", "true", "yes", "on")
+
+# 缓存格式版本，格式变化时递增，旧缓存自动失效
+CACHE_FORMAT = 1
+ALIGNMENT = 64
+
+
+# --- Whisper ---
+
+def whisper_cache_dir(name, cache_dir=MODEL_CACHE_DIR):
+    return os.path.join(cache_dir, f"whisper-{name}")
+
+
+def build_whisper_cache(name, cache_dir=MODEL_CACHE_DIR):
+    """
+    加载原始 Whisper 检查点并写出 mmap 缓存（float32），返回缓存目录
+    """
+    import numpy as np
+    import whisper
+    from dataclasses import asdict
+
+    target = whisper_cache_dir(name, cache_dir)
+    tmp = f"{target}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    started = time.monotonic()
+    model = whisper.load_model(name, device="cpu")
+
+    tensors = {}
+    offset = 0
+    with open(os.path.join(tmp, "weights.bin"), "wb") as f:
+        for key, tensor in model.state_dict().items():
+            array = tensor.detach().cpu()
+            if array.is_floating_point():
+                array = array.float()
+            array = np.ascontiguousarray(array.numpy())
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            tensors[key] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            f.write(array.tobytes())
+            offset += array.nbytes
+
+    manifest = {"format": CACHE_FORMAT, "name": name, "dims": asdict(model.dims), "tensors": tensors}
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    del model
+
+    # 目录整体替换，多个进程同时生成时只有一个生效，读取方不会看到写了一半的缓存
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    logger.info("Whisper %s 缓存已生成: %s（%.1f MB，耗时 %.1f 秒）",
+                name, target, offset / 1024 / 1024, time.monotonic() - started)
+    return target
+
+
+def load_whisper_mmap(name, cache_dir=MODEL_CACHE_DIR):
+    """
+    从 mmap 缓存加载 Whisper 模型；缓存不存在时返回 None
+    """
+    import numpy as np
+    import torch
+    import whisper
+    from whisper.model import Whisper, ModelDimensions
+
+    target = whisper_cache_dir(name, cache_dir)
+    manifest_path = os.path.join(target, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != CACHE_FORMAT:
+        return None
+
+    # copy-on-write 映射：张量可写（torch 要求），但只要不写入就一直与其他进程共享页缓存
+    weights = np.memmap(os.path.join(target, "weights.bin"), dtype=np.uint8, mode="c")
+    state = {}
+    for key, info in manifest["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"])) if info["shape"] else 1
+        view = weights[info["offset"]:info["offset"] + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+        state[key] = torch.from_numpy(view)
+
+    dims = ModelDimensions(**manifest["dims"])
+    try:
+        # 在 meta 设备上构建结构，参数直接指向 mmap 视图，不做随机初始化也不复制
+        with torch.device("meta"):
+            model = Whisper(dims)
+        model.load_state_dict(state, assign=True)
+        # 非持久化 buffer 不在 state_dict 中，按 Whisper.__init__ 的方式在 CPU 上重建
+        n_ctx = dims.n_text_ctx
+        model.decoder.mask = torch.empty(n_ctx, n_ctx).fill_(-np.inf).triu_(1)
+        all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+        all_heads[dims.n_text_layer // 2:] = True
+        model.alignment_heads = all_heads.to_sparse()
+    except (AttributeError, TypeError):
+        # torch < 2.1 不支持 meta 设备上下文或 assign，退化为常规构建后复制
+        model = Whisper(dims)
+        model.load_state_dict(state)
+
+    alignment_heads = getattr(whisper, "_ALIGNMENT_HEADS", {}).get(name)
+    if alignment_heads is not None:
+        model.set_alignment_heads(alignment_heads)
+    return model
+
+
+def load_whisper_model(name, device="cpu"):
+    """
+    优先从 mmap 缓存加载 Whisper，缓存不存在时先生成；缓存不可用时回退到 whisper.load_model
+    """
+    import whisper
+
+    if MODEL_CACHE_ENABLED and device == "cpu":
+        try:
+            started = time.monotonic()
+            model = load_whisper_mmap(name)
+            if model is None:
+                build_whisper_cache(name)
+                model = load_whisper_mmap(name)
+            if model is not None:
+                logger.info("Whisper %s 已从 mmap 缓存加载，耗时 %.2f 秒", name, time.monotonic() - started)
+                return model
+        except Exception as e:
+            logger.warning("Whisper mmap 缓存不可用，回退到常规加载: %s", e, exc_info=True)
+    return whisper.load_model(name, device=device, in_memory=True)
+
+
+# --- Piper / onnxruntime ---
+
+def ort_cache_path(model_path, graph_opt_level, cache_dir=MODEL_CACHE_DIR):
+    """
+    ORT 格式模型的缓存路径。优化结果与 onnxruntime 版本、CPU 架构和优化级别有关，都计入文件名
+    """
+    import onnxruntime
+
+    stat = os.stat(model_path)
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    key = f"{name}-{int(stat.st_mtime)}-{stat.st_size}-ort{onnxruntime.__version__}-{platform.machine()}-{graph_opt_level}"
+    return os.path.join(cache_dir, "piper", key + ".ort")
+
+
+def build_ort_model(model_path, sess_options, cache_path):
+    """
+    用给定的会话选项优化模型并保存为 ORT 格式
+    """
+    import onnxruntime
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp = f"{cache_path}.tmp-{os.getpid()}"
+    sess_options.optimized_model_filepath = tmp
+    sess_options.add_session_config_entry("session.save_model_format", "ORT")
+    started = time.monotonic()
+    onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=["CPUExecutionProvider"])
+    os.replace(tmp, cache_path)
+    logger.info("Piper 模型已转换为 ORT 格式: %s（耗时 %.1f 秒）", cache_path, time.monotonic() - started)
+    return cache_path
+
+
+def load_ort_session(model_path, make_options, graph_opt_level="all"):
+    """
+    创建 onnxruntime 会话：优先使用 ORT 格式缓存（首次运行时生成），
+    make_options() 每次返回一个新的 SessionOptions（选项对象不能在会话之间复用）
+    """
+    import onnxruntime
+
+    if not MODEL_CACHE_ENABLED:
+        return onnxruntime.InferenceSession(model_path, sess_options=make_options(),
+                                            providers=["CPUExecutionProvider"])
+    try:
+        cache_path = ort_cache_path(model_path, graph_opt_level)
+        if not os.path.exists(cache_path):
+            build_ort_model(model_path, make_options(), cache_path)
+        options = make_options()
+        options.add_session_config_entry("session.load_model_format", "ORT")
+        # 初始化器直接引用模型缓冲区，不再单独复制
+        options.add_session_config_entry("session.use_ort_model_bytes_directly", "1")
+        options.add_session_config_entry("session.use_ort_model_bytes_for_initializers", "1")
+        # InferenceSession 只接受路径或 bytes，这里读入一份进程私有的缓冲区
+        with open(cache_path, "rb") as f:
+            model_bytes = f.read()
+        session = onnxruntime.InferenceSession(model_bytes, sess_options=options,
+                                               providers=["CPUExecutionProvider"])
+        # 使用 use_ort_model_bytes_directly 时缓冲区必须在会话存活期间保持有效
+        session._model_cache_bytes = model_bytes
+        return session
+    except Exception as e:
+        logger.warning("ORT 格式缓存不可用，回退到直接加载 %s: %s", model_path, e)
+        return onnxruntime.InferenceSession(model_path, sess_options=make_options(),
+                                            providers=["CPUExecutionProvider"])
+
+
+# --- 基准测试 ---
+
+def _memory_mb():
+    """
+    返回当前进程的 RSS 和 PSS（MB）。PSS 把共享页按共享进程数分摊，更能反映多进程的实际占用
+    """
+    rss = pss = None
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith("Pss:"):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, pss
+
+
+def _bench_child(kind, mode, hold):
+    """
+    子进程：按指定方式加载一次模型，停留 hold 秒让其他进程同时在线，然后输出耗时和内存
+    """
+    # tts_manager 导入的是 model_cache 模块本身而不是 __main__，开关通过环境变量传递
+    os.environ["MODEL_CACHE"] = "1" if mode == "mmap" else "0"
+    import model_cache
+    started = time.monotonic()
+    if kind == "whisper":
+        model = model_cache.load_whisper_model(os.getenv("WHISPER_MODEL", "base"))
+    else:
+        from tts_manager import PiperVoiceManager
+        manager = PiperVoiceManager.from_env(os.path.join(BASE_DIR, "piper_models"), "zh_CN-huayan-medium")
+        model = manager.get()
+    elapsed = time.monotonic() - started
+    time.sleep(hold)
+    rss, pss = _memory_mb()
+    print(json.dumps({"seconds": elapsed, "rss_mb": rss, "pss_mb": pss}))
+    del model
+
+
+def benchmark(processes=3, hold=5.0):
+    """
+    对 Whisper 和 Piper 分别用常规加载和缓存加载启动 processes 个并发进程，报告加载耗时和内存
+    """
+    # 先生成缓存，不计入加载耗时
+    for kind in ("whisper", "piper"):
+        subprocess.run([sys.executable, __file__, "_load", kind, "mmap", "0"], capture_output=True)
+
+    print(f"{'模型':<9}{'加载方式':<10}{'平均耗时(秒)':<14}{'平均RSS(MB)':<14}{'平均PSS(MB)':<14}{'PSS合计(MB)'}")
+    for kind in ("whisper", "piper"):
+        for mode in ("default", "mmap"):
+            children = [
+                subprocess.Popen([sys.executable, __file__, "_load", kind, mode, str(hold)],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                for _ in range(processes)
+            ]
+            results = []
+            for child in children:
+                output, _ = child.communicate()
+                lines = [line for line in output.splitlines() if line.startswith("{")]
+                if child.returncode == 0 and lines:
+                    results.append(json.loads(lines[-1]))
+            if not results:
+                print(f"{kind:<9}{mode:<10}加载失败")
+                continue
+
+            def avg(key):
+                values = [r[key] for r in results if r[key] is not None]
+                return sum(values) / len(values) if values else float("nan")
+
+            pss_total = sum(r["pss_mb"] or 0 for r in results)
+            print(f"{kind:<9}{mode:<10}{avg('seconds'):<14.2f}{avg('rss_mb'):<14.1f}{avg('pss_mb'):<14.1f}{pss_total:.1f}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    command = sys.argv[1]
+    if command == "build":
+        name = sys.argv[2] if len(sys.argv) > 2 else os.getenv("WHISPER_MODEL", "base")
+        if load_whisper_mmap(name) is None:
+            build_whisper_cache(name)
+        from tts_manager import PiperVoiceManager
+        manager = PiperVoiceManager.from_env(os.path.join(BASE_DIR, "piper_models"), "zh_CN-huayan-medium")
+        for voice in sys.argv[3:] or manager.available_voices():
+            manager.get(voice)
+            manager.unload(voice)
+        print(f"✅ 模型缓存已生成: {MODEL_CACHE_DIR}")
+    elif command == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    elif command == "_load":
+        _bench_child(sys.argv[2], sys.argv[3], float(sys.argv[4]))
+    else:
+        print(f"❌ 未知命令: {command}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
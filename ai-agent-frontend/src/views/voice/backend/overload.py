@@ -0,0 +1,172 @@
+"""
+过载保护：按负载逐级降级
+机器满载时如果每个请求仍然使用完整的识别模型、500 token 的回复和整段语音合成，
+所有人的延迟都会一起崩溃。控制器定期检查调度队列深度和各阶段的近期耗时，
+压力持续超标时升高降级等级，持续恢复后再逐级回落（升降阈值和持续时间不同，避免来回抖动）。
+
+等级（逐级叠加）：
+0 normal              正常
+1 small_asr           识别改用更小的模型（OVERLOAD_ASR_MODEL，默认 tiny）
+2 short_reply         降低 LLM 的 max_tokens（OVERLOAD_MAX_TOKENS）
+3 tts_first_sentence  只合成回复的前几句（OVERLOAD_TTS_SENTENCES）
+4 text_only           不合成语音，只返回文本
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger("overload")
+
+LEVEL_NAMES = ("normal", "small_asr", "short_reply", "tts_first_sentence", "text_only")
+
+
+def _parse_targets(value):
+    targets = {}
+    for item in value.split(","):
+        stage, sep, target = item.partition("=")
+        if sep and stage.strip():
+            targets[stage.strip()] = float(target)
+    return targets
+
+
+class OverloadController:
+    """
+    根据队列深度和阶段耗时计算压力（实际值 / 目标值 的最大者），带滞回地调整降级等级。
+    阶段耗时通过 observe() 上报：asr 为实时率（识别耗时 / 音频时长），其他阶段为秒
+    """
+
+    def __init__(self, queue_depth, queue_target=8, stage_targets=None, window=30.0, interval=1.0,
+                 up_threshold=1.0, down_threshold=0.6, up_after=5.0, down_after=30.0, max_level=4,
+                 asr_model="tiny", max_tokens=150, tts_sentences=1, enabled=True):
+        self.queue_depth = queue_depth
+        self.queue_target = max(1, queue_target)
+        self.stage_targets = stage_targets or {"asr": 0.5, "llm": 15.0, "tts": 5.0}
+        self.window = window
+        self.interval = interval
+        self.up_threshold = up_threshold
+        self.down_threshold = down_threshold
+        self.up_after = up_after
+        self.down_after = down_after
+        self.max_level = min(max_level, len(LEVEL_NAMES) - 1)
+        self.asr_model = asr_model
+        self.max_tokens = max_tokens
+        self.tts_sentences = tts_sentences
+        self.enabled = enabled
+
+        self.level = 0
+        self.pressure = 0.0
+        self.changed_at = time.time()
+        self.transitions = 0
+        self._samples = {stage: deque() for stage in self.stage_targets}
+        self._over_since = None
+        self._under_since = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if enabled:
+            threading.Thread(target=self._run, name="overload-controller", daemon=True).start()
+
+    @classmethod
+    def from_env(cls, queue_depth, workers=4):
+        return cls(
+            queue_depth,
+            queue_target=int(os.getenv("OVERLOAD_QUEUE_TARGET", str(workers * 2))),
+            stage_targets=_parse_targets(os.getenv("OVERLOAD_TARGETS", "asr=0.5,llm=15,tts=5")),
+            window=float(os.getenv("OVERLOAD_WINDOW_SECONDS", "30")),
+            up_after=float(os.getenv("OVERLOAD_UP_AFTER_SECONDS", "5")),
+            down_after=float(os.getenv("OVERLOAD_DOWN_AFTER_SECONDS", "30")),
+            max_level=int(os.getenv("OVERLOAD_MAX_LEVEL", "4")),
+            asr_model=os.getenv("OVERLOAD_ASR_MODEL", "tiny"),
+            max_tokens=int(os.getenv("OVERLOAD_MAX_TOKENS", "150")),
+            tts_sentences=int(os.getenv("OVERLOAD_TTS_SENTENCES", "1")),
+            enabled=os.getenv("OVERLOAD_CONTROL", "1").lower() in ("1", "true", "yes", "on"),
+        )
+
+    def observe(self, stage, value):
+        """
+        上报一次阶段耗时
+        """
+        samples = self._samples.get(stage)
+        if samples is None:
+            return
+        with self._lock:
+            samples.append((time.monotonic(), value))
+
+    def _stage_pressure(self, now):
+        pressure = {}
+        with self._lock:
+            for stage, samples in self._samples.items():
+                while samples and now - samples[0][0] > self.window:
+                    samples.popleft()
+                if samples:
+                    pressure[stage] = sum(v for _, v in samples) / len(samples) / self.stage_targets[stage]
+        return pressure
+
+    def evaluate(self, now=None):
+        """
+        计算当前压力并按滞回规则调整等级，返回当前等级
+        """
+        now = time.monotonic() if now is None else now
+        pressure = self._stage_pressure(now)
+        pressure["queue"] = self.queue_depth() / self.queue_target
+        self.pressure = round(max(pressure.values()), 3)
+
+        if self.pressure >= self.up_threshold:
+            self._under_since = None
+            self._over_since = self._over_since or now
+            if now - self._over_since >= self.up_after and self.level < self.max_level:
+                self._set_level(self.level + 1, pressure)
+                self._over_since = now
+        elif self.pressure <= self.down_threshold:
+            self._over_since = None
+            self._under_since = self._under_since or now
+            if now - self._under_since >= self.down_after and self.level > 0:
+                self._set_level(self.level - 1, pressure)
+                self._under_since = now
+        else:
+            self._over_since = self._under_since = None
+        return self.level
+
+    def _set_level(self, level, pressure):
+        logger.warning("降级等级 %d(%s) -> %d(%s)，压力: %s", self.level, LEVEL_NAMES[self.level],
+                       level, LEVEL_NAMES[level], {k: round(v, 2) for k, v in pressure.items()})
+        self.level = level
+        self.changed_at = time.time()
+        self.transitions += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.evaluate()
+            except Exception as e:
+                logger.error("过载检查失败: %s", e, exc_info=True)
+
+    def stop(self):
+        self._stop.set()
+
+    def policy(self):
+        """
+        当前等级对应的处理参数，在请求入口取一次，整个请求使用同一份
+        """
+        level = self.level
+        return {
+            "level": level,
+            "mode": LEVEL_NAMES[level],
+            "asr_model": self.asr_model if level >= 1 else None,
+            "max_tokens": self.max_tokens if level >= 2 else None,
+            "tts_sentences": self.tts_sentences if level >= 3 else None,
+            "tts": level < 4,
+        }
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "level": self.level,
+            "mode": LEVEL_NAMES[self.level],
+            "pressure": self.pressure,
+            "stage_pressure": {k: round(v, 3) for k, v in self._stage_pressure(time.monotonic()).items()},
+            "queue_depth": self.queue_depth(),
+            "changed_at": self.changed_at,
+            "transitions": self.transitions,
+        }
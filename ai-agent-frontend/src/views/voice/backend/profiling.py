@@ -0,0 +1,270 @@
+"""
+线上性能分析（只通过管理接口使用）
+- SamplingProfiler：定时采样所有线程的调用栈，输出 flamegraph.pl / speedscope 可直接读取的
+  折叠栈格式（"线程;帧;帧 次数"）。只在采样期间有开销
+- RequestProfiles：单个请求的 cProfile 结果（请求处理线程和它提交的后台任务各一份），
+  保留最近的若干个，可以取文本汇总或 .prof 文件（pstats/snakeviz 可读）
+- MemoryTracker：tracemalloc 快照对比，定位 async_results、TTS 等路径上的内存增长
+"""
+import io
+import sys
+import time
+import pstats
+import cProfile
+import marshal
+import logging
+import threading
+import tracemalloc
+from collections import Counter, OrderedDict
+from functools import wraps
+
+logger = logging.getLogger("profiling")
+
+
+class ProfilerBusy(Exception):
+    """已有进行中的采样"""
+
+
+class SamplingProfiler:
+    """
+    采样式分析器：后台线程每隔 interval 秒读取一次 sys._current_frames()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+        self.interval = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=10.0, interval=0.005, thread_prefix=None):
+        """
+        开始采样 seconds 秒；thread_prefix 不为空时只采样名字以它开头的线程（如 "scheduler-"）
+        """
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("已有进行中的采样")
+            self._stop.clear()
+            self._stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(seconds, interval, thread_prefix),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+        logger.info("开始采样分析，时长 %.1f 秒，间隔 %.4f 秒，线程前缀: %s", seconds, interval, thread_prefix)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, seconds, interval, thread_prefix):
+        own_id = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                name = names.get(thread_id, str(thread_id))
+                if thread_prefix and not name.startswith(thread_prefix):
+                    continue
+                self._stacks[self._collapse(name, frame)] += 1
+            self.samples += 1
+            self._stop.wait(interval)
+        self.duration = round(time.monotonic() - started, 3)
+        logger.info("采样分析结束，共采样 %d 次，%d 种调用栈", self.samples, len(self._stacks))
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(thread_name)
+        # 折叠栈格式中 ";" 是分隔符，" " 用于分隔次数
+        return ";".join(f.replace(";", ":") for f in reversed(frames))
+
+    def collapsed(self):
+        """
+        折叠栈文本，每行 "栈 次数"，按次数降序
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "duration": self.duration,
+        }
+
+
+class _SavedStats:
+    # pstats.Stats 可以从任何带 create_stats() 和 stats 属性的对象加载
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class RequestProfiles:
+    """
+    保存最近 capacity 个 cProfile 结果，按分析ID分组（一个请求及其后台任务共用一个ID）
+    """
+
+    def __init__(self, capacity=50):
+        self.capacity = capacity
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # 同一线程上已有其他分析器在运行
+            logger.warning("无法启用 cProfile: %s", e)
+            return None
+        return profile
+
+    def save(self, profile_id, name, profile, elapsed):
+        profile.disable()
+        profile.create_stats()
+        with self._lock:
+            entries = self._profiles.setdefault(profile_id, OrderedDict())
+            entries[name] = {"stats": profile.stats, "elapsed": round(elapsed, 4)}
+            self._profiles.move_to_end(profile_id)
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+
+    def wrap(self, profile_id, func):
+        """
+        包装后台任务，在执行它的工作线程中做 cProfile
+        """
+        @wraps(func)
+        def profiled(*args, **kwargs):
+            profile = self.start()
+            if profile is None:
+                return func(*args, **kwargs)
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.save(profile_id, func.__name__, profile, time.monotonic() - started)
+        return profiled
+
+    def entries(self, profile_id):
+        with self._lock:
+            entries = self._profiles.get(profile_id)
+            return {name: entry["elapsed"] for name, entry in entries.items()} if entries else None
+
+    def recent(self):
+        with self._lock:
+            return [{"profile_id": pid, "entries": {n: e["elapsed"] for n, e in entries.items()}}
+                    for pid, entries in reversed(self._profiles.items())]
+
+    def _entry(self, profile_id, name):
+        with self._lock:
+            return (self._profiles.get(profile_id) or {}).get(name)
+
+    def report(self, profile_id, name, sort="cumulative", limit=40):
+        """
+        pstats 文本汇总，找不到返回 None
+        """
+        entry = self._entry(profile_id, name)
+        if entry is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(_SavedStats(entry["stats"]), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, profile_id, name):
+        """
+        与 cProfile.Profile.dump_stats 相同格式的 .prof 数据，找不到返回 None
+        """
+        entry = self._entry(profile_id, name)
+        return marshal.dumps(entry["stats"]) if entry else None
+
+
+class MemoryTracker:
+    """
+    tracemalloc 快照对比：每次 snapshot() 与上一次快照比较，返回增长最多的位置
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous = None
+        self.started_by_us = False
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, nframes=10):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(nframes)
+                self.started_by_us = True
+            self._previous = tracemalloc.take_snapshot()
+        logger.info("tracemalloc 已启动，调用栈深度 %d", nframes)
+
+    def stop(self):
+        with self._lock:
+            self._previous = None
+            if self.started_by_us:
+                tracemalloc.stop()
+                self.started_by_us = False
+
+    def snapshot(self, group_by="lineno", limit=30, include=None):
+        """
+        与上一次快照比较；include 为文件名片段列表，只统计匹配的文件（如 ["tts_", "job_store"]）
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc 未启动")
+            current = tracemalloc.take_snapshot()
+            previous, self._previous = self._previous, current
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        if include:
+            filters.extend(tracemalloc.Filter(True, f"*{pattern}*", all_frames=True) for pattern in include)
+        current = current.filter_traces(filters)
+        size, peak = tracemalloc.get_traced_memory()
+        result = {
+            "traced_mb": round(size / 1024 / 1024, 2),
+            "peak_mb": round(peak / 1024 / 1024, 2),
+        }
+        if previous is None:
+            stats = current.statistics(group_by)[:limit]
+            result["top"] = [self._format(stat, diff=False) for stat in stats]
+        else:
+            stats = current.compare_to(previous.filter_traces(filters), group_by)[:limit]
+            result["diff"] = [self._format(stat, diff=True) for stat in stats]
+        return result
+
+    @staticmethod
+    def _format(stat, diff):
+        entry = {
+            "location": [f"{frame.filename.rsplit('/', 1)[-1]}:{frame.lineno}" for frame in stat.traceback],
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        if diff:
+            entry["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+            entry["count_diff"] = stat.count_diff
+        return entry
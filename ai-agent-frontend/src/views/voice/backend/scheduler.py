@@ -0,0 +1,278 @@
+"""
+任务调度
+替代原来 FIFO 的 ThreadPoolExecutor，保证一个客户端上传的大量长录音不会拖慢其他人的短对话：
+- 优先级分类：interactive（按住说话、文字提问）优先于 batch（长录音、批量任务），
+  batch 任务排队超过 max_batch_wait 后不再让路，避免饿死
+- 同一分类内按客户端做加权公平排队（起始时间公平排队），每个客户端内部短音频优先
+- 每个客户端一个令牌桶限流，超出时由接口返回 429
+- 按分类统计排队等待时间
+"""
+import os
+import time
+import heapq
+import itertools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+
+logger = logging.getLogger("scheduler")
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITY_CLASSES = (INTERACTIVE, BATCH)
+
+
+class _Job:
+    __slots__ = ("future", "func", "args", "kwargs", "priority", "client_id", "cost", "deadline", "enqueued_at")
+
+    def __init__(self, future, func, args, kwargs, priority, client_id, cost, deadline=None):
+        self.future = future
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.client_id = client_id
+        self.cost = cost
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+
+
+class _ClassQueue:
+    """
+    一个优先级分类内的队列：每个客户端一个按 cost 排序的小顶堆，客户端之间按虚拟时间公平轮转
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.clients = {}       # client_id -> [(cost, seq, job)]
+        self.vtime = {}         # client_id -> 虚拟时间
+        self.virtual_clock = 0.0
+        self.size = 0
+        self.waits = deque(maxlen=1000)
+        self.completed = 0
+        self.expired = 0
+
+    def push(self, job, seq):
+        heap = self.clients.get(job.client_id)
+        if heap is None:
+            heap = self.clients[job.client_id] = []
+            # 重新进入排队的客户端不能用过去积累的空闲时间插队
+            self.vtime[job.client_id] = max(self.vtime.get(job.client_id, 0.0), self.virtual_clock)
+        heapq.heappush(heap, (job.cost, seq, job))
+        self.size += 1
+
+    def oldest_wait(self, now):
+        if not self.size:
+            return 0.0
+        return max(now - job.enqueued_at for heap in self.clients.values() for _, _, job in heap)
+
+    def pop(self, weights, min_cost):
+        client_id = min(self.clients, key=lambda c: (self.vtime[c], c or ""))
+        heap = self.clients[client_id]
+        _, _, job = heapq.heappop(heap)
+        if not heap:
+            del self.clients[client_id]
+        self.size -= 1
+        self.virtual_clock = self.vtime[client_id]
+        self.vtime[client_id] += max(job.cost, min_cost) / weights.get(client_id, 1.0)
+        # 只保留仍在排队的客户端的虚拟时间
+        for stale in [c for c in self.vtime if c not in self.clients and self.vtime[c] <= self.virtual_clock]:
+            del self.vtime[stale]
+        return job
+
+    def stats(self):
+        waits = sorted(self.waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else 0.0
+
+        return {
+            "queued": self.size,
+            "queued_clients": len(self.clients),
+            "completed": self.completed,
+            "expired": self.expired,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "p50_wait_seconds": percentile(0.5),
+            "p95_wait_seconds": percentile(0.95),
+            "max_wait_seconds": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+class JobScheduler(Executor):
+    """
+    带优先级和公平排队的线程池，兼容 concurrent.futures.Executor 接口（submit 按 interactive 调度）
+    """
+
+    def __init__(self, max_workers=4, client_weights=None, max_batch_wait=30.0, min_cost=0.5):
+        self.max_workers = max_workers
+        self.client_weights = client_weights or {}
+        self.max_batch_wait = max_batch_wait
+        self.min_cost = min_cost
+        self._queues = {name: _ClassQueue(name) for name in PRIORITY_CLASSES}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._shutdown = False
+        self._threads = []
+        for i in range(max_workers):
+            thread = threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @classmethod
+    def from_env(cls):
+        weights = {}
+        for item in os.getenv("SCHEDULER_CLIENT_WEIGHTS", "").split(","):
+            client_id, sep, weight = item.partition("=")
+            if sep and client_id.strip():
+                weights[client_id.strip()] = float(weight)
+        return cls(
+            max_workers=int(os.getenv("SCHEDULER_WORKERS", "4")),
+            client_weights=weights,
+            max_batch_wait=float(os.getenv("SCHEDULER_MAX_BATCH_WAIT", "30")),
+        )
+
+    def schedule(self, func, *args, priority=INTERACTIVE, client_id=None, cost=1.0, deadline=None, **kwargs):
+        """
+        提交任务。priority 为 interactive 或 batch；cost 是预计耗时（如音频秒数），
+        同一客户端内 cost 小的先执行，并按 cost 计入该客户端的公平份额。
+        deadline 为截止时间戳，轮到执行时已经过期的任务计入 expired 统计
+        （任务函数通过同样带截止时间的取消标记自行放弃，并完成清理）
+        """
+        if priority not in self._queues:
+            raise ValueError(f"未知的优先级: {priority}")
+        return self._enqueue(func, args, kwargs, priority, client_id, cost, deadline)
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self._enqueue(fn, args, kwargs, INTERACTIVE, None, 1.0, None)
+
+    def _enqueue(self, func, args, kwargs, priority, client_id, cost, deadline):
+        future = Future()
+        job = _Job(future, func, args, kwargs, priority, client_id, max(0.0, float(cost)), deadline)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("调度器已关闭")
+            self._queues[priority].push(job, next(self._seq))
+            self._cond.notify()
+        return future
+
+    def _next_job(self):
+        """
+        选择下一个任务（调用方持有锁）：interactive 优先，batch 等待过久时让 batch 先走
+        """
+        interactive = self._queues[INTERACTIVE]
+        batch = self._queues[BATCH]
+        if batch.size and (not interactive.size or batch.oldest_wait(time.monotonic()) > self.max_batch_wait):
+            queue = batch
+        else:
+            queue = interactive
+        return queue.pop(self.client_weights, self.min_cost)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._shutdown and not any(q.size for q in self._queues.values()):
+                    self._cond.wait()
+                if self._shutdown and not any(q.size for q in self._queues.values()):
+                    return
+                job = self._next_job()
+                queue = self._queues[job.priority]
+                queue.waits.append(time.monotonic() - job.enqueued_at)
+                if job.deadline is not None and time.time() >= job.deadline:
+                    queue.expired += 1
+                self._running += 1
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.func(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        logger.error("调度任务执行失败: %s", e, exc_info=True)
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    queue.completed += 1
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for queue in self._queues.values():
+                    while queue.size:
+                        queue.pop(self.client_weights, self.min_cost).future.cancel()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def queued(self):
+        """
+        所有分类中排队等待的任务数
+        """
+        with self._cond:
+            return sum(queue.size for queue in self._queues.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "classes": {name: queue.stats() for name, queue in self._queues.items()},
+            }
+
+
+class RateLimiter:
+    """
+    按客户端的令牌桶限流：每分钟补充 rate_per_minute 个令牌，最多积累 burst 个；rate_per_minute 为 0 时不限流
+    """
+
+    def __init__(self, rate_per_minute=60.0, burst=20):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rate_per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", "0")),
+            burst=int(os.getenv("RATE_LIMIT_BURST", "20")),
+        )
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def allow(self, client_id, tokens=1.0):
+        """
+        尝试消耗令牌，返回 (是否允许, 需要等待的秒数)
+        """
+        if not self.enabled:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            available, updated_at = self._buckets.get(client_id, (float(self.burst), now))
+            available = min(float(self.burst), available + (now - updated_at) * self.rate)
+            if available >= tokens:
+                self._buckets[client_id] = (available - tokens, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[client_id] = (available, now)
+                self.rejected += 1
+                allowed, retry_after = False, (tokens - available) / self.rate
+            if len(self._buckets) > 10000:
+                # 清理早已回满的桶
+                idle = self.burst / self.rate
+                self._buckets = {c: b for c, b in self._buckets.items() if now - b[1] < idle}
+        return allowed, retry_after
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_minute": round(self.rate * 60, 3),
+                "burst": self.burst,
+                "clients": len(self._buckets),
+                "rejected": self.rejected,
+            }
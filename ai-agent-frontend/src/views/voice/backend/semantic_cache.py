@@ -0,0 +1,266 @@
+"""
+语义问答缓存（可选，SEMANTIC_CACHE=1 开启）
+调度员经常用不同说法问同一个问题，每次都要让 20B 模型完整生成一遍。
+这里用本地 CPU 上的小型句向量模型把规范化后的问题编码成向量，在内存中做暴力余弦检索
+（向量已归一化，一次矩阵乘法即可，几千条以内比近似索引更快也更准确），
+相似度超过阈值时直接返回已有的回答以及预先合成好的音频。
+
+条目来源：
+- faq：启动时从 SEMANTIC_CACHE_FAQ 指定的 JSON 文件加载的人工整理问答，不过期
+- llm：模型回答过的问题，超过 TTL 后失效，超出容量时淘汰最早的
+
+依赖 sentence-transformers（未安装时缓存不可用，不影响正常问答）
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+logger = logging.getLogger("semantic_cache")
+
+
+def normalize_question(text: str) -> str:
+    """
+    全角转半角、去掉标点和空白、英文小写，作为编码和精确匹配的输入
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(c for c in text if not unicodedata.category(c).startswith(("P", "Z", "C")))
+
+
+class SentenceEmbedder:
+    """
+    句向量模型，首次使用时加载，输出 L2 归一化的 float32 向量
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                logger.info("正在加载句向量模型: %s", self.model_name)
+                self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model
+
+    def encode(self, texts):
+        model = self._model or self._load()
+        vectors = model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class SemanticCache:
+    """
+    问题向量的暴力检索索引。synthesize(answer, key) 返回音频 URL，
+    提供时新条目的回答会通过 submit(func, *args) 在后台预先合成
+    """
+
+    def __init__(self, embedder, threshold=0.9, ttl=86400.0, capacity=5000, synthesize=None, submit=None):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.synthesize = synthesize
+        self.submit = submit
+        self._vectors = None
+        self._entries = []
+        self._keys = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.hit_similarity = 0.0
+        self.embed_seconds = 0.0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls, synthesize=None, submit=None):
+        """
+        SEMANTIC_CACHE 未开启或缺少依赖时返回 None
+        """
+        if os.getenv("SEMANTIC_CACHE", "0").lower() not in ("1", "true", "yes", "on"):
+            return None
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            logger.warning("sentence-transformers 未安装，语义问答缓存不可用")
+            return None
+        cache = cls(
+            SentenceEmbedder(os.getenv("SEMANTIC_CACHE_MODEL", "BAAI/bge-small-zh-v1.5")),
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+            ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "86400")),
+            capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", "5000")),
+            synthesize=synthesize,
+            submit=submit,
+        )
+        faq_path = os.getenv("SEMANTIC_CACHE_FAQ")
+        if faq_path:
+            # 编码 FAQ 需要先加载模型，放到后台进行，不拖慢启动
+            threading.Thread(target=cache.load_faq, args=(faq_path,), name="semantic-cache-faq",
+                             daemon=True).start()
+        return cache
+
+    def _embed(self, texts):
+        started = time.monotonic()
+        vectors = self.embedder.encode(texts)
+        self.embed_seconds = round(time.monotonic() - started, 4)
+        return vectors
+
+    @staticmethod
+    def _key(normalized):
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+    def load_faq(self, path):
+        """
+        加载 FAQ 文件：[{"question": ..., "answer": ...}]，question 也可以是多种问法的列表
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+            pairs = []
+            for item in items:
+                questions = item["question"]
+                for question in [questions] if isinstance(questions, str) else questions:
+                    pairs.append((question, item["answer"]))
+            self._add_many(pairs, source="faq")
+            logger.info("已加载 %d 条 FAQ 问法: %s", len(pairs), path)
+        except Exception as e:
+            logger.error("加载 FAQ 文件失败: %s (%s)", path, e, exc_info=True)
+
+    def add(self, question, answer):
+        """
+        记录一次模型回答
+        """
+        self._add_many([(question, answer)], source="llm")
+
+    def _add_many(self, pairs, source):
+        normalized = [normalize_question(q) for q, _ in pairs]
+        pairs = [(q, a, n) for (q, a), n in zip(pairs, normalized) if n and a]
+        if not pairs:
+            return
+        vectors = self._embed([n for _, _, n in pairs])
+        now = time.time()
+        added = []
+        with self._lock:
+            self._sweep(now)
+            for (question, answer, norm), vector in zip(pairs, vectors):
+                key = self._key(norm)
+                if key in self._keys:
+                    entry = self._entries[self._keys[key]]
+                    # 人工整理的回答不会被模型回答覆盖
+                    if entry["answer"] == answer or (entry["source"] == "faq" and source == "llm"):
+                        entry["created_at"] = now
+                        continue
+                    self._remove(self._keys[key])
+                if len(self._entries) >= self.capacity and not self._evict_oldest():
+                    break
+                entry = {"key": key, "question": question, "answer": answer, "source": source,
+                         "created_at": now, "hits": 0, "audio_url": None}
+                self._append(key, entry, vector)
+                added.append(entry)
+        if self.synthesize is not None and self.submit is not None:
+            for entry in added:
+                self.submit(self._prepare_audio, entry)
+
+    def _prepare_audio(self, entry):
+        try:
+            entry["audio_url"] = self.synthesize(entry["answer"], entry["key"])
+        except Exception as e:
+            logger.warning("预合成缓存回答的音频失败: %s", e)
+
+    # 以下方法由调用方持有 self._lock
+
+    def _append(self, key, entry, vector):
+        size = len(self._entries)
+        if self._vectors is None:
+            self._vectors = np.zeros((64, vector.shape[0]), dtype=np.float32)
+        elif size == self._vectors.shape[0]:
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+        self._vectors[size] = vector
+        self._entries.append(entry)
+        self._keys[key] = size
+
+    def _remove(self, index):
+        # 与最后一个交换后删除，保持向量矩阵连续
+        last = len(self._entries) - 1
+        removed = self._entries[index]
+        if index != last:
+            self._vectors[index] = self._vectors[last]
+            self._entries[index] = self._entries[last]
+            self._keys[self._entries[index]["key"]] = index
+        self._entries.pop()
+        del self._keys[removed["key"]]
+        self.evicted += 1
+
+    def _evict_oldest(self):
+        learned = [i for i, e in enumerate(self._entries) if e["source"] == "llm"]
+        if not learned:
+            return False
+        self._remove(min(learned, key=lambda i: self._entries[i]["created_at"]))
+        return True
+
+    def _sweep(self, now):
+        for index in range(len(self._entries) - 1, -1, -1):
+            entry = self._entries[index]
+            if entry["source"] == "llm" and now - entry["created_at"] > self.ttl:
+                self._remove(index)
+
+    def lookup(self, question):
+        """
+        查找相似的问题，命中时返回 {"answer", "similarity", "audio_url", "source", "question"}，否则返回 None
+        """
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        vector = self._embed([normalized])[0]
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            if not self._entries:
+                return None
+            scores = self._vectors[:len(self._entries)] @ vector
+            index = int(np.argmax(scores))
+            similarity = float(scores[index])
+            entry = self._entries[index]
+            if entry["source"] == "llm" and now - entry["created_at"] > self.ttl:
+                self._remove(index)
+                return None
+            if similarity < self.threshold:
+                return None
+            entry["hits"] += 1
+            self.hits += 1
+            self.hit_similarity += similarity
+            return {"answer": entry["answer"], "similarity": round(similarity, 4), "audio_url": entry["audio_url"],
+                    "source": entry["source"], "question": entry["question"]}
+
+    def audio_keys(self):
+        """
+        仍在缓存中、已有预合成音频的条目
+        """
+        with self._lock:
+            return {e["key"] for e in self._entries if e["audio_url"]}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "faq_entries": sum(1 for e in self._entries if e["source"] == "faq"),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "avg_hit_similarity": round(self.hit_similarity / self.hits, 4) if self.hits else 0.0,
+                "last_embed_seconds": self.embed_seconds,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,245 @@
+"""
+推测式 LLM 调用
+流式识别（/speech-stream）的中间结果稳定且用户很可能已经说完时，提前发起 LLM 请求；
+最终文本到达后，如果与推测时的文本规范化后一致就直接复用结果，否则取消推测并重新发起。
+
+中间结果需要是“到目前为止说的全部内容”。/speech-stream 的分块默认是互相独立的片段，
+各块的识别结果按到达顺序编号（on_chunk），按编号拼接出连续的前缀后再作为中间结果；
+客户端每次上传累积录音（cumulative=true）时，识别结果直接就是中间结果（on_partial）
+"""
+import os
+import re
+import time
+import logging
+import threading
+import itertools
+import unicodedata
+
+logger = logging.getLogger("speculation")
+
+# 句末标点：识别结果以此结尾时认为用户很可能已说完
+_END_OF_UTTERANCE_RE = re.compile(r"[。？！?!.]\s*$")
+
+
+def _join_chunks(texts):
+    # 中文直接拼接，前后都是英文字母或数字时补一个空格
+    joined = ""
+    for text in texts:
+        text = text.strip()
+        if joined and text and joined[-1].isascii() and joined[-1].isalnum() \
+                and text[0].isascii() and text[0].isalnum():
+            joined += " "
+        joined += text
+    return joined
+
+
+def normalize_transcript(text: str) -> str:
+    """
+    规范化识别文本用于比较：全角转半角、小写、去掉标点和空白
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(c for c in text if not unicodedata.category(c).startswith(("P", "Z", "S")))
+
+
+_utterance_ids = itertools.count(1)
+
+
+class _SessionState:
+    def __init__(self):
+        # 一段话一个编号，on_final 之后的分块属于新的一段话
+        self.utterance = next(_utterance_ids)
+        self.last_norm = None
+        self.repeat_count = 0
+        self.updated_at = time.monotonic()
+        # 进行中的推测：(规范化文本, 原始文本, 任务ID, 开始时间)
+        self.speculation = None
+        # 独立分块的识别结果：{编号: 文本}，next_seq 为下一个分块的编号，joined 为已拼接的连续块数
+        self.chunks = {}
+        self.next_seq = 0
+        self.joined = 0
+
+
+class SpeculativeLLM:
+    """
+    管理每个会话的推测状态并统计命中率和节省的延迟。
+    launch(session_id, text) 负责真正提交 LLM 任务并返回任务ID，cancel(result_id) 负责取消
+    """
+
+    def __init__(self, launch, cancel, stable_partials=2, min_chars=2, ttl=60.0):
+        self.launch = launch
+        self.cancel = cancel
+        self.stable_partials = stable_partials
+        self.min_chars = min_chars
+        self.ttl = ttl
+        self._sessions = {}
+        self._finished_at = {}
+        self._lock = threading.Lock()
+        self.launched = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.saved_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, launch, cancel):
+        return cls(
+            launch,
+            cancel,
+            stable_partials=int(os.getenv("SPECULATION_STABLE_PARTIALS", "2")),
+            min_chars=int(os.getenv("SPECULATION_MIN_CHARS", "2")),
+            ttl=float(os.getenv("SPECULATION_TTL_SECONDS", "60")),
+        )
+
+    def _expire(self, now):
+        """
+        清理长时间没有更新的会话（调用方持有锁），返回需要取消的推测任务
+        """
+        stale = [sid for sid, state in self._sessions.items() if now - state.updated_at > self.ttl]
+        to_cancel = []
+        for sid in stale:
+            state = self._sessions.pop(sid)
+            if state.speculation:
+                to_cancel.append(state.speculation[2])
+                self._finished_at.pop(state.speculation[2], None)
+        return to_cancel
+
+    def next_chunk(self, session_id):
+        """
+        按到达顺序为会话的下一个独立分块分配编号，返回 (段落编号, 分块编号)
+        """
+        with self._lock:
+            state = self._sessions.setdefault(session_id, _SessionState())
+            state.updated_at = time.monotonic()
+            seq = state.next_seq
+            state.next_seq += 1
+            return state.utterance, seq
+
+    def on_chunk(self, session_id, chunk, text, end_of_utterance=False):
+        """
+        收到一个独立分块（chunk 为 next_chunk 的返回值）的识别结果，各块可能乱序完成。
+        从第 0 块起连续的前缀变长时，把拼接后的文本作为中间结果交给 on_partial；
+        返回新发起的推测任务ID（没有则为 None）
+        """
+        utterance, seq = chunk
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or state.utterance != utterance:
+                # 这段话已经结束（on_final）或过期
+                return None
+            state.chunks[seq] = text or ""
+            if state.joined not in state.chunks:
+                return None
+            while state.joined in state.chunks:
+                state.joined += 1
+            joined = _join_chunks(state.chunks[i] for i in range(state.joined))
+            # 末尾的块刚好是这一块时，它的 eou 标记才适用于整段文本
+            end_of_utterance = end_of_utterance and state.joined == seq + 1
+        return self.on_partial(session_id, joined, end_of_utterance)
+
+    def on_partial(self, session_id, text, end_of_utterance=False):
+        """
+        收到一个中间识别结果。文本连续 stable_partials 次不变且判断用户已说完时发起推测；
+        与进行中的推测不一致时立即取消旧推测。返回新发起的推测任务ID（没有则为 None）
+        """
+        norm = normalize_transcript(text)
+        now = time.monotonic()
+        to_cancel = []
+        launch_text = None
+        with self._lock:
+            to_cancel.extend(self._expire(now))
+            state = self._sessions.setdefault(session_id, _SessionState())
+            state.updated_at = now
+            if norm == state.last_norm:
+                state.repeat_count += 1
+            else:
+                state.last_norm = norm
+                state.repeat_count = 1
+
+            if state.speculation and state.speculation[0] != norm:
+                # 用户还在继续说，推测作废
+                to_cancel.append(state.speculation[2])
+                self._finished_at.pop(state.speculation[2], None)
+                state.speculation = None
+                self.discarded += 1
+
+            stable = state.repeat_count >= self.stable_partials
+            likely_done = end_of_utterance or bool(_END_OF_UTTERANCE_RE.search(text or "")) \
+                or state.repeat_count > self.stable_partials
+            if (state.speculation is None and len(norm) >= self.min_chars
+                    and (end_of_utterance or stable) and likely_done):
+                launch_text = text
+
+        for result_id in to_cancel:
+            self.cancel(result_id)
+        if launch_text is None:
+            return None
+
+        result_id = self.launch(session_id, launch_text)
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or state.last_norm != norm or state.speculation is not None:
+                # 发起期间状态已变化，放弃这次推测
+                to_cancel = [result_id]
+            else:
+                state.speculation = (norm, launch_text, result_id, time.monotonic())
+                self.launched += 1
+                to_cancel = []
+        for stale_id in to_cancel:
+            self.cancel(stale_id)
+        if to_cancel:
+            return None
+        logger.info("会话 %s 发起推测式 LLM 调用，任务ID: %s，文本: %s", session_id, result_id, launch_text)
+        return result_id
+
+    def job_finished(self, result_id):
+        """
+        LLM 任务结束时调用，用于计算推测实际节省的时间
+        """
+        with self._lock:
+            for state in self._sessions.values():
+                if state.speculation and state.speculation[2] == result_id:
+                    self._finished_at[result_id] = time.monotonic()
+                    return
+
+    def on_final(self, session_id, text):
+        """
+        最终识别文本到达。命中时返回推测任务ID，否则取消推测并返回 None（由调用方正常发起）
+        """
+        now = time.monotonic()
+        norm = normalize_transcript(text)
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+            speculation = state.speculation if state else None
+            if speculation is None:
+                return None
+            spec_norm, _, result_id, started_at = speculation
+            finished_at = self._finished_at.pop(result_id, None)
+            if spec_norm == norm:
+                self.hits += 1
+                # 节省的时间 = 提前开始的时长，但不超过 LLM 实际耗时
+                self.saved_seconds += (min(now, finished_at) if finished_at else now) - started_at
+                hit = True
+            else:
+                self.misses += 1
+                hit = False
+
+        if hit:
+            logger.info("会话 %s 推测命中，复用任务: %s", session_id, result_id)
+            return result_id
+        logger.info("会话 %s 推测未命中，取消任务: %s", session_id, result_id)
+        self.cancel(result_id)
+        return None
+
+    def stats(self):
+        with self._lock:
+            resolved = self.hits + self.misses
+            return {
+                "launched": self.launched,
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "hit_rate": round(self.hits / resolved, 3) if resolved else 0.0,
+                "latency_saved_seconds": round(self.saved_seconds, 3),
+                "avg_latency_saved_seconds": round(self.saved_seconds / self.hits, 3) if self.hits else 0.0,
+                "active_sessions": len(self._sessions),
+            }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块按顶层模块名互相导入（from scheduler import ...），测试时同样把后端目录放到路径最前面
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+import io
+import wave
+import array
+
+import pytest
+
+from audio_utils import decode_audio_stream, l16_params, wav_duration, InvalidAudioFormat, AudioUploadTooLarge
+
+
+def test_l16_params_defaults_and_values():
+    assert l16_params({}) == (16000, 1)
+    assert l16_params({"Rate": "8000", "channels": "2"}) == (8000, 2)
+
+
+@pytest.mark.parametrize("params", [{"rate": "abc"}, {"rate": "0"}, {"rate": ""}, {"channels": "-1"}])
+def test_l16_params_rejects_invalid_values(params):
+    with pytest.raises(InvalidAudioFormat):
+        l16_params(params)
+
+
+def test_invalid_params_are_rejected_before_reading(tmp_path):
+    stream = io.BytesIO(b"\x00" * 100)
+    with pytest.raises(ValueError):
+        decode_audio_stream(stream, "audio/l16", {"rate": "abc"}, str(tmp_path / "out.wav"))
+    assert stream.tell() == 0
+
+
+def test_l16_passthrough_writes_wav(tmp_path):
+    samples = array.array("h", [0, 1000, -1000, 0] * 4000)
+    output = str(tmp_path / "out.wav")
+    received = decode_audio_stream(io.BytesIO(samples.tobytes()), "audio/l16",
+                                   {"rate": "16000", "endianness": "little-endian"}, output)
+    assert received == len(samples) * 2
+    assert wav_duration(output) == pytest.approx(1.0)
+    with wave.open(output, "rb") as wav:
+        assert array.array("h", wav.readframes(4)).tolist() == [0, 1000, -1000, 0]
+
+
+def test_upload_limit(tmp_path):
+    output = str(tmp_path / "out.wav")
+    with pytest.raises(AudioUploadTooLarge):
+        decode_audio_stream(io.BytesIO(b"\x00" * 200), "audio/l16", {}, output, max_bytes=100)
@@ -0,0 +1,109 @@
+import os
+import json
+import argparse
+from concurrent.futures import Future
+
+import pytest
+
+import batch_transcribe
+from batch_transcribe import _srt_time, write_srt, load_checkpoint, find_recordings, run
+
+
+@pytest.mark.parametrize("seconds, text", [
+    (0, "00:00:00,000"), (1.2345, "00:00:01,234"), (59.9996, "00:01:00,000"), (3723.5, "01:02:03,500"),
+])
+def test_srt_time(seconds, text):
+    assert _srt_time(seconds) == text
+
+
+def test_write_srt(tmp_path):
+    path = str(tmp_path / "srt" / "a" / "call.srt")
+    write_srt(path, [{"start": 0.0, "end": 1.5, "text": "你好"}, {"start": 1.5, "end": 3.0, "text": "再见"}])
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "1\n00:00:00,000 --> 00:00:01,500\n你好\n\n2\n00:00:01,500 --> 00:00:03,000\n再见\n\n"
+
+
+def test_load_checkpoint_ignores_truncated_line(tmp_path):
+    path = tmp_path / "transcripts.jsonl"
+    assert load_checkpoint(str(path)) == {}
+    path.write_text(json.dumps({"file": "a.wav", "size": 10, "mtime": 5}) + "\n" + '{"file": "b.wa',
+                    encoding="utf-8")
+    assert load_checkpoint(str(path)) == {"a.wav": (10, 5)}
+
+
+def test_find_recordings_filters_extensions(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("a.WAV", "sub/b.mp3", "notes.txt"):
+        (tmp_path / name).write_bytes(b"\0")
+    found = sorted(rel for _, rel in find_recordings(str(tmp_path), {".wav", ".mp3"}))
+    assert found == ["a.WAV", os.path.join("sub", "b.mp3")]
+
+
+class _InlinePool:
+    """
+    在当前进程内同步执行的进程池替身，记录初始化参数
+    """
+    initargs = None
+
+    def __init__(self, max_workers, initializer, initargs):
+        _InlinePool.initargs = initargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+@pytest.fixture
+def archive(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_transcribe(path, rel_path, tmp_dir):
+        calls.append(rel_path)
+        stat = os.stat(path)
+        record = {"file": rel_path, "size": stat.st_size, "mtime": int(stat.st_mtime), "elapsed": 0.0}
+        if rel_path.startswith("bad"):
+            record["error"] = "decode failed"
+        else:
+            record.update({"text": "你好", "duration": 2.0,
+                           "segments": [{"start": 0.0, "end": 2.0, "text": "你好"}]})
+        return record
+
+    monkeypatch.setattr(batch_transcribe, "ProcessPoolExecutor", _InlinePool)
+    monkeypatch.setattr(batch_transcribe, "_transcribe_file", fake_transcribe)
+    source = tmp_path / "in"
+    source.mkdir()
+    (source / "good.wav").write_bytes(b"\0" * 20)
+    (source / "bad.wav").write_bytes(b"\0" * 10)
+
+    def transcribe(**options):
+        values = dict(input=str(source), output=str(tmp_path / "out"), workers=1, threads=1, model="tiny",
+                      language=None, srt=False, ext=".wav", retry_failed=False, report_interval=30.0)
+        values.update(options)
+        return run(argparse.Namespace(**values))
+
+    transcribe.calls = calls
+    transcribe.output = tmp_path / "out"
+    return transcribe
+
+
+def test_run_writes_transcripts_errors_and_srt(archive):
+    assert archive(srt=True, language="zh") == 1
+    assert _InlinePool.initargs == ("tiny", 1, {"without_timestamps": "false", "language": "zh"})
+    assert set(load_checkpoint(str(archive.output / "transcripts.jsonl"))) == {"good.wav"}
+    assert set(load_checkpoint(str(archive.output / "errors.jsonl"))) == {"bad.wav"}
+    assert (archive.output / "srt" / "good.srt").read_text(encoding="utf-8").startswith("1\n00:00:00,000")
+
+
+def test_run_resumes_and_retries_failed(archive):
+    archive()
+    assert archive() == 0
+    assert sorted(archive.calls) == ["bad.wav", "good.wav"]
+    archive(retry_failed=True)
+    assert sorted(archive.calls) == ["bad.wav", "bad.wav", "good.wav"]
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from cancellation import CancellationRegistry, CancelToken, JobCancelled
+
+
+def test_new_turn_supersedes_previous_jobs():
+    registry = CancellationRegistry()
+    old, _ = registry.register("old", "s1")
+    other, _ = registry.register("other", "s2")
+    _, cancelled = registry.register("new", "s1", new_turn=True)
+    assert cancelled == ["old"]
+    assert old.reason == "superseded"
+    assert not other.cancelled
+
+
+def test_cancel_runs_callbacks_once():
+    token = CancelToken("a")
+    calls = []
+    token.on_cancel(lambda: calls.append(1))
+    assert token.cancel("user")
+    assert not token.cancel("user")
+    assert calls == [1]
+    with pytest.raises(JobCancelled):
+        token.raise_if_cancelled()
+
+
+def test_deadline_cancels_token():
+    token = CancelToken("a", deadline=time.time() + 0.05)
+    calls = []
+    token.on_cancel(lambda: calls.append(1))
+    assert not token.cancelled
+    assert 0 < token.remaining() <= 0.05
+    time.sleep(0.06)
+    with pytest.raises(JobCancelled):
+        token.raise_if_cancelled()
+    assert token.reason == "deadline"
+    assert calls == [1]
+    assert token.remaining() == 0.0
+
+
+def test_wait_wakes_at_deadline():
+    token = CancelToken("a", deadline=time.time() + 0.05)
+    started = time.monotonic()
+    assert token.wait(5)
+    assert time.monotonic() - started < 1
+    assert token.reason == "deadline"
+
+
+def test_no_deadline():
+    token = CancelToken("a")
+    assert token.remaining() is None
+    assert not token.wait(0.01)
+
+
+def test_limit_deadline_only_tightens():
+    token = CancelToken("a", deadline=time.time() + 10)
+    token.limit_deadline(time.time() + 100)
+    assert token.remaining() <= 10
+    token.limit_deadline(time.time() + 1)
+    assert token.remaining() <= 1
+    token.limit_deadline(None)
+    assert token.remaining() is not None
+
+
+def test_finish_forgets_job():
+    registry = CancellationRegistry()
+    registry.register("a", "s1")
+    registry.finish("a")
+    assert registry.get("a") is None
+    assert registry.active_jobs("s1") == []
+    assert not registry.cancel("a")
+
+
+def test_llm_call_respects_deadline(monkeypatch):
+    pytest.importorskip("requests")
+    import llm_client
+
+    timeouts = []
+
+    def fake_post(*args, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        raise llm_client.requests.exceptions.ConnectionError("down")
+
+    monkeypatch.setattr(llm_client.requests, "post", fake_post)
+    with pytest.raises(JobCancelled):
+        llm_client.call_local_llm("你好", cancel_token=CancelToken("job", deadline=time.time() - 1))
+    assert timeouts == []
+
+    llm_client.call_local_llm("你好", max_retries=1, cancel_token=CancelToken("job", deadline=time.time() + 0.3))
+    assert timeouts == [llm_client.LLM_MIN_TIMEOUT]
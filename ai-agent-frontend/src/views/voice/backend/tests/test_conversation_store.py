@@ -0,0 +1,49 @@
+import pytest
+
+from conversation_store import ConversationStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"), flush_interval=0.01)
+    yield store
+    store.close()
+
+
+def test_records_are_written_in_order(store):
+    store.record("s1", "transcript", "今天天气怎么样", job_id="j1", duration=1.5)
+    store.record("s1", "reply", "晴", job_id="j2")
+    store.record("s2", "prompt", "你好")
+    assert store.flush(timeout=5)
+    records = store.session("s1")
+    assert [(r["kind"], r["text"]) for r in records] == [("transcript", "今天天气怎么样"), ("reply", "晴")]
+    assert records[0]["meta"] == {"duration": 1.5}
+    assert {s["session_id"] for s in store.recent_sessions()} == {"s1", "s2"}
+    assert store.stats()["written"] == 3
+
+
+def test_unknown_kind_is_rejected(store):
+    with pytest.raises(ValueError):
+        store.record("s1", "note", "x")
+
+
+def test_drop_policy_counts_overflow(tmp_path):
+    store = ConversationStore(str(tmp_path / "c.db"), queue_size=1, overflow="drop", flush_interval=0.5)
+    try:
+        results = [store.record("s", "prompt", str(i)) for i in range(50)]
+        assert not all(results)
+        assert store.stats()["dropped"] == results.count(False)
+    finally:
+        store.close()
+
+
+def test_close_writes_remaining_records(tmp_path):
+    path = str(tmp_path / "c.db")
+    store = ConversationStore(path, flush_interval=10)
+    store.record("s", "prompt", "x")
+    store.close()
+    reopened = ConversationStore(path)
+    try:
+        assert [r["text"] for r in reopened.session("s")] == ["x"]
+    finally:
+        reopened.close()
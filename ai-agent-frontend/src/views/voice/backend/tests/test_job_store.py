@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+from job_store import MemoryJobStore, SQLiteJobStore, RedisJobStore, new_result_id, result_owner, INSTANCE_ID
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore(ttl=60)
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.db"), ttl=60)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisJobStore(fakeredis.FakeRedis(), ttl=60)
+
+
+def test_round_trip(store):
+    store["a"] = {"status": "completed", "reply": "你好"}
+    assert "a" in store
+    assert store["a"] == {"status": "completed", "reply": "你好"}
+    assert store.get("missing") is None
+    with pytest.raises(KeyError):
+        store["missing"]
+
+
+def test_pop_removes_entry(store):
+    store["a"] = {"status": "completed"}
+    assert store.pop("a") == {"status": "completed"}
+    assert "a" not in store
+    assert store.pop("a", None) is None
+    with pytest.raises(KeyError):
+        store.pop("a")
+
+
+def test_delete(store):
+    store["a"] = {"status": "processing"}
+    del store["a"]
+    assert "a" not in store
+    with pytest.raises(KeyError):
+        del store["a"]
+
+
+def test_instance_registration_is_not_counted_as_job(store):
+    store.register_instance("node-1", "http://10.0.0.1:1013")
+    store["a"] = {"status": "processing"}
+    assert store.instance_url("node-1") == "http://10.0.0.1:1013"
+    assert store.instance_url("node-2") is None
+    assert store.stats()["jobs"] == 1
+
+
+def test_memory_store_expires_old_results():
+    store = MemoryJobStore(ttl=0.05, sweep_interval=0)
+    store.register_instance("node-1", "http://10.0.0.1:1013")
+    store["old"] = {"status": "completed"}
+    time.sleep(0.1)
+    store["new"] = {"status": "processing"}
+    assert "old" not in store
+    assert "new" in store
+    assert store.instance_url("node-1") == "http://10.0.0.1:1013"
+
+
+def test_sqlite_store_expires_old_results(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), ttl=0.05, sweep_interval=0)
+    store.register_instance("node-1", "http://10.0.0.1:1013")
+    store["old"] = {"status": "completed"}
+    time.sleep(0.1)
+    store["new"] = {"status": "processing"}
+    assert "old" not in store
+    assert "new" in store
+    assert store.instance_url("node-1") == "http://10.0.0.1:1013"
+
+
+def test_sweep_is_throttled():
+    store = MemoryJobStore(ttl=0.05, sweep_interval=60)
+    store["old"] = {"status": "completed"}
+    time.sleep(0.1)
+    store["new"] = {"status": "processing"}
+    assert "old" in store
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first, second = SQLiteJobStore(path), SQLiteJobStore(path)
+    first["a"] = {"status": "completed", "user_text": "测试"}
+    assert second.pop("a") == {"status": "completed", "user_text": "测试"}
+    assert "a" not in first
+
+
+def test_redis_store_sets_ttl_on_results_only():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    store = RedisJobStore(client, ttl=30, prefix="t:")
+    store["a"] = {"status": "processing"}
+    store.register_instance("node-1", "http://10.0.0.1:1013")
+    assert 0 < client.ttl("t:a") <= 30
+    assert client.ttl("t:instance:node-1") == -1
+    assert sorted(store) == ["a", "instance:node-1"]
+
+
+def test_result_ids_carry_owner():
+    result_id = new_result_id()
+    assert result_owner(result_id) == INSTANCE_ID
+    assert result_owner(f"{result_id}.wav") == INSTANCE_ID
+    assert result_owner("legacy-id") is None
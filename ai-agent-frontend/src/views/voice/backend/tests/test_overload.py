@@ -0,0 +1,71 @@
+import time
+
+from overload import OverloadController
+
+
+def _controller(depth, **kwargs):
+    options = dict(queue_target=10, up_after=5, down_after=30, enabled=False)
+    options.update(kwargs)
+    return OverloadController(lambda: depth[0], **options)
+
+
+def test_raises_one_level_after_sustained_pressure():
+    depth = [20]
+    controller = _controller(depth)
+    assert controller.evaluate(now=100) == 0
+    assert controller.evaluate(now=104) == 0
+    assert controller.evaluate(now=105) == 1
+    assert controller.evaluate(now=109) == 1
+    assert controller.evaluate(now=110) == 2
+    assert controller.pressure == 2.0
+
+
+def test_short_spikes_do_not_degrade():
+    depth = [20]
+    controller = _controller(depth)
+    controller.evaluate(now=100)
+    depth[0] = 7
+    controller.evaluate(now=103)
+    depth[0] = 20
+    assert controller.evaluate(now=106) == 0
+
+
+def test_recovers_slowly_with_hysteresis():
+    depth = [20]
+    controller = _controller(depth, max_level=1)
+    controller.evaluate(now=1000)
+    assert controller.evaluate(now=1005) == 1
+    assert controller.evaluate(now=1100) == 1
+    depth[0] = 7
+    # 介于升降阈值之间，保持不变
+    assert controller.evaluate(now=1200) == 1
+    depth[0] = 2
+    controller.evaluate(now=1300)
+    assert controller.evaluate(now=1329) == 1
+    assert controller.evaluate(now=1330) == 0
+    assert controller.transitions == 2
+
+
+def test_stage_latency_counts_as_pressure():
+    depth = [0]
+    controller = _controller(depth, stage_targets={"llm": 10.0})
+    controller.observe("llm", 30.0)
+    controller.observe("unknown", 100.0)
+    now = time.monotonic()
+    controller.evaluate(now=now)
+    assert controller.pressure == 3.0
+    assert controller.evaluate(now=now + 5) == 1
+
+
+def test_policy_per_level():
+    controller = _controller([0], asr_model="tiny", max_tokens=150, tts_sentences=1)
+    policies = []
+    for level in range(5):
+        controller.level = level
+        policies.append(controller.policy())
+    assert policies[0] == {"level": 0, "mode": "normal", "asr_model": None, "max_tokens": None,
+                           "tts_sentences": None, "tts": True}
+    assert policies[1]["asr_model"] == "tiny" and policies[1]["max_tokens"] is None
+    assert policies[2]["max_tokens"] == 150
+    assert policies[3]["tts_sentences"] == 1 and policies[3]["tts"]
+    assert not policies[4]["tts"]
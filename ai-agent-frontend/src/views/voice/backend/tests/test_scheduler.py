@@ -0,0 +1,128 @@
+import time
+import threading
+
+from scheduler import JobScheduler, RateLimiter, _ClassQueue, _Job, INTERACTIVE, BATCH
+
+
+def _job(client_id, cost, name):
+    return _Job(None, name, (), {}, INTERACTIVE, client_id, cost)
+
+
+def _drain(queue, weights=None, min_cost=0.5):
+    order = []
+    while queue.size:
+        order.append(queue.pop(weights or {}, min_cost).func)
+    return order
+
+
+def test_clients_share_a_class_fairly():
+    queue = _ClassQueue(INTERACTIVE)
+    for i in range(3):
+        queue.push(_job("heavy", 1.0, f"heavy-{i}"), i)
+    queue.push(_job("light", 1.0, "light-0"), 3)
+    # 后到的客户端不需要等前一个客户端的任务全部执行完
+    assert _drain(queue).index("light-0") <= 1
+
+
+def test_short_jobs_first_within_a_client():
+    queue = _ClassQueue(INTERACTIVE)
+    queue.push(_job("a", 60.0, "long"), 0)
+    queue.push(_job("a", 2.0, "short"), 1)
+    queue.push(_job("a", 10.0, "medium"), 2)
+    assert _drain(queue) == ["short", "medium", "long"]
+
+
+def test_cost_counts_against_the_client_share():
+    queue = _ClassQueue(INTERACTIVE)
+    queue.push(_job("a", 30.0, "a-long"), 0)
+    queue.push(_job("a", 30.0, "a-long-2"), 1)
+    for i in range(3):
+        queue.push(_job("b", 1.0, f"b-{i}"), 2 + i)
+    order = _drain(queue)
+    # a 执行一个 30 秒的任务后，b 的三个短任务都先于 a 的第二个长任务
+    assert order.index("a-long-2") == len(order) - 1
+
+
+def test_client_weights():
+    queue = _ClassQueue(INTERACTIVE)
+    for i in range(4):
+        queue.push(_job("vip", 1.0, f"vip-{i}"), i)
+        queue.push(_job("std", 1.0, f"std-{i}"), 4 + i)
+    order = _drain(queue, weights={"vip": 3.0})
+    assert sum(name.startswith("vip") for name in order[:4]) >= 3
+
+
+def _blocked_scheduler():
+    scheduler = JobScheduler(max_workers=1)
+    release = threading.Event()
+    scheduler.schedule(release.wait)
+    time.sleep(0.05)
+    return scheduler, release
+
+
+def test_interactive_runs_before_batch():
+    scheduler, release = _blocked_scheduler()
+    order = []
+    futures = [scheduler.schedule(order.append, "batch", priority=BATCH),
+               scheduler.schedule(order.append, "interactive", priority=INTERACTIVE)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    scheduler.shutdown()
+    assert order == ["interactive", "batch"]
+
+
+def test_batch_is_not_starved():
+    scheduler = JobScheduler(max_workers=1, max_batch_wait=0.0)
+    release = threading.Event()
+    scheduler.schedule(release.wait)
+    time.sleep(0.05)
+    order = []
+    futures = [scheduler.schedule(order.append, "batch", priority=BATCH),
+               scheduler.schedule(order.append, "interactive", priority=INTERACTIVE)]
+    time.sleep(0.01)
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    scheduler.shutdown()
+    assert order == ["batch", "interactive"]
+
+
+def test_expired_jobs_are_counted():
+    scheduler, release = _blocked_scheduler()
+    future = scheduler.schedule(lambda: None, deadline=time.time() + 0.01)
+    time.sleep(0.05)
+    release.set()
+    future.result(timeout=5)
+    stats = scheduler.stats()
+    scheduler.shutdown()
+    assert stats["classes"][INTERACTIVE]["expired"] == 1
+    assert stats["classes"][BATCH]["expired"] == 0
+
+
+def test_exceptions_reach_the_future():
+    scheduler = JobScheduler(max_workers=1)
+    future = scheduler.schedule(lambda: 1 / 0)
+    try:
+        future.result(timeout=5)
+    except ZeroDivisionError:
+        pass
+    else:
+        raise AssertionError("expected ZeroDivisionError")
+    finally:
+        scheduler.shutdown()
+
+
+def test_rate_limiter_bucket():
+    limiter = RateLimiter(rate_per_minute=60, burst=2)
+    assert limiter.allow("a")[0]
+    assert limiter.allow("a")[0]
+    allowed, retry_after = limiter.allow("a")
+    assert not allowed and 0 < retry_after <= 1.0
+    assert limiter.allow("b")[0]
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(rate_per_minute=0)
+    assert all(limiter.allow("a")[0] for _ in range(100))
@@ -0,0 +1,84 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache, normalize_question
+
+
+class FakeEmbedder:
+    """
+    每个不同的文本分配一个正交的单位向量：相同文本相似度为 1，不同文本为 0
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.ids = {}
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row, self.ids.setdefault(text, len(self.ids))] = 1.0
+        return vectors
+
+
+def _cache(**kwargs):
+    return SemanticCache(FakeEmbedder(), **kwargs)
+
+
+def test_normalize_question():
+    assert normalize_question("  今天，天气？ ") == "今天天气"
+    assert normalize_question("ＡＢＣ!") == "abc"
+
+
+def test_lookup_hit_and_miss():
+    cache = _cache(threshold=0.95)
+    cache.add("变压器温度多少？", "85 摄氏度")
+    hit = cache.lookup("变压器温度多少")
+    assert hit["answer"] == "85 摄氏度"
+    assert hit["source"] == "llm"
+    assert cache.lookup("线路负荷") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_faq_is_not_overwritten_by_llm(tmp_path):
+    faq = tmp_path / "faq.json"
+    faq.write_text('[{"question": ["怎么报修", "如何报修"], "answer": "拨打 95598"}]', encoding="utf-8")
+    cache = _cache()
+    cache.load_faq(str(faq))
+    cache.add("怎么报修", "模型的回答")
+    assert cache.lookup("怎么报修")["answer"] == "拨打 95598"
+    assert cache.stats()["faq_entries"] == 2
+
+
+def test_ttl_expires_llm_entries():
+    cache = _cache(ttl=-1)
+    cache.add("问题一", "回答")
+    assert cache.lookup("问题一") is None
+
+
+def test_capacity_evicts_oldest_llm_entry():
+    cache = _cache(capacity=2, threshold=0.99)
+    cache.add("一一", "a")
+    cache.add("二二", "b")
+    cache.add("三三", "c")
+    assert cache.lookup("一一") is None
+    assert cache.lookup("三三")["answer"] == "c"
+    assert cache.stats()["evicted"] == 1
+
+
+def test_index_grows_past_initial_capacity():
+    cache = _cache(capacity=1000, threshold=0.99)
+    for i in range(100):
+        cache.add(f"问题{i:03d}", str(i))
+    assert cache.stats()["entries"] == 100
+    assert cache.lookup("问题042")["answer"] == "42"
+
+
+def test_audio_is_prepared_for_new_entries():
+    submitted = []
+    cache = _cache(synthesize=lambda answer, key: f"/static/{key}.wav",
+                   submit=lambda func, *args: submitted.append(func(*args)))
+    cache.add("问题", "回答")
+    assert len(submitted) == 1
+    assert cache.lookup("问题")["audio_url"].startswith("/static/")
+    assert len(cache.audio_keys()) == 1
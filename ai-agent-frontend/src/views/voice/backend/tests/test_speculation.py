@@ -0,0 +1,51 @@
+from speculation import SpeculativeLLM, normalize_transcript
+
+
+def _speculator(**kwargs):
+    launched, cancelled = [], []
+
+    def launch(session_id, text):
+        launched.append(text)
+        return f"job-{len(launched)}"
+
+    speculator = SpeculativeLLM(launch, cancelled.append, **kwargs)
+    return speculator, launched, cancelled
+
+
+def test_normalize_transcript():
+    assert normalize_transcript("今天 天气，怎么样？") == normalize_transcript("今天天气怎么样")
+
+
+def test_launches_after_stable_partials_and_hits():
+    speculator, launched, cancelled = _speculator(stable_partials=2)
+    assert speculator.on_partial("s", "今天天气") is None
+    assert speculator.on_partial("s", "今天天气怎么样？") is None
+    assert speculator.on_partial("s", "今天天气怎么样？") == "job-1"
+    assert speculator.on_final("s", "今天天气怎么样") == "job-1"
+    assert cancelled == []
+    assert speculator.stats()["hits"] == 1
+
+
+def test_miss_cancels_speculation():
+    speculator, _, cancelled = _speculator()
+    assert speculator.on_partial("s", "打开灯", end_of_utterance=True) == "job-1"
+    assert speculator.on_final("s", "打开灯光") is None
+    assert cancelled == ["job-1"]
+
+
+def test_chunks_are_joined_in_order():
+    speculator, launched, _ = _speculator()
+    first, second, third = (speculator.next_chunk("s") for _ in range(3))
+    assert speculator.on_chunk("s", second, "天气") is None
+    assert speculator.on_chunk("s", first, "今天") is None
+    assert speculator.on_chunk("s", third, "怎么样？", end_of_utterance=True) == "job-1"
+    assert launched == ["今天天气怎么样？"]
+
+
+def test_chunks_from_a_finished_utterance_are_ignored():
+    speculator, launched, _ = _speculator()
+    chunk = speculator.next_chunk("s")
+    speculator.on_final("s", "别的")
+    speculator.next_chunk("s")
+    assert speculator.on_chunk("s", chunk, "旧的", end_of_utterance=True) is None
+    assert launched == []
@@ -0,0 +1,67 @@
+import pytest
+
+from text_frontend import (normalize_text, strip_markdown, int_to_chinese, split_sentences, first_sentences,
+                           split_language_segments, PhonemeCache)
+
+
+@pytest.mark.parametrize("number, reading", [
+    (0, "零"), (10, "十"), (15, "十五"), (105, "一百零五"), (3000, "三千"), (10010, "一万零一十"),
+])
+def test_int_to_chinese(number, reading):
+    assert int_to_chinese(number) == reading
+
+
+@pytest.mark.parametrize("text, reading", [
+    ("#1主变跳闸", "一号主变跳闸。"),
+    ("#2主变和3#主变", "二号主变和三号主变。"),
+    ("2点开会", "两点开会。"),
+    ("下午2:00", "下午两点整。"),
+    ("第2点", "第二点。"),
+    ("2台变压器", "两台变压器。"),
+    ("12台", "十二台。"),
+    ("持续2h", "持续两小时。"),
+    ("电压220kV", "电压二百二十千伏。"),
+    ("负荷85%", "负荷百分之八十五。"),
+    ("温度-5℃", "温度负五摄氏度。"),
+    ("2024-03-05", "二零二四年三月五日。"),
+])
+def test_normalize_text(text, reading):
+    assert normalize_text(text) == reading
+
+
+def test_strip_markdown_keeps_readable_text():
+    text = "## 处理步骤\n1. **断开** `QF1`\n- 查看[记录](http://example.com)\n#1主变"
+    assert strip_markdown(text) == "处理步骤。1、断开 QF1。查看记录。#1主变。"
+
+
+def test_split_sentences_and_first_sentences():
+    text = "第一句。第二句！第三句？"
+    assert split_sentences(text) == ["第一句。", "第二句！", "第三句？"]
+    assert first_sentences(text, 2) == "第一句。第二句！"
+
+
+def test_english_abbreviations_are_spelled_without_english_voice():
+    assert split_language_segments("启动AGC") == [("zh", "启动诶吉西")]
+
+
+class _FakeVoice:
+    def __init__(self):
+        self.calls = 0
+
+    def phonemize(self, text):
+        self.calls += 1
+        return [list(text)]
+
+    def phonemes_to_ids(self, phonemes):
+        return [ord(p) for p in phonemes]
+
+
+def test_phoneme_cache_reuses_sentences():
+    cache = PhonemeCache(maxsize=2)
+    voice = _FakeVoice()
+    first = cache.phoneme_ids("v", voice, "你好。")
+    assert cache.phoneme_ids("v", voice, "你好。") == first
+    assert voice.calls == 1
+    cache.invalidate("v")
+    cache.phoneme_ids("v", voice, "你好。")
+    assert voice.calls == 2
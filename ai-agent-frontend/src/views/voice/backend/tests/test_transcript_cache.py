@@ -0,0 +1,88 @@
+import io
+import time
+
+from transcript_cache import TranscriptCache, content_key, file_chunks
+
+
+def test_content_key_depends_on_audio_and_options():
+    assert content_key([b"ab", b"c"]) == content_key([b"abc"])
+    assert content_key([b"abc"]) != content_key([b"abd"])
+    assert content_key([b"abc"], {"language": "zh"}) != content_key([b"abc"], {"language": "en"})
+
+
+def test_file_chunks_rewinds():
+    stream = io.BytesIO(b"x" * 100)
+    assert b"".join(file_chunks(stream, chunk_size=7)) == b"x" * 100
+    assert stream.read() == b"x" * 100
+
+
+def test_hit_and_miss():
+    cache = TranscriptCache(maxsize=2)
+    assert cache.get("k") is None
+    assert cache.claim("k", "job-1") is None
+    assert cache.complete("k", {"user_text": "你好"}) == []
+    assert cache.get("k") == {"user_text": "你好"}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["in_flight"]) == (1, 1, 0)
+
+
+def test_followers_receive_leader_result():
+    cache = TranscriptCache()
+    assert cache.claim("k", "leader") is None
+    assert cache.claim("k", "f1") == "leader"
+    assert cache.claim("k", "f2") == "leader"
+    assert cache.complete("k", {"user_text": "x"}) == ["f1", "f2"]
+    assert cache.stats()["deduplicated"] == 2
+
+
+def test_abandon_returns_followers_without_caching():
+    cache = TranscriptCache()
+    cache.claim("k", "leader")
+    cache.claim("k", "f1")
+    assert cache.abandon("k") == ["f1"]
+    assert cache.get("k") is None
+    assert cache.claim("k", "next") is None
+
+
+def test_handoff_promotes_first_follower():
+    cache = TranscriptCache()
+    cache.claim("k", "leader")
+    cache.claim("k", "f1", {"session_id": "s1"})
+    cache.claim("k", "f2", {"session_id": "s2"})
+    assert cache.handoff("k") == ("f1", {"session_id": "s1"})
+    assert cache.claim("k", "f3") == "f1"
+    assert cache.complete("k", {"user_text": "x"}) == ["f2", "f3"]
+    assert cache.stats()["handoffs"] == 1
+
+
+def test_handoff_without_followers_releases_key():
+    cache = TranscriptCache()
+    cache.claim("k", "leader")
+    assert cache.handoff("k") is None
+    assert cache.claim("k", "next") is None
+
+
+def test_complete_without_cache():
+    cache = TranscriptCache()
+    cache.claim("k", "leader")
+    cache.complete("k", {"user_text": "x"}, cache=False)
+    assert cache.get("k") is None
+
+
+def test_lru_and_ttl():
+    cache = TranscriptCache(maxsize=2, ttl=0.05)
+    for key in ("a", "b", "c"):
+        cache.claim(key, key)
+        cache.complete(key, {"user_text": key})
+    assert cache.get("a") is None
+    assert cache.get("c") == {"user_text": "c"}
+    time.sleep(0.06)
+    assert cache.get("c") is None
+
+
+def test_disabled_cache():
+    cache = TranscriptCache(maxsize=0)
+    assert cache.claim("k", "a") is None
+    assert cache.claim("k", "b") is None
+    cache.complete("k", {"user_text": "x"})
+    assert cache.get("k") is None
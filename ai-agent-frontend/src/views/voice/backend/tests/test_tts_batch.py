@@ -0,0 +1,103 @@
+import io
+import os
+import json
+import time
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("numpy")
+pytest.importorskip("whisper")
+# 导入 app 时会加载 Whisper 模型，测试使用最小的模型
+os.environ.setdefault("WHISPER_MODEL", "tiny")
+
+import app as backend  # noqa: E402
+
+
+@pytest.fixture
+def synth(monkeypatch, tmp_path):
+    calls = []
+    state = {"engine": "piper"}
+
+    def fake_text_to_speech(text, output_path, **_):
+        calls.append(text)
+        with open(output_path, "wb") as f:
+            f.write(b"RIFF" + text.encode("utf-8"))
+        return output_path
+
+    monkeypatch.setattr(backend, "AUDIO_DIR", str(tmp_path))
+    monkeypatch.setattr(backend, "text_to_speech", fake_text_to_speech)
+    monkeypatch.setattr(backend, "engine_used", lambda: state["engine"])
+    return SimpleNamespace(calls=calls, state=state)
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+def _wait(client, batch_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        body = client.get(f"/tts-batch-status/{batch_id}").get_json()
+        if body["status"] != "processing":
+            return body
+        time.sleep(0.05)
+    raise AssertionError("批次未在超时前完成")
+
+
+@pytest.mark.parametrize("payload", [
+    {},
+    {"texts": []},
+    {"texts": "你好"},
+    {"texts": ["你好", ""]},
+    {"texts": ["你好"], "length_scale": "fast"},
+    {"texts": ["你好"], "length_scale": 0},
+])
+def test_invalid_requests(client, synth, payload):
+    assert client.post("/tts-batch", json=payload).status_code == 400
+
+
+def test_duplicates_are_synthesized_once(client, synth):
+    response = client.post("/tts-batch", json={"texts": ["你好", "再见", "你好"]})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert (body["total"], body["unique"]) == (3, 2)
+    result = _wait(client, body["batch_id"])
+    assert result["status"] == "completed"
+    items = result["items"]
+    assert items[0]["audio_url"] == items[2]["audio_url"] != items[1]["audio_url"]
+    assert sorted(synth.calls) == ["你好", "再见"]
+
+
+def test_piper_audio_is_reused_by_later_batches(client, synth):
+    first = _wait(client, client.post("/tts-batch", json={"texts": ["你好"]}).get_json()["batch_id"])
+    second = _wait(client, client.post("/tts-batch", json={"texts": ["你好"]}).get_json()["batch_id"])
+    assert first["items"][0]["audio_url"] == second["items"][0]["audio_url"]
+    assert synth.calls == ["你好"]
+
+
+def test_fallback_audio_is_not_reused(client, synth):
+    synth.state["engine"] = "beep"
+    first = _wait(client, client.post("/tts-batch", json={"texts": ["你好"]}).get_json()["batch_id"])
+    synth.state["engine"] = "piper"
+    second = _wait(client, client.post("/tts-batch", json={"texts": ["你好"]}).get_json()["batch_id"])
+    assert first["items"][0]["audio_url"] != second["items"][0]["audio_url"]
+    assert synth.calls == ["你好", "你好"]
+
+
+def test_zip_download(client, synth):
+    batch_id = client.post("/tts-batch", json={"texts": ["你好", "再见", "你好"]}).get_json()["batch_id"]
+    _wait(client, batch_id)
+    response = client.get(f"/tts-batch-status/{batch_id}?format=zip")
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        assert [item["file"] for item in manifest] == ["000.wav", "001.wav", "000.wav"]
+        assert zf.read("001.wav") == b"RIFF" + "再见".encode("utf-8")
+
+
+def test_unknown_batch(client):
+    assert client.get("/tts-batch-status/missing").status_code == 404
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from cancellation import JobCancelled
+from tts_fallback import CircuitBreaker
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("piper", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure(RuntimeError("a"))
+    assert breaker.allow()
+    breaker.record_failure(RuntimeError("b"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.status()["last_error"] == "b"
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = CircuitBreaker("piper", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure(RuntimeError("x"))
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("piper", failure_threshold=3, reset_timeout=0.01)
+    for _ in range(3):
+        breaker.record_failure(RuntimeError("x"))
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure(RuntimeError("y"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_release_frees_the_trial_without_closing():
+    breaker = CircuitBreaker("piper", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure(RuntimeError("x"))
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+@pytest.fixture
+def chain(monkeypatch, tmp_path):
+    pytest.importorskip("numpy")
+    pytest.importorskip("soundfile")
+    import tts_engine
+
+    calls = []
+
+    def engine(name, error=None):
+        def synthesize(text, output_path, **_):
+            calls.append(name)
+            if error is not None:
+                raise error
+            with open(output_path, "wb") as f:
+                f.write(b"\0" * 100)
+            return output_path
+        return synthesize
+
+    def configure(*engines):
+        monkeypatch.setattr(tts_engine, "TTS_ENGINES",
+                            [(name, lambda: True, engine(name, error)) for name, error in engines])
+        monkeypatch.setattr(tts_engine, "breakers", {
+            name: CircuitBreaker(name, failure_threshold=1, reset_timeout=60) for name, _ in engines[:-1]
+        })
+        return tts_engine
+
+    configure.calls = calls
+    configure.output = str(tmp_path / "out.wav")
+    return configure
+
+
+def test_chain_falls_back_and_skips_open_breakers(chain):
+    tts_engine = chain(("piper", RuntimeError("boom")), ("pyttsx3", None), ("beep", None))
+    tts_engine.text_to_speech("你好", chain.output)
+    assert chain.calls == ["piper", "pyttsx3"]
+    assert tts_engine.engine_used() == "pyttsx3"
+    assert tts_engine.breakers["piper"].state == CircuitBreaker.OPEN
+
+    tts_engine.text_to_speech("你好", chain.output)
+    assert chain.calls == ["piper", "pyttsx3", "pyttsx3"]
+
+
+def test_cancellation_does_not_fall_back(chain):
+    tts_engine = chain(("piper", JobCancelled("cancelled")), ("beep", None))
+    with pytest.raises(JobCancelled):
+        tts_engine.text_to_speech("你好", chain.output)
+    assert chain.calls == ["piper"]
+    assert tts_engine.breakers["piper"].state == CircuitBreaker.CLOSED
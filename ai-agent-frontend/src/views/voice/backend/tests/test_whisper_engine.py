@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("whisper")
+# 导入 whisper_engine 时会加载模型，测试使用最小的模型
+os.environ.setdefault("WHISPER_MODEL", "tiny")
+
+import numpy as np  # noqa: E402
+
+from whisper_engine import (parse_decode_options, split_on_silence, _transcribe_kwargs,  # noqa: E402
+                            DEFAULT_DECODE_OPTIONS, SAMPLE_RATE)
+
+
+def test_defaults_when_nothing_is_given():
+    assert parse_decode_options({}) == DEFAULT_DECODE_OPTIONS
+    assert parse_decode_options(None) == DEFAULT_DECODE_OPTIONS
+
+
+def test_language_names_and_auto_detection():
+    assert parse_decode_options({"language": "Chinese"})["language"] == "zh"
+    assert parse_decode_options({"language": "EN"})["language"] == "en"
+    assert parse_decode_options({"language": "auto"})["language"] is None
+    assert parse_decode_options({"language": ""})["language"] is None
+
+
+@pytest.mark.parametrize("values", [
+    {"language": "klingon"},
+    {"beam_size": "-1"},
+    {"beam_size": "abc"},
+    {"temperature_max": "1.5"},
+    {"long_audio": "sometimes"},
+])
+def test_invalid_values_raise(values):
+    with pytest.raises(ValueError):
+        parse_decode_options(values)
+
+
+def test_flags_and_prompt():
+    options = parse_decode_options({"without_timestamps": "false", "condition_on_previous_text": "on",
+                                    "initial_prompt": "", "long_audio": "Yes"})
+    assert options["without_timestamps"] is False
+    assert options["condition_on_previous_text"] is True
+    assert options["initial_prompt"] is None
+    assert options["long_audio"] == "true"
+
+
+def test_transcribe_kwargs_temperature_fallback():
+    kwargs = _transcribe_kwargs(parse_decode_options({"temperature_max": "0.4", "beam_size": "5"}))
+    assert kwargs["temperature"] == (0.0, 0.2, 0.4)
+    assert kwargs["beam_size"] == 5
+    kwargs = _transcribe_kwargs(parse_decode_options({"temperature_max": "0", "beam_size": "0"}))
+    assert kwargs["temperature"] == 0.0
+    assert "beam_size" not in kwargs
+
+
+def _tone(seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (0.5 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def test_short_audio_is_a_single_chunk():
+    audio = _tone(10)
+    assert split_on_silence(audio, chunk_seconds=30) == [(0, len(audio))]
+
+
+def test_chunks_cover_the_audio_and_respect_the_limit():
+    audio = _tone(75)
+    chunks = split_on_silence(audio, chunk_seconds=30, search_seconds=5)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(audio)
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in chunks)
+
+
+def test_cut_lands_in_silence():
+    silence_at = 27
+    audio = np.concatenate([_tone(silence_at), np.zeros(SAMPLE_RATE // 2, dtype=np.float32), _tone(20)])
+    (_, cut), _ = split_on_silence(audio, chunk_seconds=30, search_seconds=5)
+    assert silence_at * SAMPLE_RATE <= cut <= (silence_at + 0.5) * SAMPLE_RATE
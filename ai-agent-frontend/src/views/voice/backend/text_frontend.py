@@ -0,0 +1,329 @@
+"""
+TTS 文本前端
+在送入 Piper 合成之前对 LLM 回复做规范化：去除 markdown、将数字/单位/日期展开为中文读法、
+切分中英文片段，并按句缓存音素 ID，重复的句子无需再次音素化
+"""
+import os
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("text_frontend")
+
+DIGITS = "零一二三四五六七八九"
+
+# 电网领域常见单位的中文读法（区分大小写，长的写在前面优先匹配）
+UNITS = OrderedDict([
+    ("kWh", "千瓦时"), ("MWh", "兆瓦时"), ("GWh", "吉瓦时"), ("TWh", "太瓦时"),
+    ("kVA", "千伏安"), ("MVA", "兆伏安"),
+    ("kvar", "千乏"), ("Mvar", "兆乏"), ("MVar", "兆乏"),
+    ("kV", "千伏"), ("mV", "毫伏"), ("V", "伏"),
+    ("kW", "千瓦"), ("MW", "兆瓦"), ("GW", "吉瓦"), ("W", "瓦"),
+    ("kA", "千安"), ("mA", "毫安"), ("A", "安"),
+    ("kHz", "千赫"), ("Hz", "赫兹"),
+    ("kΩ", "千欧"), ("MΩ", "兆欧"), ("Ω", "欧姆"),
+    ("km", "公里"), ("cm", "厘米"), ("mm", "毫米"), ("m", "米"),
+    ("kg", "千克"), ("t", "吨"),
+    ("°C", "摄氏度"), ("℃", "摄氏度"),
+    ("ms", "毫秒"), ("min", "分钟"), ("s", "秒"), ("h", "小时"),
+])
+
+# 无数字前缀时也需要转换的单位（避免把普通英文单词误判为单位，只取多字母的电气单位）
+STANDALONE_UNITS = ["kWh", "MWh", "GWh", "kVA", "MVA", "kvar", "Mvar", "kV", "kW", "MW", "GW", "kHz", "Hz"]
+
+# 量词、时长单位和钟点：前面的 2 读作“两”（两个、两小时、两点），不读“二”
+MEASURE_WORDS = ("个", "小时", "分钟", "秒", "天", "周", "次", "台", "条", "位", "种", "名", "人", "件",
+                 "份", "张", "组", "路", "座", "处", "项", "回", "遍", "倍", "辆", "块", "根", "套", "类", "点")
+MEASURE_UNITS = {"h", "min", "s", "ms", "t", "kg"}
+
+SYMBOLS = {
+    "±": "正负", "≥": "大于等于", "≤": "小于等于", ">": "大于", "<": "小于",
+    "=": "等于", "≈": "约等于", "&": "和", "~": "到", "～": "到", "→": "到",
+}
+
+# 没有英文语音时，大写缩写按字母逐个读出
+LETTER_NAMES = {
+    "A": "诶", "B": "比", "C": "西", "D": "迪", "E": "伊", "F": "艾弗", "G": "吉",
+    "H": "艾尺", "I": "艾", "J": "杰", "K": "开", "L": "艾勒", "M": "艾姆", "N": "艾恩",
+    "O": "欧", "P": "批", "Q": "丘", "R": "艾儿", "S": "艾丝", "T": "提", "U": "优",
+    "V": "维", "W": "达布溜", "X": "艾克斯", "Y": "歪", "Z": "贼德",
+}
+
+SENTENCE_END = "。！？；.!?;"
+
+_EMOJI_RE = re.compile("[\U0001F300-\U0001FAFF\U00002600-\U000027BF\U0001F000-\U0001F2FF️]")
+_NUMBER = r"\d+(?:\.\d+)?"
+_UNIT_RE = re.compile(
+    r"(-?" + _NUMBER + r")\s*(" + "|".join(re.escape(u) for u in UNITS) + r")(?![A-Za-z])"
+)
+_STANDALONE_UNIT_RE = re.compile(
+    r"(?<![A-Za-z])(" + "|".join(re.escape(u) for u in STANDALONE_UNITS) + r")(?![A-Za-z])"
+)
+_TWO_BEFORE_MEASURE_RE = re.compile(
+    r"(?<![\d.第])2(?![\d.])(?=\s*(?:" + "|".join(MEASURE_WORDS) + r"))"
+)
+_LATIN_RE = re.compile(r"[A-Za-z][A-Za-z'\-]*(?:\s+[A-Za-z][A-Za-z'\-]*)*")
+
+
+def int_to_chinese(number: int) -> str:
+    """
+    将整数转换为中文读法，例如 220 -> 二百二十，10500 -> 一万零五百
+    """
+    if number == 0:
+        return "零"
+    if number < 0:
+        return "负" + int_to_chinese(-number)
+
+    small_units = ["", "十", "百", "千"]
+    large_units = ["", "万", "亿", "万亿"]
+
+    def four_digits(value):
+        result = ""
+        zero = False
+        for i in range(3, -1, -1):
+            digit = value // (10 ** i) % 10
+            if digit == 0:
+                zero = bool(result)
+                continue
+            if zero:
+                result += "零"
+                zero = False
+            result += DIGITS[digit] + small_units[i]
+        return result
+
+    groups = []
+    while number > 0:
+        groups.append(number % 10000)
+        number //= 10000
+
+    result = ""
+    need_zero = False
+    for index in range(len(groups) - 1, -1, -1):
+        group = groups[index]
+        if group == 0:
+            need_zero = bool(result)
+            continue
+        if result and (need_zero or group < 1000):
+            result += "零"
+        result += four_digits(group) + large_units[index]
+        need_zero = False
+
+    # “一十二” 读作 “十二”
+    if result.startswith("一十"):
+        result = result[1:]
+    return result
+
+
+def digits_to_chinese(text: str) -> str:
+    """
+    逐位读出数字串，用于年份、编号、电话号码等
+    """
+    return "".join(DIGITS[int(c)] for c in text)
+
+
+def number_to_chinese(text: str) -> str:
+    """
+    读出整数或小数，例如 3.14 -> 三点一四；前导零或超长的数字逐位读出
+    """
+    negative = text.startswith("-")
+    if negative:
+        text = text[1:]
+    if "." in text:
+        integer, fraction = text.split(".", 1)
+        result = int_to_chinese(int(integer or "0")) + "点" + digits_to_chinese(fraction)
+    elif len(text) > 1 and text.startswith("0") or len(text) > 12:
+        result = digits_to_chinese(text)
+    else:
+        result = int_to_chinese(int(text))
+    return ("负" if negative else "") + result
+
+
+def strip_markdown(text: str) -> str:
+    """
+    去除 markdown 标记，只保留适合朗读的文字
+    """
+    text = re.sub(r"```.*?```", "", text, flags=re.S)              # 代码块
+    text = re.sub(r"`([^`]*)`", r"\1", text)                       # 行内代码
+    text = re.sub(r"!\[([^\]]*)\]\([^)]*\)", r"\1", text)          # 图片
+    text = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", text)           # 链接
+    text = re.sub(r"https?://\S+", "", text)                       # 裸链接
+    text = re.sub(r"<[^>]+>", "", text)                            # HTML 标签
+    text = re.sub(r"^\s*#{1,6}\s+", "", text, flags=re.M)          # 标题（# 后必须有空格，#1 是设备编号）
+    text = re.sub(r"^\s*>\s?", "", text, flags=re.M)               # 引用
+    text = re.sub(r"^\s*([-*_])(\s*\1){2,}\s*$", "", text, flags=re.M)  # 分隔线
+    text = re.sub(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$", "", text, flags=re.M)  # 表格分隔行
+    text = re.sub(r"^\s*[-*+]\s+", "", text, flags=re.M)           # 无序列表
+    text = re.sub(r"^\s*(\d+)[.)]\s+", r"\1、", text, flags=re.M)  # 有序列表
+    text = re.sub(r"(\*\*|__)(.+?)\1", r"\2", text)                # 粗体
+    text = re.sub(r"(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?!\w)", r"\1", text)  # 斜体
+    text = re.sub(r"~~(.+?)~~", r"\1", text)                       # 删除线
+    text = re.sub(r"[ \t]*\|[ \t]*", "，", text)                      # 表格列
+    text = _EMOJI_RE.sub("", text)
+
+    # 换行处补充句读，便于分句和停顿
+    lines = [line.strip(" ，") for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    text = "".join(line if line[-1] in SENTENCE_END + "，,：:、" else line + "。" for line in lines)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _date_to_chinese(match) -> str:
+    year, month, day = match.group(1), match.group(2), match.group(3)
+    result = digits_to_chinese(year) + "年" + int_to_chinese(int(month)) + "月"
+    if day:
+        result += int_to_chinese(int(day)) + "日"
+    return result
+
+
+def _time_to_chinese(match) -> str:
+    hour, minute, second = match.group(1), match.group(2), match.group(3)
+    result = ("两" if int(hour) == 2 else int_to_chinese(int(hour))) + "点"
+    if minute == "00" and not second:
+        return result + "整"
+    result += ("零" if minute.startswith("0") and minute != "00" else "") + int_to_chinese(int(minute)) + "分"
+    if second:
+        result += int_to_chinese(int(second)) + "秒"
+    return result
+
+
+def expand_numbers(text: str) -> str:
+    """
+    将日期、时间、百分比、带单位的数值、编号和普通数字展开为中文读法
+    """
+    text = re.sub(r"(?<=\d),(?=\d{3}(?!\d))", "", text)            # 千分位
+    text = re.sub(r"(\d{4})[-/年](\d{1,2})(?:[-/月](\d{1,2})[日号]?)?(?![\d:])",
+                  _date_to_chinese, text)                           # 日期
+    text = re.sub(r"(\d{4})年", lambda m: digits_to_chinese(m.group(1)) + "年", text)
+    text = re.sub(r"(?<!\d)(\d{1,2}):(\d{2})(?::(\d{2}))?(?!\d)", _time_to_chinese, text)  # 时间
+    text = re.sub(r"(-?" + _NUMBER + r")\s*[%％]",
+                  lambda m: "百分之" + number_to_chinese(m.group(1)), text)  # 百分比
+    text = _UNIT_RE.sub(lambda m: ("两" if m.group(1) == "2" and m.group(2) in MEASURE_UNITS
+                                   else number_to_chinese(m.group(1))) + UNITS[m.group(2)], text)
+    text = _STANDALONE_UNIT_RE.sub(lambda m: UNITS[m.group(1)], text)
+    text = re.sub(r"#(\d+)|(\d+)#",
+                  lambda m: number_to_chinese(m.group(1) or m.group(2)) + "号", text)  # 设备编号
+    text = re.sub(r"(?<![\w.])-(?=\d)", "负", text)
+    text = _TWO_BEFORE_MEASURE_RE.sub("两", text)
+    text = re.sub(_NUMBER, lambda m: number_to_chinese(m.group(0)), text)
+    for symbol, reading in SYMBOLS.items():
+        text = text.replace(symbol, reading)
+    return text
+
+
+def spell_letters(word: str) -> str:
+    """
+    将大写缩写按字母读出，例如 AGC -> 诶吉西
+    """
+    return "".join(LETTER_NAMES.get(c.upper(), "") for c in word)
+
+
+def normalize_text(text: str) -> str:
+    """
+    完整的文本规范化：去 markdown + 数字单位展开
+    """
+    return expand_numbers(strip_markdown(text))
+
+
+def split_language_segments(text: str, english_voice: bool = False):
+    """
+    将规范化后的文本切分为 [(语言, 文本)] 片段。
+    有英文语音时英文片段交给英文语音合成；否则大写缩写按字母读出，其余英文保留在中文片段中。
+    """
+    segments = []
+
+    def append(lang, value):
+        if not value.strip():
+            return
+        if segments and segments[-1][0] == lang:
+            segments[-1] = (lang, segments[-1][1] + value)
+        else:
+            segments.append((lang, value))
+
+    position = 0
+    for match in _LATIN_RE.finditer(text):
+        append("zh", text[position:match.start()])
+        span = match.group(0)
+        if english_voice:
+            append("en", span)
+        elif span.isupper() and len(span) <= 6:
+            append("zh", spell_letters(span))
+        else:
+            append("zh", span)
+        position = match.end()
+    append("zh", text[position:])
+    return segments
+
+
+def split_sentences(text: str):
+    """
+    按句末标点切分句子（保留标点），作为音素缓存的粒度
+    """
+    sentences = re.findall(r"[^" + re.escape(SENTENCE_END) + r"]+[" + re.escape(SENTENCE_END) + r"]*", text)
+    # 只有标点的片段没有可朗读的内容
+    return [s.strip() for s in sentences if re.search(r"\w", s)]
+
+
+def first_sentences(text: str, count: int) -> str:
+    """
+    只保留前 count 句（过载降级时只合成回复的开头）
+    """
+    sentences = split_sentences(text)
+    return "".join(sentences[:count]) if len(sentences) > count else text
+
+
+class PhonemeCache:
+    """
+    按 (语音, 句子) 缓存 Piper 音素 ID 的有界 LRU 缓存
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def phoneme_ids(self, voice_name, piper_voice, sentence):
+        """
+        返回句子的音素 ID 列表（Piper 可能将一句再切分，因此是列表的列表）
+        """
+        key = (voice_name, sentence)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        ids = [piper_voice.phonemes_to_ids(phonemes) for phonemes in piper_voice.phonemize(sentence)]
+        with self._lock:
+            self._entries[key] = ids
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return ids
+
+    def invalidate(self, voice_name):
+        """
+        删除某个语音的全部缓存（语音模型被替换时调用），返回删除的条目数
+        """
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == voice_name]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+phoneme_cache = PhonemeCache(maxsize=int(os.getenv("TTS_PHONEME_CACHE_SIZE", "1024")))
@@ -0,0 +1,160 @@
+"""
+识别结果缓存
+客户端在网络错误后会重传，前端也可能重复发送同一段录音。按音频内容哈希（原始上传文件，
+原始音频流则是解码后的 PCM）加上解码参数缓存识别结果，命中时跳过格式转换和 Whisper。
+同样内容的请求同时到达时只识别一次：第一个请求执行识别，其他请求登记为跟随者，
+识别结束后结果复制给每个跟随者的任务ID（状态查询在读取后会删除结果，不能共用一个ID）。
+执行识别的请求被取消（例如所属会话开始了新一轮）时，结果不复制给跟随者，
+而是由第一个跟随者接手重新识别，其余跟随者继续等待
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_key(chunks, options=None):
+    """
+    对音频内容（bytes 的可迭代对象）和解码参数计算缓存键
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    digest.update(json.dumps(options or {}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def file_chunks(stream, chunk_size=64 * 1024):
+    """
+    逐块读取文件对象，读完后回到开头，之后仍可正常保存
+    """
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+    stream.seek(0)
+
+
+class TranscriptCache:
+    """
+    有界 LRU + TTL 的识别结果缓存，附带进行中任务的去重
+    """
+
+    def __init__(self, maxsize=256, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (result, created_at)
+        self._inflight = {}             # key -> [leader_id, follower_id...]
+        self._contexts = {}             # 任务ID -> claim 时登记的提交参数，接手识别时使用
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.handoffs = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            maxsize=int(os.getenv("TRANSCRIPT_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("TRANSCRIPT_CACHE_TTL", "600")),
+        )
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def claim(self, key, result_id, context=None):
+        """
+        登记一次识别。没有相同内容的任务在进行时返回 None（调用方负责识别），
+        否则把 result_id 登记为跟随者并返回正在执行的任务ID。
+        context 为跟随者接手识别时需要的提交参数（会话、优先级等），见 handoff
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            waiting = self._inflight.get(key)
+            if waiting is None:
+                self._inflight[key] = [result_id]
+                return None
+            waiting.append(result_id)
+            self._contexts[result_id] = context or {}
+            self.deduplicated += 1
+            return waiting[0]
+
+    def _pop(self, key):
+        # 调用方持有 self._lock
+        waiting = self._inflight.pop(key, [])
+        for result_id in waiting:
+            self._contexts.pop(result_id, None)
+        return waiting
+
+    def complete(self, key, result, cache=True):
+        """
+        识别完成，返回需要同样填入结果的跟随者任务ID；cache=False 时只分发不缓存
+        """
+        with self._lock:
+            waiting = self._pop(key)
+            if cache and self.enabled:
+                self._entries[key] = (dict(result), time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return waiting[1:]
+
+    def abandon(self, key):
+        """
+        识别失败，返回跟随者任务ID，由调用方告知它们同样的结果
+        """
+        with self._lock:
+            return self._pop(key)[1:]
+
+    def handoff(self, key):
+        """
+        执行识别的任务被取消：第一个跟随者成为新的执行者，其余跟随者改为等待它。
+        返回 (新执行者的任务ID, 它登记的 context)，没有跟随者时返回 None
+        """
+        with self._lock:
+            waiting = self._inflight.get(key)
+            if not waiting or len(waiting) < 2:
+                self._pop(key)
+                return None
+            waiting.pop(0)
+            self.handoffs += 1
+            return waiting[0], self._contexts.pop(waiting[0], {})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "in_flight": len(self._inflight),
+                "deduplicated": self.deduplicated,
+                "handoffs": self.handoffs,
+            }
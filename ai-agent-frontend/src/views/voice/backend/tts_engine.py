@@ -1,20 +1,26 @@
 import os
+import time
+import uuid
+import threading
 import logging
 import json # 导入 json 模块以捕获特定错误
 import soundfile as sf
 import numpy as np
 from functools import lru_cache
-import threading
 
 # --- 依赖库导入与检查 ---
+from tts_manager import PiperVoiceManager, VoiceNotFound, InvalidVoiceOption, PIPER_AVAILABLE
+from text_frontend import normalize_text, split_language_segments, split_sentences, phoneme_cache
+from tts_fallback import CircuitBreaker, Pyttsx3Worker
+from cancellation import JobCancelled
+
 try:
-    from piper import PiperVoice
-    PIPER_AVAILABLE = True
+    from piper import SynthesisConfig
 except ImportError:
-    PIPER_AVAILABLE = False
+    SynthesisConfig = None
 
 try:
-    import pyttsx3
+    import pyttsx3  # noqa: F401  实际使用在 Pyttsx3Worker 的工作线程中
     PYTTSX3_AVAILABLE = True
 except ImportError:
     PYTTSX3_AVAILABLE = False
@@ -24,6 +30,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger("tts_engine")
 
 # 抑制piper.phoneme_ids的警告日志，避免"Missing phoneme from id map"警告
+# （文本已由 text_frontend 规范化，残留的少见字符仍可能触发该警告）
 piper_phoneme_logger = logging.getLogger("piper.phoneme_ids")
 piper_phoneme_logger.setLevel(logging.ERROR)
 
@@ -42,104 +49,370 @@ os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
 PIPER_VOICE_NAME = "zh_CN-huayan-medium"
 
 # 3. 构建模型的完整路径。代码将从这里加载模型。
-MODEL_PATH_ONNX = os.path.join(BASE_DIR, "piper_models", PIPER_VOICE_NAME + ".onnx")
-MODEL_PATH_JSON = os.path.join(BASE_DIR, "piper_models", PIPER_VOICE_NAME + ".onnx.json")
+PIPER_MODELS_DIR = os.path.join(BASE_DIR, "piper_models")
+MODEL_PATH_ONNX = os.path.join(PIPER_MODELS_DIR, PIPER_VOICE_NAME + ".onnx")
+MODEL_PATH_JSON = os.path.join(PIPER_MODELS_DIR, PIPER_VOICE_NAME + ".onnx.json")
+
+# 4. 英文片段使用的语音，模型不存在时英文缩写按字母用中文语音读出
+PIPER_ENGLISH_VOICE = os.getenv("PIPER_ENGLISH_VOICE", "en_US-lessac-medium")
 
 
 # --- TTS 引擎初始化 ---
-piper_voice = None
-piper_voice_lock = threading.Lock()
+# 语音管理器：多语音懒加载、会话副本和 LRU 淘汰，配置见 PiperVoiceManager.from_env
+voice_manager = PiperVoiceManager.from_env(PIPER_MODELS_DIR, PIPER_VOICE_NAME)
+piper_ready = False
+
+def _synthesize_audio(piper_voice, text: str, syn_config=None):
+    """
+    调用 Piper 合成并将各版本不同的返回类型统一为 numpy 数组
+    """
+    if syn_config is not None:
+        audio_chunks = list(piper_voice.synthesize(text, syn_config=syn_config))
+    else:
+        audio_chunks = list(piper_voice.synthesize(text))
+
+    if audio_chunks and hasattr(audio_chunks[0], 'audio_int16_bytes'):
+        # 新版本返回AudioChunk对象，包含audio_int16_bytes属性
+        return np.concatenate([chunk.audio_int16_array for chunk in audio_chunks])
+    if audio_chunks and hasattr(audio_chunks[0], 'audio'):
+        # 其他版本返回AudioChunk对象，包含audio属性
+        return np.concatenate([chunk.audio for chunk in audio_chunks])
+    if audio_chunks and isinstance(audio_chunks[0], np.ndarray):
+        # 如果是numpy数组，直接连接
+        return np.concatenate(audio_chunks)
+    if len(audio_chunks) == 1:
+        chunk = audio_chunks[0]
+        if hasattr(chunk, 'audio'):
+            return chunk.audio
+        if hasattr(chunk, 'audio_int16_array'):
+            return chunk.audio_int16_array
+        if isinstance(chunk, np.ndarray):
+            return chunk
+        return np.array(chunk)
+    raise TypeError("无法处理返回的音频数据类型")
+
+def _resolve_speaker(piper_voice, speaker):
+    """
+    将说话人名称或编号解析为 speaker_id
+    """
+    if speaker is None or speaker == "":
+        return None
+    if isinstance(speaker, int) or str(speaker).isdigit():
+        speaker_id = int(speaker)
+    else:
+        speaker_id_map = getattr(piper_voice.config, "speaker_id_map", None) or {}
+        if speaker not in speaker_id_map:
+            raise InvalidVoiceOption(f"未知的说话人: {speaker}")
+        speaker_id = speaker_id_map[speaker]
+    num_speakers = getattr(piper_voice.config, "num_speakers", 1)
+    if speaker_id >= num_speakers:
+        raise InvalidVoiceOption(f"说话人编号超出范围: {speaker_id} (共 {num_speakers} 个)")
+    return speaker_id
+
+def _synthesis_config(piper_voice, speaker=None, length_scale=None):
+    """
+    根据请求参数构造 SynthesisConfig，没有自定义参数时返回 None
+    """
+    speaker_id = _resolve_speaker(piper_voice, speaker)
+    if speaker_id is None and length_scale is None:
+        return None
+    if SynthesisConfig is None:
+        logger.warning("当前 piper 版本不支持 SynthesisConfig，忽略 speaker/length_scale 参数")
+        return None
+    return SynthesisConfig(speaker_id=speaker_id, length_scale=length_scale)
+
+def _sentence_audio(voice_name, piper_voice, sentence: str, syn_config=None):
+    """
+    使用缓存的音素 ID 合成一句话；piper 版本不支持分步接口时直接合成
+    """
+    if not all(hasattr(piper_voice, attr) for attr in ("phonemize", "phonemes_to_ids", "phoneme_ids_to_audio")):
+        return _synthesize_audio(piper_voice, sentence, syn_config)
+
+    if syn_config is None and SynthesisConfig is not None:
+        syn_config = SynthesisConfig()
+    pieces = []
+    for phoneme_ids in phoneme_cache.phoneme_ids(voice_name, piper_voice, sentence):
+        audio = piper_voice.phoneme_ids_to_audio(phoneme_ids, syn_config)
+        # 与 PiperVoice.synthesize 相同的音量归一化
+        if syn_config is None or getattr(syn_config, "normalize_audio", True):
+            max_val = np.max(np.abs(audio)) if audio.size else 0.0
+            audio = audio / max_val if max_val >= 1e-8 else np.zeros_like(audio)
+        volume = getattr(syn_config, "volume", 1.0)
+        if volume != 1.0:
+            audio = audio * volume
+        pieces.append((np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16))
+    return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.int16)
+
+def _resample(audio, source_rate: int, target_rate: int):
+    """
+    线性插值重采样，用于拼接采样率不同的语音片段
+    """
+    if source_rate == target_rate or audio.size == 0:
+        return audio
+    target_length = int(round(audio.size * target_rate / source_rate))
+    positions = np.linspace(0, audio.size - 1, target_length)
+    return np.interp(positions, np.arange(audio.size), audio).astype(np.int16)
+
+def _iter_sentence_audio(text: str, voice: str = None, speaker=None, length_scale: float = None,
+                         cancel_token=None):
+    """
+    文本前端 + 分句合成：规范化文本，中英文片段分别交给对应语音，逐句使用音素缓存合成。
+    每合成完一句就产出 (int16 音频数组, 采样率)，采样率统一为第一句的采样率。
+    每句开始前检查取消标记
+    """
+    voice_name = voice or voice_manager.default_voice
+    english_voice = None
+    if PIPER_ENGLISH_VOICE != voice_name and PIPER_ENGLISH_VOICE in voice_manager.available_voices():
+        english_voice = PIPER_ENGLISH_VOICE
+
+    normalized = normalize_text(text) or "你好"
+    segments = split_language_segments(normalized, english_voice=english_voice is not None)
+    logger.info(f"文本规范化结果: {normalized[:80]}（{len(segments)} 个语言片段）")
+
+    sample_rate = None
+    for lang, segment in segments:
+        segment_voice = english_voice if lang == "en" else voice_name
+        with voice_manager.acquire(segment_voice) as piper_voice:
+            rate = piper_voice.config.sample_rate
+            # 说话人只对主语音生效
+            segment_speaker = speaker if segment_voice == voice_name else None
+            syn_config = _synthesis_config(piper_voice, segment_speaker, length_scale)
+            for sentence in split_sentences(segment):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                audio = _sentence_audio(segment_voice, piper_voice, sentence, syn_config)
+                if sample_rate is None:
+                    sample_rate = rate
+                yield _resample(audio, rate, sample_rate), sample_rate
+
+def _synthesize_text(text: str, voice: str = None, speaker=None, length_scale: float = None,
+                     cancel_token=None):
+    """
+    合成整段文本，返回 (int16 音频数组, 采样率)
+    """
+    pieces = []
+    sample_rate = None
+    for audio, sample_rate in _iter_sentence_audio(text, voice, speaker, length_scale, cancel_token):
+        pieces.append(audio)
+    if not pieces:
+        raise RuntimeError("文本规范化后没有可合成的内容")
+    return np.concatenate(pieces), sample_rate
 
 # 缓存常用的短语以提高响应速度
+# 不超过该长度、且不指定说话人和语速的文本直接使用缓存的合成结果
+CACHED_PHRASE_MAX_CHARS = int(os.getenv("TTS_CACHED_PHRASE_MAX_CHARS", "32"))
+
 @lru_cache(maxsize=128)
-def cached_synthesize(text: str):
+def cached_synthesize(text: str, voice: str = None):
     """
-    缓存常用的短语合成结果以提高响应速度
+    缓存常用的短语合成结果以提高响应速度，返回 (音频, 采样率)。
+    失败时抛出异常（lru_cache 不缓存异常，下次调用会重新合成）
     """
-    if piper_voice:
-        try:
-            audio_chunks = list(piper_voice.synthesize(text))
-            if audio_chunks and hasattr(audio_chunks[0], 'audio_int16_bytes'):
-                # 新版本返回AudioChunk对象，包含audio_int16_bytes属性
-                audio_data = np.concatenate([chunk.audio_int16_array for chunk in audio_chunks])
-            elif audio_chunks and hasattr(audio_chunks[0], 'audio'):
-                # 其他版本返回AudioChunk对象，包含audio属性
-                audio_data = np.concatenate([chunk.audio for chunk in audio_chunks])
-            elif audio_chunks and isinstance(audio_chunks[0], np.ndarray):
-                # 如果是numpy数组，直接连接
-                audio_data = np.concatenate(audio_chunks)
-            else:
-                # 其他情况尝试转换
-                if audio_chunks and hasattr(audio_chunks[0], 'audio'):
-                    audio_data = np.concatenate([chunk.audio for chunk in audio_chunks])
-                elif len(audio_chunks) == 1:
-                    # 如果只有一个元素，尝试直接使用
-                    audio_data = audio_chunks[0]
-                    if hasattr(audio_data, 'audio'):
-                        audio_data = audio_data.audio
-                    elif hasattr(audio_data, 'audio_int16_array'):
-                        audio_data = audio_data.audio_int16_array
-                    # 如果audio_data是numpy数组，直接使用
-                    elif isinstance(audio_data, np.ndarray):
-                        audio_data = audio_data
-                    else:
-                        # 尝试转换为numpy数组
-                        audio_data = np.array(audio_data)
-                else:
-                    raise TypeError("无法处理返回的音频数据类型")
-            return audio_data
-        except Exception as e:
-            logger.error(f"Piper 缓存合成过程中发生错误: {e}", exc_info=True)
-    return None
+    if not piper_ready:
+        raise RuntimeError("Piper 尚未就绪")
+    return _synthesize_text(text, voice)
 
 def initialize_piper():
     """
-    从指定的本地路径加载 Piper 模型。
+    从指定的本地路径加载默认 Piper 语音模型，其他语音在首次请求时加载。
     这种方法比依赖自动下载更稳定。
     """
-    global piper_voice
+    global piper_ready
     if not PIPER_AVAILABLE:
         logger.warning("Piper-tts 库未安装，将无法使用 Piper 引擎。")
         return
 
+    default_onnx, default_json = voice_manager.model_paths(voice_manager.default_voice)
     # **【核心修正】** 在加载前，先检查模型文件是否存在
-    if not os.path.exists(MODEL_PATH_ONNX) or not os.path.exists(MODEL_PATH_JSON):
+    if not os.path.exists(default_onnx) or not os.path.exists(default_json):
         logger.error("="*50)
         logger.error(f"Piper 模型文件未找到!")
-        logger.error(f"请手动下载模型并将它们放入以下文件夹: {os.path.dirname(MODEL_PATH_ONNX)}")
+        logger.error(f"请手动下载模型并将它们放入以下文件夹: {os.path.dirname(default_onnx)}")
         logger.error("需要下载两个文件:")
-        logger.error(f"1. {os.path.basename(MODEL_PATH_ONNX)}")
-        logger.error(f"2. {os.path.basename(MODEL_PATH_JSON)}")
+        logger.error(f"1. {os.path.basename(default_onnx)}")
+        logger.error(f"2. {os.path.basename(default_json)}")
         logger.error("下载地址: https://huggingface.co/rhasspy/piper-voices/tree/main/zh_CN/huayan/x_low")
         logger.error("="*50)
         return
 
     try:
-        logger.info(f"正在从本地路径加载 Piper 语音模型: {MODEL_PATH_ONNX}...")
-        piper_voice = PiperVoice.load(MODEL_PATH_ONNX, config_path=MODEL_PATH_JSON)
-        # 预热模型和缓存
-        piper_voice.synthesize("模型加载成功")
+        logger.info(f"正在从本地路径加载 Piper 语音模型: {default_onnx}...")
+        loaded = voice_manager.get()
+        # 预热每个会话副本
+        for replica in loaded.replicas:
+            _synthesize_audio(replica, "模型加载成功")
+        piper_ready = True
         # 预热一些常见的短语
         common_phrases = ["你好", "您好", "是的", "不是", "谢谢", "不客气", "再见"]
         for phrase in common_phrases:
-            cached_synthesize(phrase)
-        logger.info("Piper 语音模型加载并预热成功。")
+            try:
+                cached_synthesize(phrase)
+            except Exception as e:
+                logger.warning(f"预热短语 {phrase} 失败: {e}")
+        logger.info("Piper 语音模型加载并预热成功。可用语音: %s", voice_manager.available_voices())
     except json.JSONDecodeError:
-        logger.error(f"加载 Piper 模型失败：配置文件 '{MODEL_PATH_JSON}' 已损坏或为空。", exc_info=True)
-        piper_voice = None
+        logger.error(f"加载 Piper 模型失败：配置文件 '{default_json}' 已损坏或为空。", exc_info=True)
+        piper_ready = False
     except Exception as e:
         logger.error(f"加载 Piper 模型时发生未知错误: {e}", exc_info=True)
-        piper_voice = None
+        piper_ready = False
 
 # 在模块加载时执行初始化
 initialize_piper()
 
-def text_to_speech(text: str, output_path: str = OUTPUT_PATH):
+_swap_lock = threading.Lock()
+
+def swap_voice(name: str) -> dict:
+    """
+    热切换默认 Piper 语音：新语音加载并预热完成后才换入，期间旧语音照常服务，
+    已经开始的合成继续使用旧模型。返回各阶段耗时
+    """
+    global piper_ready
+    if not PIPER_AVAILABLE:
+        raise RuntimeError("Piper-tts 库未安装，无法切换语音")
+    with _swap_lock:
+        started = time.monotonic()
+        previous = voice_manager.default_voice
+        timings = {}
+
+        def warmup(loaded):
+            timings["load_seconds"] = round(time.monotonic() - started, 3)
+            for replica in loaded.replicas:
+                _synthesize_audio(replica, "模型加载成功")
+
+        _, replaced = voice_manager.swap(name, warmup=warmup)
+        warmed = time.monotonic()
+        # 默认语音的合成结果和被替换语音的音素缓存都已过期
+        cached_synthesize.cache_clear()
+        phoneme_cache.invalidate(name)
+        piper_ready = True
+        return {
+            "kind": "tts",
+            "previous": previous,
+            "current": name,
+            "load_seconds": timings["load_seconds"],
+            "warmup_seconds": round(warmed - started - timings["load_seconds"], 3),
+            "swap_seconds": round(time.monotonic() - started, 3),
+            "previous_in_flight": replaced.in_use if replaced else 0,
+        }
+
+# --- TTS 回退链 ---
+# 每个引擎一个熔断器，持续失败的引擎在冷却期内直接跳过，不再为每个请求付出一次失败的合成
+pyttsx3_worker = Pyttsx3Worker(rate=150)
+PYTTSX3_TIMEOUT = float(os.getenv("PYTTSX3_TIMEOUT_SECONDS", "30"))
+breakers = {
+    "piper": CircuitBreaker.from_env("piper"),
+    "pyttsx3": CircuitBreaker.from_env("pyttsx3"),
+}
+last_engine = None
+# 当前线程最近一次 text_to_speech 实际使用的引擎（last_engine 是全局的，会被其他线程覆盖）
+_thread_state = threading.local()
+
+def engine_used():
+    """
+    返回当前线程最近一次 text_to_speech 成功时使用的引擎名称，没有时返回 None
+    """
+    return getattr(_thread_state, "engine", None)
+
+def _check_output(output_path: str, engine_name: str):
+    """
+    检查输出文件是否有效，无效时抛出异常交给熔断器记录
+    """
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 44: # WAV header is 44 bytes
+        logger.info(f"{engine_name} 合成成功 -> {output_path} (大小: {os.path.getsize(output_path)} 字节)")
+        return output_path
+    raise RuntimeError(f"{engine_name} 合成失败：文件未生成或大小为 0。")
+
+def _piper_engine(text: str, output_path: str, voice=None, speaker=None, length_scale=None,
+                  cancel_token=None):
+    """
+    Piper (首选)
+    """
+    logger.info(f"尝试使用 Piper 合成语音... (语音: {voice or voice_manager.default_voice})")
+
+    # 经过文本前端后逐句合成，音素化结果按句缓存；常用短语直接取缓存的合成结果
+    if speaker is None and length_scale is None and len(text) <= CACHED_PHRASE_MAX_CHARS:
+        audio_data, sample_rate = cached_synthesize(text, voice)
+    else:
+        audio_data, sample_rate = _synthesize_text(text, voice, speaker, length_scale, cancel_token)
+    logger.info(f"模型采样率: {sample_rate} Hz")
+
+    # 写入WAV文件 - 确保音频数据格式正确
+    logger.info(f"音频数据形状: {audio_data.shape if isinstance(audio_data, np.ndarray) else 'unknown'}")
+    logger.info(f"音频数据类型: {type(audio_data)}")
+
+    # 确保音频数据是正确的格式
+    if isinstance(audio_data, np.ndarray):
+        # 确保是单声道1D数组
+        if len(audio_data.shape) > 1:
+            audio_data = audio_data.flatten()
+        logger.info(f"处理后的音频数据形状: {audio_data.shape}")
+        logger.info(f"音频数据范围: [{audio_data.min():.2f}, {audio_data.max():.2f}]")
+    else:
+        logger.error(f"音频数据不是numpy数组: {type(audio_data)}")
+        raise TypeError("音频数据格式错误")
+
+    # 写入WAV文件
+    sf.write(output_path, audio_data, sample_rate, format='WAV', subtype='PCM_16')
+    return _check_output(output_path, "Piper")
+
+def _pyttsx3_engine(text: str, output_path: str, **_):
+    """
+    pyttsx3 (备选)：持久引擎实例运行在专用工作线程中
+    """
+    logger.info("Piper 不可用或失败，回退到 pyttsx3...")
+    pyttsx3_worker.synthesize(normalize_text(text) or text, output_path, timeout=PYTTSX3_TIMEOUT)
+    return _check_output(output_path, "pyttsx3")
+
+def _beep_engine(text: str, output_path: str, **_):
+    """
+    生成默认提示音 (最终保障)
+    """
+    logger.warning("所有 TTS 引擎都失败，生成默认提示音...")
+    sample_rate = 22050; duration = 0.5; frequency = 440
+    t = np.linspace(0., duration, int(sample_rate * duration), endpoint=False)
+    amplitude = np.iinfo(np.int16).max * 0.5
+    data = amplitude * np.sin(2. * np.pi * frequency * t)
+    sf.write(output_path, data.astype(np.int16), sample_rate, format='WAV', subtype='PCM_16')
+    logger.info(f"默认提示音生成成功 -> {output_path}")
+    return output_path
+
+# 回退顺序：(名称, 是否可用, 合成函数)
+TTS_ENGINES = [
+    ("piper", lambda: piper_ready, _piper_engine),
+    ("pyttsx3", lambda: PYTTSX3_AVAILABLE, _pyttsx3_engine),
+    ("beep", lambda: True, _beep_engine),
+]
+
+def tts_health():
+    """
+    报告各 TTS 引擎的可用性和熔断状态，以及当前会被使用的引擎
+    """
+    engines = []
+    active_engine = None
+    for name, available, _ in TTS_ENGINES:
+        breaker = breakers.get(name)
+        status = breaker.status() if breaker else {"state": CircuitBreaker.CLOSED}
+        status.update({"name": name, "available": available()})
+        engines.append(status)
+        if active_engine is None and status["available"] and status["state"] != CircuitBreaker.OPEN:
+            active_engine = name
+    return {
+        "active_engine": active_engine,
+        "last_engine": last_engine,
+        "engines": engines,
+    }
+
+def text_to_speech(text: str, output_path: str = OUTPUT_PATH, voice: str = None,
+                   speaker=None, length_scale: float = None, cancel_token=None):
     """
     将文本转换为 WAV 文件。
-    每次都重新生成新的音频文件，不使用缓存。
-    优先使用全局加载的 Piper 引擎，失败则回退到 pyttsx3 或默认提示音。
+    每次都重新生成新的音频文件；文本先经过前端规范化，音素化结果按句缓存。
+    按 Piper -> pyttsx3 -> 默认提示音 的顺序回退，处于熔断状态的引擎会被直接跳过。
+    任务被取消时抛出 JobCancelled，不再回退。
     """
+    global last_engine
+    _thread_state.engine = None
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
     if not text or not text.strip():
@@ -154,93 +427,78 @@ def text_to_speech(text: str, output_path: str = OUTPUT_PATH):
         except Exception as e:
             logger.warning("无法删除旧音频文件 %s: %s", output_path, e)
 
-    # ---- 1. Piper (首选) ----
-    if piper_voice:
+    for name, available, engine in TTS_ENGINES:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if not available():
+            continue
+        breaker = breakers.get(name)
+        if breaker and not breaker.allow():
+            logger.info(f"{name} 处于熔断状态，跳过")
+            continue
         try:
-            sample_rate = piper_voice.config.sample_rate
-            logger.info(f"尝试使用 Piper 合成语音... (模型采样率: {sample_rate} Hz)")
-
-            # 直接合成，跳过缓存
-            audio_chunks = list(piper_voice.synthesize(text))
-
-            # 统一处理各种可能的返回类型
-            if audio_chunks and hasattr(audio_chunks[0], 'audio_int16_bytes'):
-                audio_data = np.concatenate([chunk.audio_int16_array for chunk in audio_chunks])
-            elif audio_chunks and hasattr(audio_chunks[0], 'audio'):
-                audio_data = np.concatenate([chunk.audio for chunk in audio_chunks])
-            elif audio_chunks and isinstance(audio_chunks[0], np.ndarray):
-                audio_data = np.concatenate(audio_chunks)
-            else:
-                if audio_chunks and hasattr(audio_chunks[0], 'audio'):
-                    audio_data = np.concatenate([chunk.audio for chunk in audio_chunks])
-                elif len(audio_chunks) == 1:
-                    chunk = audio_chunks[0]
-                    if hasattr(chunk, 'audio'):
-                        audio_data = chunk.audio
-                    elif hasattr(chunk, 'audio_int16_array'):
-                        audio_data = chunk.audio_int16_array
-                    elif isinstance(chunk, np.ndarray):
-                        audio_data = chunk
-                    else:
-                        audio_data = np.array(chunk)
-                else:
-                    raise TypeError("无法处理返回的音频数据类型")
-            
-            # 写入WAV文件 - 确保音频数据格式正确
-            logger.info(f"音频数据形状: {audio_data.shape if isinstance(audio_data, np.ndarray) else 'unknown'}")
-            logger.info(f"音频数据类型: {type(audio_data)}")
-            
-            # 确保音频数据是正确的格式
-            if isinstance(audio_data, np.ndarray):
-                # 确保是单声道1D数组
-                if len(audio_data.shape) > 1:
-                    audio_data = audio_data.flatten()
-                logger.info(f"处理后的音频数据形状: {audio_data.shape}")
-                logger.info(f"音频数据范围: [{audio_data.min():.2f}, {audio_data.max():.2f}]")
-            else:
-                logger.error(f"音频数据不是numpy数组: {type(audio_data)}")
-                raise TypeError("音频数据格式错误")
-            
-            # 写入WAV文件
-            sf.write(output_path, audio_data, sample_rate, format='WAV', subtype='PCM_16')
-
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 44: # WAV header is 44 bytes
-                logger.info(f"Piper 合成成功 -> {output_path} (大小: {os.path.getsize(output_path)} 字节)")
-                return output_path
-            else:
-                logger.error("Piper 合成失败：文件未生成或大小为 0。")
+            path = engine(text, output_path, voice=voice, speaker=speaker, length_scale=length_scale,
+                          cancel_token=cancel_token)
+        except (VoiceNotFound, InvalidVoiceOption, JobCancelled):
+            # 请求参数错误或任务已取消，不回退到其他引擎，也不计入熔断
+            if breaker:
+                breaker.release()
+            raise
         except Exception as e:
-            logger.error(f"Piper 合成过程中发生错误: {e}", exc_info=True)
+            logger.error(f"{name} 合成过程中发生错误: {e}", exc_info=True)
+            if breaker:
+                breaker.record_failure(e)
+            continue
+        if breaker:
+            breaker.record_success()
+        last_engine = name
+        _thread_state.engine = name
+        return path
+
+    raise RuntimeError("无法使用任何 TTS 引擎，也无法生成默认音频。")
 
-    # ---- 2. pyttsx3 (备选) ----
-    if PYTTSX3_AVAILABLE:
+def synthesize_stream(text: str, voice: str = None, speaker=None, length_scale: float = None,
+                      cancel_token=None):
+    """
+    逐句产出合成音频 (int16 数组, 采样率)，用于 WebSocket 边合成边发送。
+    Piper 可用时按句流式产出；Piper 不可用、处于熔断或在第一句之前失败时，
+    回退到 text_to_speech 整段合成后一次性产出
+    """
+    global last_engine
+    if not text or not text.strip():
+        text = "你好"
+
+    breaker = breakers["piper"]
+    if piper_ready and breaker.allow():
+        produced = False
         try:
-            logger.info("Piper 不可用或失败，回退到 pyttsx3...")
-            engine = pyttsx3.init()
-            engine.setProperty('rate', 150)
-            engine.save_to_file(text, output_path)
-            engine.runAndWait()
-            engine.stop()
-
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 44:
-                logger.info(f"pyttsx3 合成成功 -> {output_path}")
-                return output_path
-            else:
-                logger.error("pyttsx3 合成失败：文件未生成或大小为 0。")
+            for audio, sample_rate in _iter_sentence_audio(text, voice, speaker, length_scale, cancel_token):
+                produced = True
+                yield audio, sample_rate
+            if not produced:
+                raise RuntimeError("文本规范化后没有可合成的内容")
+        except (VoiceNotFound, InvalidVoiceOption, JobCancelled, GeneratorExit):
+            breaker.release()
+            raise
         except Exception as e:
-            logger.error(f"pyttsx3 合成过程中发生错误: {e}", exc_info=True)
+            logger.error(f"Piper 流式合成过程中发生错误: {e}", exc_info=True)
+            breaker.record_failure(e)
+            if produced:
+                # 已经发出部分音频，不能再整段重新合成
+                raise
+        else:
+            breaker.record_success()
+            last_engine = "piper"
+            return
 
-    # ---- 3. 生成默认音频 (最终保障) ----
+    output_path = os.path.join(os.path.dirname(OUTPUT_PATH), f"stream_{uuid.uuid4().hex}.wav")
     try:
-        logger.warning("所有 TTS 引擎都失败，生成默认提示音...")
-        sample_rate = 22050; duration = 0.5; frequency = 440
-        t = np.linspace(0., duration, int(sample_rate * duration), endpoint=False)
-        amplitude = np.iinfo(np.int16).max * 0.5
-        data = amplitude * np.sin(2. * np.pi * frequency * t)
-        sf.write(output_path, data.astype(np.int16), sample_rate, format='WAV', subtype='PCM_16')
-        logger.info(f"默认提示音生成成功 -> {output_path}")
-        return output_path
-    except Exception as e:
-        logger.error(f"生成默认提示音失败: {e}", exc_info=True)
-
-    raise RuntimeError("无法使用任何 TTS 引擎，也无法生成默认音频。")
\ No newline at end of file
+        text_to_speech(text, output_path, voice=voice, speaker=speaker, length_scale=length_scale,
+                       cancel_token=cancel_token)
+        audio, sample_rate = sf.read(output_path, dtype='int16')
+        if audio.ndim > 1:
+            audio = audio[:, 0]
+        yield audio, sample_rate
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
@@ -0,0 +1,146 @@
+"""
+TTS 回退链支持
+- CircuitBreaker：连续失败后暂时跳过某个引擎，超时后放行一次试探请求
+- Pyttsx3Worker：在专用线程中持有一个持久的 pyttsx3 引擎实例，其他线程通过队列提交合成任务
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger("tts_fallback")
+
+
+class CircuitBreaker:
+    """
+    熔断器：closed（正常）-> open（熔断，直接跳过）-> half_open（放行一次试探）
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        判断是否允许调用该引擎
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                logger.info("熔断器 %s 进入半开状态，放行一次试探请求", self.name)
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("熔断器 %s 已恢复", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """
+        调用因与引擎无关的原因（如请求参数错误）结束时，释放试探名额而不改变状态
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("熔断器 %s 打开（连续失败 %d 次），%.0f 秒内跳过该引擎",
+                                   self.name, self.failures, self.reset_timeout)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
+
+    @classmethod
+    def from_env(cls, name):
+        return cls(
+            name,
+            failure_threshold=int(os.getenv("TTS_BREAKER_FAILURES", "3")),
+            reset_timeout=float(os.getenv("TTS_BREAKER_RESET_SECONDS", "30")),
+        )
+
+
+class Pyttsx3Worker:
+    """
+    pyttsx3 不是线程安全的，且每次 init() 开销很大。
+    这里在一个专用线程里只初始化一次引擎，所有合成请求排队交给该线程执行。
+    """
+
+    def __init__(self, rate=150):
+        self.rate = rate
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="pyttsx3-worker", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        import pyttsx3
+        engine = None
+        while True:
+            text, output_path, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if engine is None:
+                    engine = pyttsx3.init()
+                    engine.setProperty('rate', self.rate)
+                    logger.info("pyttsx3 引擎已在工作线程中初始化")
+                engine.save_to_file(text, output_path)
+                engine.runAndWait()
+                future.set_result(output_path)
+            except Exception as e:
+                # 引擎状态可能已损坏，下次重新初始化
+                engine = None
+                future.set_exception(e)
+
+    def synthesize(self, text, output_path, timeout=30.0):
+        """
+        提交合成任务并等待结果，超时则放弃等待
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, output_path, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 还在排队的任务直接取消，避免超时后仍占用工作线程
+            future.cancel()
+            raise
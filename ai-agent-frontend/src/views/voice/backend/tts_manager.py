@@ -0,0 +1,297 @@
+"""
+Piper 语音模型管理器
+支持多个语音模型按需加载、onnxruntime 会话调优、每个语音多个会话副本并行合成，
+并在超出内存上限时按 LRU 淘汰最久未使用的语音
+"""
+import os
+import json
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    from piper import PiperVoice
+    PIPER_AVAILABLE = True
+except ImportError:
+    PIPER_AVAILABLE = False
+
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+from model_cache import load_ort_session
+
+logger = logging.getLogger("tts_manager")
+
+# onnxruntime 图优化级别名称到枚举名的映射
+GRAPH_OPT_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class VoiceNotFound(Exception):
+    """请求的语音模型不存在"""
+
+
+class InvalidVoiceOption(Exception):
+    """请求的说话人或合成参数无效"""
+
+
+class _LoadedVoice:
+    """
+    一个已加载的语音：同一模型的多个会话副本，通过队列轮流借用
+    """
+
+    def __init__(self, name, replicas, size_bytes):
+        self.name = name
+        self.replicas = replicas
+        self.size_bytes = size_bytes
+        self.config = replicas[0].config
+        self.idle = queue.Queue()
+        for replica in replicas:
+            self.idle.put(replica)
+        self.in_use = 0
+
+
+class PiperVoiceManager:
+    """
+    管理多个 Piper 语音模型。
+    - 语音在首次使用时才加载（懒加载）
+    - 每个语音可以保留 N 个 onnxruntime 会话副本，供多个线程并行合成
+    - 已加载模型总大小超过 max_memory_mb 时，按 LRU 淘汰空闲语音
+    """
+
+    def __init__(self, models_dir, default_voice, replicas=1, intra_op_threads=0,
+                 inter_op_threads=0, graph_opt_level="all", max_memory_mb=0):
+        self.models_dir = models_dir
+        self.default_voice = default_voice
+        self.replicas = max(1, replicas)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_opt_level = graph_opt_level
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self._voices = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # 热切换后被替换下来的默认语音，正在进行的合成结束后卸载
+        self._retiring = set()
+
+    @classmethod
+    def from_env(cls, models_dir, default_voice):
+        """
+        从环境变量读取配置创建管理器
+        """
+        return cls(
+            models_dir,
+            os.getenv("PIPER_DEFAULT_VOICE", default_voice),
+            replicas=int(os.getenv("PIPER_SESSION_REPLICAS", "1")),
+            intra_op_threads=int(os.getenv("PIPER_INTRA_OP_THREADS", "0")),
+            inter_op_threads=int(os.getenv("PIPER_INTER_OP_THREADS", "0")),
+            graph_opt_level=os.getenv("PIPER_GRAPH_OPT_LEVEL", "all"),
+            max_memory_mb=int(os.getenv("PIPER_MAX_MODEL_MB", "0")),
+        )
+
+    def model_paths(self, name):
+        """
+        返回语音模型的 onnx 和 json 配置文件路径
+        """
+        model_path = os.path.join(self.models_dir, name + ".onnx")
+        return model_path, model_path + ".json"
+
+    def available_voices(self):
+        """
+        列出模型目录中存在完整文件（onnx + json）的语音
+        """
+        if not os.path.isdir(self.models_dir):
+            return []
+        names = []
+        for filename in sorted(os.listdir(self.models_dir)):
+            if filename.endswith(".onnx"):
+                name = filename[:-len(".onnx")]
+                if all(os.path.exists(p) for p in self.model_paths(name)):
+                    names.append(name)
+        return names
+
+    def loaded_voices(self):
+        """
+        返回已加载语音的状态信息（按最近使用顺序）
+        """
+        with self._lock:
+            return [
+                {
+                    "name": voice.name,
+                    "replicas": len(voice.replicas),
+                    "in_use": voice.in_use,
+                    "size_mb": round(voice.size_bytes / 1024 / 1024, 1),
+                    "sample_rate": voice.config.sample_rate,
+                    "num_speakers": getattr(voice.config, "num_speakers", 1),
+                }
+                for voice in self._voices.values()
+            ]
+
+    def _session_options(self):
+        """
+        根据配置生成 onnxruntime 会话选项
+        """
+        options = onnxruntime.SessionOptions()
+        if self.intra_op_threads > 0:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads > 0:
+            options.inter_op_num_threads = self.inter_op_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        level_name = GRAPH_OPT_LEVELS.get(self.graph_opt_level.lower(), "ORT_ENABLE_ALL")
+        options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, level_name)
+        return options
+
+    def _load_replica(self, model_path, config_path):
+        """
+        加载一个会话副本，使用自定义的 onnxruntime 会话选项
+        """
+        if not ONNXRUNTIME_AVAILABLE:
+            return PiperVoice.load(model_path, config_path=config_path)
+
+        from piper.config import PiperConfig
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = PiperConfig.from_dict(json.load(f))
+        # 优先使用预先优化好的 ORT 格式缓存，见 model_cache
+        session = load_ort_session(model_path, self._session_options, self.graph_opt_level.lower())
+        return PiperVoice(session=session, config=config)
+
+    def _load(self, name):
+        """
+        加载语音的全部会话副本
+        """
+        model_path, config_path = self.model_paths(name)
+        if os.path.basename(name) != name or not os.path.exists(model_path) or not os.path.exists(config_path):
+            raise VoiceNotFound(f"语音模型不存在: {name}")
+
+        logger.info("正在加载 Piper 语音 %s（%d 个会话副本，intra=%d，inter=%d，优化级别=%s）",
+                    name, self.replicas, self.intra_op_threads, self.inter_op_threads, self.graph_opt_level)
+        replicas = [self._load_replica(model_path, config_path) for _ in range(self.replicas)]
+        size_bytes = os.path.getsize(model_path) * len(replicas)
+        return _LoadedVoice(name, replicas, size_bytes)
+
+    def _evict_if_needed(self, incoming_bytes):
+        """
+        为即将加载的语音腾出内存，淘汰最久未使用且空闲的语音（调用方持有 self._lock）
+        """
+        if self.max_memory_bytes <= 0:
+            return
+        total = sum(v.size_bytes for v in self._voices.values()) + incoming_bytes
+        for name in list(self._voices.keys()):
+            if total <= self.max_memory_bytes:
+                break
+            voice = self._voices[name]
+            if voice.in_use > 0:
+                continue
+            del self._voices[name]
+            total -= voice.size_bytes
+            logger.info("内存超出上限，已淘汰语音: %s", name)
+
+    def get(self, name=None):
+        """
+        获取（必要时加载）语音，并标记为最近使用
+        """
+        return self._get(name, pin=False)
+
+    def _get(self, name, pin):
+        """
+        pin=True 时在同一次加锁内把 in_use 加一，返回之前不会被淘汰
+        """
+        name = name or self.default_voice
+        with self._lock:
+            voice = self._lookup(name, pin)
+            if voice is not None:
+                return voice
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # 同一语音只加载一次，不同语音可以并行加载
+        with load_lock:
+            with self._lock:
+                voice = self._lookup(name, pin)
+                if voice is not None:
+                    return voice
+            loaded = self._load(name)
+            with self._lock:
+                self._evict_if_needed(loaded.size_bytes)
+                self._voices[name] = loaded
+                if pin:
+                    loaded.in_use += 1
+            logger.info("Piper 语音加载完成: %s", name)
+            return loaded
+
+    def _lookup(self, name, pin):
+        # 调用方持有 self._lock
+        voice = self._voices.get(name)
+        if voice is not None:
+            self._voices.move_to_end(name)
+            if pin:
+                voice.in_use += 1
+                # 热切换后仍有新请求显式指定这个语音，不再卸载，交给 LRU 管理
+                self._retiring.discard(name)
+        return voice
+
+    def _release_if_retired(self, voice):
+        # 调用方持有 self._lock
+        if voice.in_use == 0 and voice.name in self._retiring and self._voices.get(voice.name) is voice:
+            del self._voices[voice.name]
+            self._retiring.discard(voice.name)
+            logger.info("被替换的语音已空闲，已卸载: %s", voice.name)
+
+    @contextmanager
+    def acquire(self, name=None):
+        """
+        借用一个空闲的会话副本进行合成，用完后归还
+        """
+        voice = self._get(name, pin=True)
+        replica = voice.idle.get()
+        try:
+            yield replica
+        finally:
+            voice.idle.put(replica)
+            with self._lock:
+                voice.in_use -= 1
+                self._release_if_retired(voice)
+
+    def swap(self, name, warmup=None, make_default=True):
+        """
+        热替换语音：在锁外加载新的会话副本并调用 warmup(loaded) 预热，然后原子地换入。
+        已经借出旧副本的合成继续使用旧模型，归还后随旧对象一起释放。
+        make_default=True 时原来的默认语音在正在进行的合成结束后卸载。
+        返回 (新语音, 被替换的旧语音或 None)
+        """
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            loaded = self._load(name)
+            if warmup is not None:
+                warmup(loaded)
+            with self._lock:
+                previous = self._voices.pop(name, None)
+                self._evict_if_needed(loaded.size_bytes)
+                self._voices[name] = loaded
+                self._retiring.discard(name)
+                if make_default and self.default_voice != name:
+                    old_default = self._voices.get(self.default_voice)
+                    self._retiring.add(self.default_voice)
+                    if old_default is not None:
+                        self._release_if_retired(old_default)
+                if make_default:
+                    self.default_voice = name
+        logger.info("Piper 语音已热替换: %s", name)
+        return loaded, previous
+
+    def unload(self, name):
+        """
+        卸载语音（正在使用的副本会在归还后随对象一起释放）
+        """
+        with self._lock:
+            self._retiring.discard(name)
+            return self._voices.pop(name, None) is not None
@@ -0,0 +1,370 @@
+"""
+全双工 WebSocket 语音通道
+一个连接对应一个会话：客户端持续发送二进制音频帧，服务端增量解码并定期给出中间识别结果；
+一句话结束后在同一连接上依次返回识别文本、回复文本和逐句合成的音频帧。
+
+客户端 -> 服务端
+- 二进制消息：音频数据（默认 audio/webm，可在 start 中指定 mimetype，如 "audio/L16;rate=16000"）
+- {"type": "start", "mimetype": ..., "decode": {...}, "voice": ..., "speaker": ..., "length_scale": ...}
+  开始新的一句话；上一轮未完成的回复会被打断。不发送 start 直接发音频时使用上次的设置。
+  每句话的压缩音频都要从容器头开始（例如每句重新启动一次 MediaRecorder）
+- {"type": "end"}     一句话结束，开始识别 -> LLM -> TTS
+- {"type": "cancel"}  取消当前的语音输入和进行中的回复
+- {"type": "text", "text": ...}  直接以文字提问
+
+服务端 -> 客户端
+- {"type": "ready", "session": ...}
+- {"type": "partial", "text": ...}            中间识别结果
+- {"type": "transcript", "text": ..., ...}    最终识别结果
+- {"type": "reply", "text": ..., "speculative": bool, "degradation_level": ...}
+  过载降级到 text_only 时没有后续音频
+- {"type": "audio_start", "format": "pcm_s16le", "sample_rate": ..., "channels": 1}
+  之后是若干二进制音频帧，最后 {"type": "audio_end"}
+- {"type": "cancelled", "reason": ...} / {"type": "error", "error": ...}
+  超出限流时 error 中带有 "retry_after"（秒），中间识别在限流期间直接跳过
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+import numpy as np
+
+from audio_utils import IncrementalDecoder, AudioUploadTooLarge, l16_params
+from cancellation import JobCancelled
+from scheduler import INTERACTIVE
+from text_frontend import first_sentences
+
+logger = logging.getLogger("voice_channel")
+
+# 每新增这么多秒的已解码音频就做一次中间识别
+WS_PARTIAL_INTERVAL = float(os.getenv("WS_PARTIAL_INTERVAL_SECONDS", "1.5"))
+# 连接在这么长时间内没有任何消息就关闭
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "300"))
+# 每个二进制音频帧包含的采样点数
+WS_AUDIO_FRAME_SAMPLES = int(os.getenv("WS_AUDIO_FRAME_SAMPLES", "4096"))
+
+
+def pcm_to_float(pcm: bytes):
+    """
+    s16le PCM 转为 whisper 使用的 float32 数组
+    """
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+class VoiceChannel:
+    """
+    单个 WebSocket 连接的状态机。
+    识别、LLM 和 TTS 都提交到共享的调度器执行，接收循环只负责解码和分发消息，
+    因此用户可以在服务端播放回复的同时继续说话（打断）
+    """
+
+    def __init__(self, ws, session_id, scheduler, cancellations, speculator, transcribe, parse_decode_options,
+                 call_llm, synthesize_stream, take_result, cancel_result, speculate=False, record=None,
+                 overload=None, client_id=None, rate_limit=None, partial_cost=1.0):
+        self.ws = ws
+        self.session_id = session_id or str(uuid.uuid4())
+        self.scheduler = scheduler
+        # client_id 与 HTTP 接口一样用于调度器的公平排队；
+        # rate_limit(tokens) 返回 (是否允许, 需要等待的秒数)，中间识别按 partial_cost 计费，一轮对话按 1 计费
+        self.client_id = client_id or self.session_id
+        self.rate_limit = rate_limit
+        self.partial_cost = partial_cost
+        self.cancellations = cancellations
+        self.speculator = speculator
+        self.transcribe = transcribe
+        self.parse_decode_options = parse_decode_options
+        self.call_llm = call_llm
+        self.synthesize_stream = synthesize_stream
+        # take_result(result_id) 取出已结束任务的结果（未结束返回 None），cancel_result(result_id) 取消任务
+        self.take_result = take_result
+        self.cancel_result = cancel_result
+        self.speculate = speculate
+        # record(session_id, kind, text, job_id=..., **meta) 写入对话记录，可选
+        self.record = record
+        # 过载控制器（可选），每轮对话开始时读取一次降级参数
+        self.overload = overload
+
+        self.mimetype = "audio/webm"
+        self.mimetype_params = {}
+        self.decode_options = parse_decode_options({})
+        self.tts_options = {}
+        self.decoder = None
+        self._partial_busy = False
+        self._partial_seconds = 0.0
+        self._send_lock = threading.Lock()
+        self._closed = False
+
+    # --- 发送 ---
+
+    def send_json(self, message: dict):
+        self._send(json.dumps(message, ensure_ascii=False))
+
+    def _send(self, data):
+        if self._closed:
+            return
+        with self._send_lock:
+            try:
+                self.ws.send(data)
+            except Exception as e:
+                logger.info("会话 %s 发送失败，连接可能已关闭: %s", self.session_id, e)
+                self._closed = True
+
+    # --- 接收循环 ---
+
+    def run(self):
+        self.send_json({"type": "ready", "session": self.session_id})
+        try:
+            while not self._closed:
+                message = self.ws.receive(timeout=WS_IDLE_TIMEOUT)
+                if message is None:
+                    logger.info("会话 %s 空闲超时，关闭连接", self.session_id)
+                    break
+                if isinstance(message, (bytes, bytearray)):
+                    self._on_audio(bytes(message))
+                else:
+                    self._on_control(message)
+        except Exception as e:
+            # 客户端断开时 receive 抛出 ConnectionClosed
+            logger.info("会话 %s 连接结束: %s", self.session_id, e)
+        finally:
+            self._closed = True
+            self._drop_decoder()
+            self.cancellations.cancel_session(self.session_id, reason="disconnected")
+
+    def _on_control(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            self.send_json({"type": "error", "error": "控制消息必须是 JSON"})
+            return
+        kind = message.get("type")
+        if kind == "start":
+            try:
+                self._configure(message)
+            except ValueError as e:
+                self.send_json({"type": "error", "error": f"参数无效: {e}"})
+                return
+            self._begin_utterance()
+        elif kind == "end":
+            self._end_utterance()
+        elif kind == "cancel":
+            self._drop_decoder()
+            cancelled = self.cancellations.cancel_session(self.session_id, reason="user")
+            self.send_json({"type": "cancelled", "reason": "user", "jobs": cancelled})
+        elif kind == "text":
+            text = (message.get("text") or "").strip()
+            if not text:
+                self.send_json({"type": "error", "error": "未提供文本"})
+                return
+            self._interrupt()
+            self._submit_turn(text=text)
+        else:
+            self.send_json({"type": "error", "error": f"未知的消息类型: {kind}"})
+
+    def _configure(self, message: dict):
+        mimetype = message.get("mimetype")
+        if mimetype:
+            base, _, rest = mimetype.partition(";")
+            params = dict(
+                (k.strip(), v.strip()) for k, _, v in (p.partition("=") for p in rest.split(";")) if k.strip()
+            )
+            if base.strip().lower() == "audio/l16":
+                # 无效的采样率或声道数抛出 InvalidAudioFormat（ValueError），由调用方返回错误
+                l16_params(params)
+            self.mimetype = base.strip().lower()
+            self.mimetype_params = params
+        if "decode" in message:
+            self.decode_options = self.parse_decode_options(
+                {k: str(v) for k, v in (message["decode"] or {}).items()}
+            )
+        for key in ("voice", "speaker", "length_scale"):
+            if key in message:
+                self.tts_options[key] = message[key]
+        if self.tts_options.get("length_scale") is not None:
+            self.tts_options["length_scale"] = float(self.tts_options["length_scale"])
+        if "speculate" in message:
+            self.speculate = bool(message["speculate"])
+
+    # --- 语音输入 ---
+
+    def _interrupt(self):
+        """
+        打断该会话上一轮尚未完成的回复，丢弃未结束的语音输入
+        """
+        cancelled = self.cancellations.cancel_session(self.session_id, reason="superseded")
+        if cancelled:
+            self.send_json({"type": "cancelled", "reason": "superseded", "jobs": cancelled})
+        self._drop_decoder()
+
+    def _begin_utterance(self):
+        """
+        开始新的一句话并重新开始解码
+        """
+        self._interrupt()
+        self.decoder = IncrementalDecoder(self.mimetype, self.mimetype_params)
+        self._partial_seconds = 0.0
+
+    def _drop_decoder(self):
+        if self.decoder is not None:
+            self.decoder.abort()
+            self.decoder = None
+
+    def _on_audio(self, data: bytes):
+        if self.decoder is None:
+            self._begin_utterance()
+        try:
+            self.decoder.feed(data)
+        except AudioUploadTooLarge as e:
+            self.decoder = None
+            self.send_json({"type": "error", "error": str(e)})
+            return
+        except Exception as e:
+            logger.error("会话 %s 音频解码失败: %s", self.session_id, e)
+            self._drop_decoder()
+            self.send_json({"type": "error", "error": str(e)})
+            return
+
+        decoded = self.decoder.decoded_seconds()
+        if not self._partial_busy and decoded - self._partial_seconds >= WS_PARTIAL_INTERVAL:
+            self._partial_seconds = decoded
+            if not self._allow(self.partial_cost):
+                # 中间识别只是提示，限流时跳过，等下一个间隔再试
+                return
+            self._partial_busy = True
+            self._schedule(self._partial_job, self.decoder, self.decoder.pcm(), cost=decoded)
+
+    def _partial_job(self, decoder, pcm: bytes):
+        try:
+            options = dict(self.decode_options, long_audio="false")
+            model_name = self.overload.policy()["asr_model"] if self.overload else None
+            text = self.transcribe(pcm_to_float(pcm), options, model_name=model_name)["text"]
+            # 期间已经开始了新的一句话，结果作废
+            if decoder is self.decoder and text != "（未识别到内容）":
+                self.send_json({"type": "partial", "text": text})
+                if self.speculate:
+                    self.speculator.on_partial(self.session_id, text)
+        except Exception as e:
+            logger.warning("会话 %s 中间识别失败: %s", self.session_id, e)
+        finally:
+            self._partial_busy = False
+
+    def _end_utterance(self):
+        decoder, self.decoder = self.decoder, None
+        if decoder is None:
+            self.send_json({"type": "error", "error": "没有正在进行的语音输入"})
+            return
+        self._submit_turn(decoder=decoder)
+
+    # --- 一轮对话：识别 -> LLM -> TTS ---
+
+    def _allow(self, tokens):
+        if self.rate_limit is None:
+            return True
+        allowed, _ = self.rate_limit(tokens)
+        return allowed
+
+    def _schedule(self, func, *args, cost=1.0):
+        self.scheduler.schedule(func, *args, priority=INTERACTIVE, client_id=self.client_id, cost=cost)
+
+    def _submit_turn(self, decoder=None, text=None):
+        if self.rate_limit is not None:
+            allowed, retry_after = self.rate_limit(1.0)
+            if not allowed:
+                if decoder is not None:
+                    decoder.abort()
+                self.send_json({"type": "error", "error": "请求过于频繁，请稍后再试",
+                                "retry_after": round(retry_after, 1)})
+                return
+        job_id = str(uuid.uuid4())
+        token, _ = self.cancellations.register(job_id, self.session_id)
+        cost = decoder.decoded_seconds() if decoder is not None else 1.0
+        self._schedule(self._turn_job, job_id, token, decoder, text, cost=cost)
+
+    def _turn_job(self, job_id, token, decoder, text):
+        policy = self.overload.policy() if self.overload else {}
+        try:
+            if decoder is not None:
+                started = time.monotonic()
+                pcm = decoder.close()
+                token.raise_if_cancelled()
+                result = self.transcribe(pcm_to_float(pcm), self.decode_options, cancel_token=token,
+                                         model_name=policy.get("asr_model"))
+                text = result["text"]
+                if self.overload and result["duration"] > 0:
+                    self.overload.observe("asr", (time.monotonic() - started) / result["duration"])
+                self.send_json({
+                    "type": "transcript",
+                    "text": text,
+                    "language": result["language"],
+                    "duration": result["duration"],
+                    "elapsed": round(time.monotonic() - started, 3),
+                })
+                self._record("transcript", text, job_id, source="ws", duration=result["duration"],
+                             language=result["language"])
+                if text == "（未识别到内容）":
+                    return
+
+            started = time.monotonic()
+            reply, speculative = self._reply(text, token, policy.get("max_tokens"))
+            if self.overload and not speculative:
+                self.overload.observe("llm", time.monotonic() - started)
+            self.send_json({"type": "reply", "text": reply, "speculative": speculative,
+                            "degradation_level": policy.get("level", 0)})
+            self._record("prompt", text, job_id, source="ws")
+            self._record("reply", reply, job_id, source="ws", speculative=speculative)
+
+            if not policy.get("tts", True):
+                return
+            if policy.get("tts_sentences"):
+                reply = first_sentences(reply, policy["tts_sentences"])
+            sample_rate = None
+            for audio, rate in self.synthesize_stream(reply, cancel_token=token, **self.tts_options):
+                if sample_rate is None:
+                    sample_rate = rate
+                    self.send_json({"type": "audio_start", "format": "pcm_s16le",
+                                    "sample_rate": rate, "channels": 1})
+                audio = audio.astype("<i2", copy=False)
+                for start in range(0, len(audio), WS_AUDIO_FRAME_SAMPLES):
+                    token.raise_if_cancelled()
+                    self._send(audio[start:start + WS_AUDIO_FRAME_SAMPLES].tobytes())
+            self.send_json({"type": "audio_end"})
+        except JobCancelled:
+            logger.info("会话 %s 的回复已取消，任务: %s，原因: %s", self.session_id, job_id, token.reason)
+            if token.reason != "disconnected":
+                self.send_json({"type": "cancelled", "reason": token.reason, "job": job_id})
+        except Exception as e:
+            logger.error("会话 %s 处理失败: %s", self.session_id, e, exc_info=True)
+            self.send_json({"type": "error", "error": str(e)})
+        finally:
+            self.cancellations.finish(job_id)
+
+    def _record(self, kind, text, job_id, **meta):
+        if self.record is None:
+            return
+        try:
+            self.record(self.session_id, kind, text, job_id=job_id, **meta)
+        except Exception as e:
+            logger.warning("会话 %s 对话记录失败: %s", self.session_id, e)
+
+    def _reply(self, text, token, max_tokens=None):
+        """
+        获取 LLM 回复；推测命中且推测任务已经完成时直接使用其结果，返回 (回复文本, 是否推测命中)。
+        推测任务与本任务在同一个线程池中，等待它可能让所有工作线程互相等待，
+        所以未完成时取消推测，在本任务中直接调用 LLM
+        """
+        if self.speculate:
+            speculative_id = self.speculator.on_final(self.session_id, text)
+            if speculative_id:
+                result = self.take_result(speculative_id)
+                if result is None:
+                    self.cancel_result(speculative_id)
+                elif result.get("status") == "completed":
+                    return result["reply"], True
+        reply = self.call_llm(text, max_retries=3, cancel_token=token, max_tokens=max_tokens)
+        if not reply or not reply.strip():
+            raise RuntimeError("LLM未返回有效回复")
+        return reply, False
+
@@ -1,13 +1,348 @@
+import os
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 import whisper
+from whisper.audio import SAMPLE_RATE, CHUNK_LENGTH
+from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+
+from model_cache import load_whisper_model
+
+logger = logging.getLogger("whisper_engine")
+
+# whisper 解码时会在模型上安装 kv-cache 钩子，同一个模型实例不能被多个线程同时使用。
+# 每个模型维护一组副本，按需创建，最多 WHISPER_WORKERS 个
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+class _ModelPool:
+    """
+    一个 Whisper 模型及其副本。热切换后旧池不再分配给新任务，
+    已经拿到旧池的任务结束、不再引用它之后，旧模型随之释放
+    """
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.idle = queue.Queue()
+        self.idle.put(model)
+        self.count = 1
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def _new_replica(self):
+        """
+        创建模型副本：有 mmap 缓存时重新映射同一份权重（不占额外内存），否则重新加载检查点。
+        不能深拷贝 self.model：创建副本时它通常正在解码，深拷贝会连同其他线程的 kv-cache 钩子一起复制
+        """
+        return load_whisper_model(self.name, device="cpu")
+
+    @contextmanager
+    def borrow(self):
+        """
+        借用一个空闲的模型副本，全部在用且未达上限时创建一个新的
+        """
+        with self._lock:
+            self.in_use += 1
+            create = self.idle.empty() and self.count < WHISPER_WORKERS
+            if create:
+                self.count += 1
+        try:
+            replica = self._new_replica() if create else self.idle.get()
+        except BaseException:
+            with self._lock:
+                self.in_use -= 1
+                self.count -= 1
+            raise
+        try:
+            yield replica
+        finally:
+            self.idle.put(replica)
+            with self._lock:
+                self.in_use -= 1
 
 # 显式指定使用CPU和FP32精度，避免FP16警告
-model = whisper.load_model("base", device="cpu", in_memory=True)
+# 权重优先从 mmap 缓存加载（见 model_cache），多个进程共享同一份物理内存
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+_pool = _ModelPool(WHISPER_MODEL, load_whisper_model(WHISPER_MODEL, device="cpu"))
+_pool_lock = threading.Lock()
+_swap_lock = threading.Lock()
+
+def _current_pool():
+    with _pool_lock:
+        return _pool
+
+def current_model_name():
+    return _current_pool().name
+
+# 降级用的备用模型（如过载时改用 tiny），首次请求时在后台加载，加载完成前仍使用当前模型
+_aux_pools = {}
+_aux_loading = set()
+_aux_lock = threading.Lock()
+
+def _load_aux_pool(name):
+    try:
+        pool = _ModelPool(name, load_whisper_model(name, device="cpu"))
+        with _aux_lock:
+            _aux_pools[name] = pool
+        logger.info("备用 Whisper 模型已加载: %s", name)
+    except Exception as e:
+        logger.error("备用 Whisper 模型 %s 加载失败: %s", name, e)
+    finally:
+        with _aux_lock:
+            _aux_loading.discard(name)
+
+def _pool_for(model_name):
+    """
+    返回指定模型的模型池；未指定、就是当前模型或备用模型尚未加载好时返回当前模型池
+    """
+    pool = _current_pool()
+    if not model_name or model_name == pool.name:
+        return pool
+    with _aux_lock:
+        aux = _aux_pools.get(model_name)
+        if aux is None and model_name not in _aux_loading:
+            _aux_loading.add(model_name)
+            threading.Thread(target=_load_aux_pool, args=(model_name,), name="whisper-aux-load",
+                             daemon=True).start()
+    return aux or pool
+
+def swap_model(name: str) -> dict:
+    """
+    热切换 Whisper 模型：在调用线程中加载并预热新模型，然后原子地替换。
+    已经开始的识别任务继续使用旧模型，全部结束后释放旧模型。返回各阶段耗时
+    """
+    global _pool
+    if name not in whisper.available_models() and not os.path.isfile(name):
+        raise ValueError(f"未知的 Whisper 模型: {name}")
+    with _swap_lock:
+        started = time.monotonic()
+        new_model = load_whisper_model(name, device="cpu")
+        loaded = time.monotonic()
+        # 用一秒静音预热，首个真实请求不再承担初始化开销
+        new_model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), fp16=False, language="zh")
+        warmed = time.monotonic()
+        with _pool_lock:
+            old_pool, _pool = _pool, _ModelPool(name, new_model)
+        return {
+            "kind": "asr",
+            "previous": old_pool.name,
+            "current": name,
+            "load_seconds": round(loaded - started, 3),
+            "warmup_seconds": round(warmed - loaded, 3),
+            "swap_seconds": round(time.monotonic() - started, 3),
+            "previous_in_flight": old_pool.in_use,
+        }
+
+# 长音频模式：超过该时长的音频按静音切分后并行识别
+LONG_AUDIO_SECONDS = float(os.getenv("WHISPER_LONG_AUDIO_SECONDS", "120"))
+# 在每个 30 秒窗口边界之前的这段范围内寻找最安静的位置切分
+SILENCE_SEARCH_SECONDS = float(os.getenv("WHISPER_SILENCE_SEARCH_SECONDS", "5"))
+
+# 电网调度领域词汇提示，帮助模型识别专业术语
+DEFAULT_INITIAL_PROMPT = (
+    "以下是电网调度通话，涉及变电站、主变、母线、断路器、隔离开关、线路跳闸、重合闸、"
+    "有功、无功、负荷、电压、千伏、兆瓦、倒闸操作、检修、调度员。"
+)
 
-def speech_to_text(file_path: str) -> str:
-    # 显式指定fp16=False以避免FP16警告
-    result = model.transcribe(file_path, fp16=False)
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# 解码参数默认值，可通过环境变量配置，也可在每个请求中覆盖
+# - language: 固定语言可跳过每段音频的语言检测（少一次编码器推理），设为空字符串则自动检测
+# - beam_size: 0 表示贪心解码，大于 0 使用束搜索
+# - temperature_max: 温度回退的上限，0 表示关闭回退
+DEFAULT_DECODE_OPTIONS = {
+    "language": os.getenv("WHISPER_LANGUAGE", "zh") or None,
+    "beam_size": int(os.getenv("WHISPER_BEAM_SIZE", "0")),
+    "temperature_max": float(os.getenv("WHISPER_TEMPERATURE_MAX", "1.0")),
+    "without_timestamps": _env_bool("WHISPER_WITHOUT_TIMESTAMPS", True),
+    "condition_on_previous_text": _env_bool("WHISPER_CONDITION_ON_PREVIOUS_TEXT", False),
+    "initial_prompt": os.getenv("WHISPER_INITIAL_PROMPT", DEFAULT_INITIAL_PROMPT) or None,
+    # auto: 超过 LONG_AUDIO_SECONDS 时启用长音频模式；也可以强制开启(true)或关闭(false)
+    "long_audio": "auto",
+}
+
+# 温度回退的步长，与 whisper 默认值一致
+TEMPERATURE_STEP = 0.2
+
+def parse_decode_options(values) -> dict:
+    """
+    从请求参数（字符串字典）解析解码选项，未提供的使用默认值。
+    参数无效时抛出 ValueError
+    """
+    options = dict(DEFAULT_DECODE_OPTIONS)
+    if not values:
+        return options
+
+    if "language" in values:
+        language = values["language"].strip().lower()
+        if language in ("", "auto"):
+            options["language"] = None
+        elif language not in LANGUAGES and language not in TO_LANGUAGE_CODE:
+            raise ValueError(f"不支持的语言: {language}")
+        else:
+            options["language"] = TO_LANGUAGE_CODE.get(language, language)
+    if "beam_size" in values:
+        options["beam_size"] = int(values["beam_size"])
+        if options["beam_size"] < 0:
+            raise ValueError("beam_size 不能小于 0")
+    if "temperature_max" in values:
+        options["temperature_max"] = float(values["temperature_max"])
+        if not 0 <= options["temperature_max"] <= 1:
+            raise ValueError("temperature_max 必须在 0 到 1 之间")
+    for key in ("without_timestamps", "condition_on_previous_text"):
+        if key in values:
+            options[key] = str(values[key]).strip().lower() in ("1", "true", "yes", "on")
+    if "initial_prompt" in values:
+        options["initial_prompt"] = values["initial_prompt"] or None
+    if "long_audio" in values:
+        long_audio = str(values["long_audio"]).strip().lower()
+        if long_audio in ("1", "true", "yes", "on"):
+            options["long_audio"] = "true"
+        elif long_audio in ("0", "false", "no", "off"):
+            options["long_audio"] = "false"
+        elif long_audio == "auto":
+            options["long_audio"] = "auto"
+        else:
+            raise ValueError(f"long_audio 只能是 auto、true 或 false: {long_audio}")
+    return options
+
+def _transcribe_kwargs(options: dict) -> dict:
+    """
+    将解码选项转换为 model.transcribe 的参数
+    """
+    steps = int(round(options["temperature_max"] / TEMPERATURE_STEP))
+    temperature = tuple(round(i * TEMPERATURE_STEP, 1) for i in range(steps + 1)) if steps > 0 else 0.0
+    kwargs = {
+        "fp16": False,  # 显式指定fp16=False以避免FP16警告
+        "language": options["language"],
+        "temperature": temperature,
+        "without_timestamps": options["without_timestamps"],
+        "condition_on_previous_text": options["condition_on_previous_text"],
+        "initial_prompt": options["initial_prompt"],
+    }
+    if options["beam_size"] > 0:
+        kwargs["beam_size"] = options["beam_size"]
+    return kwargs
+
+def split_on_silence(audio, chunk_seconds: float = CHUNK_LENGTH, search_seconds: float = SILENCE_SEARCH_SECONDS):
+    """
+    将音频切分为不超过 chunk_seconds 的片段，切点选在每个窗口末尾附近能量最低的位置，
+    避免把一个字切成两半。返回 [(起始采样点, 结束采样点)]
+    """
+    chunk_samples = int(chunk_seconds * SAMPLE_RATE)
+    search_samples = int(search_seconds * SAMPLE_RATE)
+    frame = int(0.02 * SAMPLE_RATE)  # 20ms 一帧
+
+    boundaries = [0]
+    position = 0
+    while len(audio) - position > chunk_samples:
+        end = position + chunk_samples
+        start = max(end - search_samples, position + frame)
+        frames = (end - start) // frame
+        window = audio[start:start + frames * frame].reshape(frames, frame)
+        quietest = int(np.argmin((window ** 2).mean(axis=1)))
+        position = start + quietest * frame + frame // 2
+        boundaries.append(position)
+    boundaries.append(len(audio))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _transcribe_audio(pool, audio, options: dict, cancel_token=None) -> dict:
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    with pool.borrow() as replica:
+        return replica.transcribe(audio, **_transcribe_kwargs(options))
+
+def _transcribe_long(pool, audio, options: dict, progress_callback=None, cancel_token=None) -> dict:
+    """
+    长音频模式：按静音切分，多个模型副本并行识别，再按顺序拼接文本和时间戳。
+    取消后尚未开始的分块直接跳过
+    """
+    chunks = split_on_silence(audio)
+    results = [None] * len(chunks)
+    if progress_callback:
+        progress_callback(0, len(chunks))
+
+    with ThreadPoolExecutor(max_workers=min(WHISPER_WORKERS, len(chunks)),
+                            thread_name_prefix="whisper-chunk") as executor:
+        futures = {
+            executor.submit(_transcribe_audio, pool, audio[start:end], options, cancel_token): index
+            for index, (start, end) in enumerate(chunks)
+        }
+        done = 0
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(chunks))
+
+    # 拼接：片段时间戳加上所在分块的起始偏移
+    segments = []
+    for (start, _), result in zip(chunks, results):
+        offset = start / SAMPLE_RATE
+        for seg in result.get("segments", []):
+            seg = dict(seg)
+            seg["start"] += offset
+            seg["end"] += offset
+            segments.append(seg)
+    language = results[0].get("language") if results else options["language"]
+    separator = "" if language in ("zh", "ja") else " "
+    text = separator.join(r["text"].strip() for r in results if r["text"].strip())
+    return {"text": text, "language": language, "segments": segments, "chunks": len(chunks)}
+
+def transcribe(file_path, options: dict = None, progress_callback=None, cancel_token=None,
+               model_name: str = None) -> dict:
+    """
+    识别音频并返回文本和解码信息（使用的选项、检测到的语言、触发的温度回退）。
+    file_path 也可以是已解码的 16kHz float32 音频数组（WebSocket 增量解码的结果）。
+    长音频会切分后并行识别，progress_callback(已完成分块数, 总分块数) 用于报告进度。
+    model_name 指定改用其他模型（过载降级），备用模型加载完成前使用当前模型。
+    任务被取消时抛出 JobCancelled
+    """
+    options = options or dict(DEFAULT_DECODE_OPTIONS)
+    audio = whisper.load_audio(file_path) if isinstance(file_path, str) else file_path
+    duration = len(audio) / SAMPLE_RATE
+
+    # 整个任务（包括长音频的所有分块）使用同一个模型，热切换不影响进行中的任务
+    pool = _pool_for(model_name)
+    long_audio = options.get("long_audio", "auto")
+    if long_audio == "true" or (long_audio == "auto" and duration > LONG_AUDIO_SECONDS):
+        result = _transcribe_long(pool, audio, options, progress_callback, cancel_token)
+    else:
+        result = _transcribe_audio(pool, audio, options, cancel_token)
+        result["chunks"] = 1
+
+    # 每个片段记录了最终采用的温度，大于 0 说明该片段触发了温度回退
+    segments = result.get("segments", [])
+    fallback_temperatures = [seg["temperature"] for seg in segments if seg.get("temperature", 0) > 0]
     text = result["text"].strip()
-    # 确保返回的文本不为空
-    if not text:
-        return "（未识别到内容）"
-    return text
\ No newline at end of file
+    return {
+        # 确保返回的文本不为空
+        "text": text or "（未识别到内容）",
+        "language": result.get("language"),
+        "duration": round(duration, 2),
+        "segments": [
+            {"start": round(seg["start"], 2), "end": round(seg["end"], 2), "text": seg["text"].strip()}
+            for seg in segments
+        ],
+        "decode": {
+            "options": options,
+            "language_detected": options["language"] is None,
+            "model": pool.name,
+            "chunks": result["chunks"],
+            "segments": len(segments),
+            "temperature_fallbacks": len(fallback_temperatures),
+            "max_temperature_used": max(fallback_temperatures, default=0.0),
+        },
+    }
+
+def speech_to_text(file_path: str, options: dict = None) -> str:
+    return transcribe(file_path, options)["text"]
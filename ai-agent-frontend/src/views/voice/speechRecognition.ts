@@ -16,6 +16,9 @@ export interface SpeechRecognitionResponse {
   stt_result_id: string
 }
 
+// 后端 /speech 可直接接收的原始音频类型
+const RAW_AUDIO_MIME_TYPES = ['audio/webm', 'audio/ogg', 'audio/l16']
+
 export class SpeechRecognitionService {
   private baseUrl: string
   private maxRetries: number
@@ -33,16 +36,27 @@ export class SpeechRecognitionService {
    * @returns Promise<SpeechRecognitionResponse>
    */
   async recognizeSpeech(audioBlob: Blob): Promise<SpeechRecognitionResponse> {
-    const formData = new FormData()
-    formData.append('audio', audioBlob)
+    // 后端支持的原始音频类型直接作为请求体发送，避免 multipart 解析和落盘
+    const mimeType = audioBlob.type.split(';')[0].trim().toLowerCase()
+    const sendRaw = RAW_AUDIO_MIME_TYPES.includes(mimeType)
+    let body: Blob | FormData = audioBlob
+    const headers: Record<string, string> = {}
+    if (sendRaw) {
+      headers['Content-Type'] = audioBlob.type
+    } else {
+      const formData = new FormData()
+      formData.append('audio', audioBlob)
+      body = formData
+    }
 
     console.log('🎤 发送语音识别请求到:', `${this.baseUrl}/speech`)
-    console.log('🎤 音频文件大小:', audioBlob.size, 'bytes')
+    console.log('🎤 音频文件大小:', audioBlob.size, 'bytes', sendRaw ? '(原始音频流)' : '(multipart)')
 
     try {
       const response = await fetch(`${this.baseUrl}/speech`, {
         method: 'POST',
-        body: formData,
+        headers,
+        body,
         mode: 'cors'
       })
 